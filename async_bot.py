@@ -0,0 +1,1093 @@
+"""
+Асинхронная версия Telegram-бота (AsyncTeleBot)
+
+Поведение и тексты совпадают с bot.py. Запросы к Telegram и к API курсов
+выполняются асинхронно (aiohttp), обращения к SQLite — в пуле потоков
+(AsyncDatabase), поэтому один процесс обслуживает тысячи чатов
+одновременно. Обновления одного пользователя обрабатываются по очереди
+(см. serialized), разных пользователей — параллельно.
+
+Запуск:
+    python async_bot.py
+"""
+import asyncio
+import functools
+import os
+import tempfile
+import uuid
+import weakref
+from decimal import Decimal
+from typing import List, Optional, Tuple
+
+import aiohttp
+from dotenv import load_dotenv
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+
+from database import AsyncDatabase, Database
+from export import export_filename, parse_export_args, write_export
+from importer import MAX_FILE_SIZE, import_expenses
+from fsm import Router
+import metrics
+from metrics import HANDLER_SECONDS, timed
+from currency_api import async_convert_currency, async_validate_pair_and_quote, init_supported_currencies
+from country_resolver import Country, get_country, resolve as resolve_country
+from money import normalize_rate, parse_amount, parse_expense_lines, quantize
+from provider_client import get_async_client
+from user_state import (
+    get_user_state, set_user_state, clear_user_state, init_state_store, close_state_store,
+    preload_user_state
+)
+from views import (
+    WELCOME_TEXT, NEW_TRIP_TEXT, NO_USER_TEXT, NO_TRIPS_TEXT, NO_ACTIVE_TRIP_TEXT,
+    NO_ACTIVE_TRIP_HINT_TEXT, UNKNOWN_COMMAND_TEXT, HISTORY_PAGE_SIZE,
+    format_number, create_main_menu, create_back_keyboard, create_yes_no_keyboard,
+    country_suggestions, trips_list, balance_text, history_page, stats_text, export_caption,
+    import_prompt_text, import_summary_text,
+    change_rate_text, rate_offer_text, initial_amount_prompt, trip_created_text,
+    expense_prompt_text, expense_saved_text, bulk_expense_prompt_text, bulk_expense_saved_text,
+    rate_updated_text
+)
+
+load_dotenv()
+
+BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+if not BOT_TOKEN:
+    raise ValueError("TELEGRAM_BOT_TOKEN не найден в переменных окружения!")
+
+# Число потоков для запросов к SQLite
+DB_WORKERS = int(os.getenv("DB_WORKERS", "4"))
+
+# Пользователи, которым доступна команда /metrics
+ADMIN_IDS = metrics.admin_ids()
+
+bot = AsyncTeleBot(BOT_TOKEN)
+db = AsyncDatabase(Database(), max_workers=DB_WORKERS)
+init_state_store(db.db)
+# Маршрутизация текста по состоянию FSM и нажатий по callback_data
+router = Router()
+router.ignore("waiting_rate_confirmation", "waiting_expense_confirmation",
+              "waiting_bulk_expense_confirmation")
+router.set_timing_hook(metrics.fsm_timing_hook)
+metrics.instrument_telegram()
+
+# Блокировки по user_id: существуют, пока их ждёт хотя бы один обработчик
+_user_locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def _user_lock(user_id: int) -> asyncio.Lock:
+    lock = _user_locks.get(user_id)
+    if lock is None:
+        lock = _user_locks[user_id] = asyncio.Lock()
+    return lock
+
+
+def serialized(handler):
+    """
+    Последовательная обработка обновлений одного пользователя
+
+    AsyncTeleBot запускает обработчики параллельно; без блокировки два
+    быстрых сообщения одного пользователя могли бы перепутать шаги FSM.
+    """
+    @functools.wraps(handler)
+    async def wrapper(update):
+        user = getattr(update, "from_user", None)
+        if user is None:
+            return await handler(update)
+        async with _user_lock(user.id):
+            # Состояние из SQLite читается в потоке базы, а не в цикле событий
+            await preload_user_state(user.id, db._run)
+            return await handler(update)
+    return wrapper
+
+
+async def send_main_menu(chat_id: int, text: str = "🏠 Главное меню"):
+    """Отправка главного меню"""
+    await bot.send_message(chat_id, text, reply_markup=create_main_menu())
+
+
+@bot.message_handler(commands=['start'])
+@serialized
+@timed(HANDLER_SECONDS)
+async def start_command(message):
+    """Обработка команды /start"""
+    user_id = message.from_user.id
+    username = message.from_user.username
+
+    await db.add_user(user_id, username)
+    clear_user_state(user_id)
+
+    await send_main_menu(message.chat.id, WELCOME_TEXT)
+
+
+@bot.message_handler(commands=['newtrip', 'switch', 'balance', 'history', 'stats', 'export',
+                               'import', 'setrate'])
+@serialized
+@timed(HANDLER_SECONDS)
+async def handle_commands(message):
+    """Обработка команд меню"""
+    command = message.text.split()[0][1:]  # Убираем /
+
+    if command == "newtrip":
+        await start_new_trip(message)
+    elif command == "switch":
+        await show_trips_list(message)
+    elif command == "balance":
+        await show_balance(message)
+    elif command == "history":
+        await show_history(message)
+    elif command == "stats":
+        await show_stats(message)
+    elif command == "export":
+        await send_export(message)
+    elif command == "import":
+        await start_import(message)
+    elif command == "setrate":
+        await start_change_rate(message)
+
+
+@router.callback("new_trip")
+async def callback_new_trip(call):
+    """Обработка нажатия на кнопку создания путешествия"""
+    user_id = call.from_user.id
+    set_user_state(user_id, "waiting_from_country")
+    await bot.answer_callback_query(call.id)
+    await bot.send_message(call.message.chat.id, NEW_TRIP_TEXT)
+
+
+async def start_new_trip(message):
+    """Начало создания нового путешествия"""
+    if not hasattr(message, 'from_user') or not message.from_user:
+        await bot.send_message(message.chat.id, NO_USER_TEXT)
+        return
+
+    user_id = message.from_user.id
+    set_user_state(user_id, "waiting_from_country")
+    await bot.send_message(message.chat.id, NEW_TRIP_TEXT)
+
+
+@router.callback("my_trips")
+async def callback_my_trips(call):
+    """Обработка нажатия на кнопку 'Мои путешествия'"""
+    user_id = call.from_user.id
+    trips = await db.get_user_trips(user_id)
+
+    await bot.answer_callback_query(call.id)
+    if not trips:
+        await bot.send_message(call.message.chat.id, NO_TRIPS_TEXT, reply_markup=create_main_menu())
+        return
+
+    trips_text, keyboard = trips_list(trips)
+    await bot.send_message(call.message.chat.id, trips_text, reply_markup=keyboard)
+
+
+async def show_trips_list(message):
+    """Показать список путешествий пользователя"""
+    if not hasattr(message, 'from_user') or not message.from_user:
+        await bot.send_message(message.chat.id, NO_USER_TEXT)
+        return
+
+    trips = await db.get_user_trips(message.from_user.id)
+
+    if not trips:
+        await bot.send_message(message.chat.id, NO_TRIPS_TEXT, reply_markup=create_main_menu())
+        return
+
+    trips_text, keyboard = trips_list(trips)
+    await bot.send_message(message.chat.id, trips_text, reply_markup=keyboard)
+
+
+@router.callback(prefix="switch_trip_")
+async def callback_switch_trip(call):
+    """Переключение активного путешествия"""
+    user_id = call.from_user.id
+    trip_id = int(call.data.split("_")[2])
+
+    await db.switch_trip(user_id, trip_id)
+    await bot.answer_callback_query(call.id, "✅ Путешествие активировано!")
+
+    # Показываем обновленный список путешествий
+    trips = await db.get_user_trips(user_id)
+
+    if not trips:
+        await bot.send_message(call.message.chat.id, NO_TRIPS_TEXT, reply_markup=create_main_menu())
+        return
+
+    trips_text, keyboard = trips_list(trips)
+    await bot.send_message(call.message.chat.id, trips_text, reply_markup=keyboard)
+
+
+@router.callback("balance")
+async def callback_balance(call):
+    """Обработка нажатия на кнопку 'Баланс'"""
+    trip = await db.get_active_trip(call.from_user.id)
+
+    await bot.answer_callback_query(call.id)
+    if not trip:
+        await bot.send_message(call.message.chat.id, NO_ACTIVE_TRIP_HINT_TEXT,
+                               reply_markup=create_main_menu())
+        return
+
+    await bot.send_message(call.message.chat.id, balance_text(trip), reply_markup=create_back_keyboard())
+
+
+async def show_balance(message):
+    """Показать баланс активного путешествия"""
+    if not hasattr(message, 'from_user') or not message.from_user:
+        await bot.send_message(message.chat.id, NO_USER_TEXT)
+        return
+
+    trip = await db.get_active_trip(message.from_user.id)
+
+    if not trip:
+        await bot.send_message(message.chat.id, NO_ACTIVE_TRIP_HINT_TEXT,
+                               reply_markup=create_main_menu())
+        return
+
+    await bot.send_message(message.chat.id, balance_text(trip), reply_markup=create_back_keyboard())
+
+
+@router.callback("history")
+async def callback_history(call):
+    """Обработка нажатия на кнопку 'История расходов'"""
+    trip = await db.get_active_trip(call.from_user.id)
+
+    if not trip:
+        await bot.answer_callback_query(call.id)
+        await bot.send_message(call.message.chat.id, NO_ACTIVE_TRIP_TEXT,
+                               reply_markup=create_main_menu())
+        return
+
+    page = await db.get_expenses_page(trip['id'], HISTORY_PAGE_SIZE)
+    text, keyboard = history_page(trip, page)
+
+    await bot.answer_callback_query(call.id)
+    await bot.send_message(call.message.chat.id, text, reply_markup=keyboard)
+
+
+async def show_history(message):
+    """Показать историю расходов"""
+    if not hasattr(message, 'from_user') or not message.from_user:
+        await bot.send_message(message.chat.id, NO_USER_TEXT)
+        return
+
+    trip = await db.get_active_trip(message.from_user.id)
+
+    if not trip:
+        await bot.send_message(message.chat.id, NO_ACTIVE_TRIP_TEXT, reply_markup=create_main_menu())
+        return
+
+    page = await db.get_expenses_page(trip['id'], HISTORY_PAGE_SIZE)
+    text, keyboard = history_page(trip, page)
+
+    await bot.send_message(message.chat.id, text, reply_markup=keyboard)
+
+
+@router.callback(prefix="hist_")
+async def callback_history_page(call):
+    """Переход по страницам истории: hist_<before|after>_<trip_id>_<id>_<created_at>"""
+    _, direction, trip_id, expense_id, created_at = call.data.split("_", 4)
+    trip = await db.get_active_trip(call.from_user.id)
+    await bot.answer_callback_query(call.id)
+
+    if not trip:
+        await bot.send_message(call.message.chat.id, NO_ACTIVE_TRIP_TEXT,
+                               reply_markup=create_main_menu())
+        return
+
+    # Кнопки от другого путешествия (пользователь переключился) —
+    # показываем начало истории текущего
+    cursor = {}
+    if trip['id'] == int(trip_id) and direction in ("before", "after"):
+        cursor[direction] = (created_at, int(expense_id))
+    page = await db.get_expenses_page(trip['id'], HISTORY_PAGE_SIZE, **cursor)
+    text, keyboard = history_page(trip, page)
+
+    await bot.edit_message_text(text, call.message.chat.id, call.message.message_id,
+                               reply_markup=keyboard)
+
+
+@router.callback("stats")
+async def callback_stats(call):
+    """Обработка нажатия на кнопку 'Статистика'"""
+    trip = await db.get_active_trip(call.from_user.id)
+
+    await bot.answer_callback_query(call.id)
+    if not trip:
+        await bot.send_message(call.message.chat.id, NO_ACTIVE_TRIP_HINT_TEXT,
+                               reply_markup=create_main_menu())
+        return
+
+    stats = await db.get_trip_stats(trip['id'])
+    await bot.send_message(call.message.chat.id, stats_text(trip, stats),
+                           reply_markup=create_back_keyboard())
+
+
+async def show_stats(message):
+    """Показать статистику расходов активного путешествия"""
+    if not hasattr(message, 'from_user') or not message.from_user:
+        await bot.send_message(message.chat.id, NO_USER_TEXT)
+        return
+
+    trip = await db.get_active_trip(message.from_user.id)
+
+    if not trip:
+        await bot.send_message(message.chat.id, NO_ACTIVE_TRIP_HINT_TEXT,
+                               reply_markup=create_main_menu())
+        return
+
+    stats = await db.get_trip_stats(trip['id'])
+    await bot.send_message(message.chat.id, stats_text(trip, stats),
+                           reply_markup=create_back_keyboard())
+
+
+async def send_export(message):
+    """Выгрузка расходов файлом: активное путешествие или все (/export all), CSV или JSON Lines"""
+    if not hasattr(message, 'from_user') or not message.from_user:
+        await bot.send_message(message.chat.id, NO_USER_TEXT)
+        return
+
+    user_id = message.from_user.id
+    fmt, all_trips = parse_export_args(message.text.split()[1:])
+
+    trip = None
+    if not all_trips:
+        trip = await db.get_active_trip(user_id)
+        if not trip:
+            await bot.send_message(message.chat.id, NO_ACTIVE_TRIP_HINT_TEXT,
+                                   reply_markup=create_main_menu())
+            return
+
+    # Чтение базы и сжатие — в пуле потоков, целиком в одном потоке (курсор
+    # принадлежит соединению потока); в памяти — только текущая пачка строк
+    loop = asyncio.get_running_loop()
+    with tempfile.TemporaryFile() as f:
+        count = await loop.run_in_executor(None, write_export, db.db, user_id, f, fmt,
+                                           trip['id'] if trip else None)
+        f.seek(0)
+        await bot.send_document(message.chat.id, f, caption=export_caption(count, trip),
+                                visible_file_name=export_filename(fmt, trip))
+
+
+async def start_import(message):
+    """Начало импорта расходов из CSV-выписки"""
+    if not hasattr(message, 'from_user') or not message.from_user:
+        await bot.send_message(message.chat.id, NO_USER_TEXT)
+        return
+
+    user_id = message.from_user.id
+    trip = await db.get_active_trip(user_id)
+
+    if not trip:
+        await bot.send_message(message.chat.id, NO_ACTIVE_TRIP_HINT_TEXT,
+                               reply_markup=create_main_menu())
+        return
+
+    set_user_state(user_id, "waiting_import_file", {"trip_id": trip['id']})
+    await bot.send_message(message.chat.id, import_prompt_text(trip),
+                           reply_markup=create_back_keyboard())
+
+
+async def download_document(file_id: str, fileobj):
+    """Скачивание файла из Telegram в fileobj частями (файл не читается в память целиком)"""
+    file_path = (await bot.get_file(file_id)).file_path
+    url = (asyncio_helper.FILE_URL or "https://api.telegram.org/file/bot{0}/{1}").format(BOT_TOKEN,
+                                                                                          file_path)
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60)) as session:
+        async with session.get(url) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                fileobj.write(chunk)
+
+
+@bot.message_handler(content_types=['document'])
+@serialized
+@timed(HANDLER_SECONDS)
+async def handle_document(message):
+    """Файл выписки для /import"""
+    if not hasattr(message, 'from_user') or not message.from_user:
+        return
+
+    user_id = message.from_user.id
+    state_data = get_user_state(user_id)
+
+    if state_data.get("state") != "waiting_import_file":
+        await send_main_menu(message.chat.id, "📎 Чтобы загрузить расходы из выписки, отправьте /import")
+        return
+
+    if (message.document.file_size or 0) > MAX_FILE_SIZE:
+        await bot.send_message(message.chat.id, "❌ Файл больше 20 МБ. Разделите выписку на части.",
+                               reply_markup=create_back_keyboard())
+        return
+
+    trip = await db.get_active_trip(user_id)
+    if not trip or trip['id'] != state_data.get("data", {}).get("trip_id"):
+        clear_user_state(user_id)
+        await send_main_menu(message.chat.id, NO_ACTIVE_TRIP_HINT_TEXT)
+        return
+
+    # Файл скачивается на диск; разбор и запись в базу — в пуле потоков,
+    # целиком в одном потоке (соединение базы принадлежит потоку)
+    loop = asyncio.get_running_loop()
+    with tempfile.TemporaryFile() as f:
+        await download_document(message.document.file_id, f)
+        f.seek(0)
+        try:
+            summary = await loop.run_in_executor(None, import_expenses, db.db, trip, f)
+        except ValueError as e:
+            await bot.send_message(message.chat.id,
+                                   f"❌ Не удалось прочитать выписку: {e}\n\nОтправьте другой файл.",
+                                   reply_markup=create_back_keyboard())
+            return
+
+    clear_user_state(user_id)
+    await send_main_menu(message.chat.id,
+                         import_summary_text(await db.get_active_trip(user_id), summary))
+
+
+@router.state("waiting_import_file")
+async def handle_import_text(message, text: str):
+    """Текст вместо файла выписки: импорт отменяется, текст обрабатывается как обычно"""
+    clear_user_state(message.from_user.id)
+    await handle_free_text(message, text)
+
+
+@router.callback("change_rate")
+async def callback_change_rate(call):
+    """Обработка нажатия на кнопку 'Изменить курс'"""
+    user_id = call.from_user.id
+    trip = await db.get_active_trip(user_id)
+
+    await bot.answer_callback_query(call.id)
+    if not trip:
+        await bot.send_message(call.message.chat.id, NO_ACTIVE_TRIP_TEXT,
+                               reply_markup=create_main_menu())
+        return
+
+    set_user_state(user_id, "waiting_new_rate", {"trip_id": trip['id']})
+    await bot.send_message(call.message.chat.id, change_rate_text(trip))
+
+
+async def start_change_rate(message):
+    """Начало изменения курса"""
+    if not hasattr(message, 'from_user') or not message.from_user:
+        await bot.send_message(message.chat.id, NO_USER_TEXT)
+        return
+
+    user_id = message.from_user.id
+    trip = await db.get_active_trip(user_id)
+
+    if not trip:
+        await bot.send_message(message.chat.id, NO_ACTIVE_TRIP_TEXT, reply_markup=create_main_menu())
+        return
+
+    set_user_state(user_id, "waiting_new_rate", {"trip_id": trip['id']})
+    await bot.send_message(message.chat.id, change_rate_text(trip))
+
+
+@router.callback("main_menu")
+async def callback_main_menu(call):
+    """Обработка нажатия на кнопку 'Главное меню'"""
+    await send_main_menu(call.message.chat.id)
+
+
+@bot.message_handler(commands=['metrics'])
+@timed(HANDLER_SECONDS)
+async def metrics_command(message):
+    """Сводка времени выполнения (только для ADMIN_IDS)"""
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    for part in metrics.split_message(metrics.summary_text()):
+        await bot.send_message(message.chat.id, part)
+
+
+@bot.message_handler(func=lambda message: True)
+@serialized
+@timed(HANDLER_SECONDS)
+async def handle_message(message):
+    """Обработка всех текстовых сообщений"""
+    if not hasattr(message, 'from_user') or not message.from_user:
+        return
+
+    user_id = message.from_user.id
+    text = message.text.strip()
+
+    state_data = get_user_state(user_id)
+    state = state_data.get("state")
+
+    # Проверяем команду /skip для пропуска наименования расхода
+    if text.lower() == "/skip":
+        if state == "waiting_expense_description":
+            await router.dispatch_message_async(state, message, text)
+        return
+
+    # Команды обрабатываются отдельно
+    if text.startswith('/'):
+        return
+
+    await router.dispatch_message_async(state, message, text)
+
+
+@bot.callback_query_handler(func=lambda call: True)
+@serialized
+@timed(HANDLER_SECONDS)
+async def handle_callback(call):
+    """Обработка нажатий: обработчик выбирается по callback_data из таблицы router"""
+    await router.dispatch_callback_async(call)
+
+
+@router.default
+async def handle_free_text(message, text: str):
+    """Текст вне диалога: число считается расходом, строки "сумма описание" — списком расходов"""
+    amount = parse_amount(text)
+    if amount is not None:
+        await handle_expense_input(message, amount)
+        return
+    expenses = parse_expense_lines(text)
+    if expenses:
+        await handle_bulk_expense_input(message, expenses)
+    else:
+        await send_main_menu(message.chat.id, UNKNOWN_COMMAND_TEXT)
+
+
+async def resolve_country_or_ask(chat_id: int, country_name: str, retry_text: str) -> Optional[Country]:
+    """Страна по вводу пользователя; если не определена — просим уточнить"""
+    query = country_name.strip()
+    resolution = resolve_country(query)
+    # Без валюты (Антарктика) страну выбрать нельзя
+    candidates = [country for country in resolution.candidates if country.currency]
+    if candidates:
+        text, keyboard = country_suggestions(query, candidates)
+        await bot.send_message(chat_id, text, reply_markup=keyboard)
+        return None
+    if not resolution.found or not resolution.country.currency:
+        await bot.send_message(
+            chat_id,
+            f"❌ Не удалось определить валюту для страны '{query}'.\n\n" + retry_text
+        )
+        return None
+    return resolution.country
+
+
+@router.callback(prefix="country_")
+async def callback_country(call):
+    """Выбор страны из предложенных вариантов"""
+    user_id = call.from_user.id
+    country = get_country(call.data[len("country_"):])
+    state = get_user_state(user_id).get("state")
+    select = {
+        "waiting_from_country": select_from_country,
+        "waiting_to_country": select_to_country
+    }.get(state)
+    if country is None or select is None:
+        await bot.answer_callback_query(call.id, "❌ Ошибка состояния")
+        return
+    await bot.answer_callback_query(call.id)
+    await select(call.message.chat.id, user_id, country)
+
+
+@router.state("waiting_from_country")
+async def handle_from_country(message, country_name: str):
+    """Обработка ввода страны отправления"""
+    country = await resolve_country_or_ask(
+        message.chat.id, country_name,
+        "Пожалуйста, введите название страны ещё раз (например: Россия, Russia, RU):"
+    )
+    if country:
+        await select_from_country(message.chat.id, message.from_user.id, country)
+
+
+async def select_from_country(chat_id: int, user_id: int, country: Country):
+    """Страна отправления выбрана: запрашиваем страну назначения"""
+    set_user_state(user_id, "waiting_to_country", {
+        "from_country": country.name_ru,
+        "from_currency": country.currency
+    })
+
+    await bot.send_message(
+        chat_id,
+        f"✅ Страна отправления: {country.name_ru} ({country.currency})\n\n"
+        "Введите страну назначения (например: Китай, China, CN):"
+    )
+
+
+@router.state("waiting_to_country")
+async def handle_to_country(message, country_name: str):
+    """Обработка ввода страны назначения"""
+    country = await resolve_country_or_ask(
+        message.chat.id, country_name, "Пожалуйста, введите название страны ещё раз:"
+    )
+    if country:
+        await select_to_country(message.chat.id, message.from_user.id, country)
+
+
+async def select_to_country(chat_id: int, user_id: int, country: Country):
+    """Страна назначения выбрана: получаем курс и просим его подтвердить"""
+    state_data = get_user_state(user_id)
+    data = state_data.get("data", {})
+    from_country = data.get("from_country")
+    from_currency = data.get("from_currency")
+
+    if not from_country or not from_currency:
+        await bot.send_message(
+            chat_id,
+            "❌ Ошибка состояния. Начните создание путешествия заново.",
+            reply_markup=create_main_menu()
+        )
+        clear_user_state(user_id)
+        return
+
+    currency = country.currency
+
+    if currency == from_currency:
+        await bot.send_message(
+            chat_id,
+            "❌ Валюты стран отправления и назначения совпадают.\n\n"
+            "Введите другую страну назначения:"
+        )
+        return
+
+    to_currency = currency
+
+    # Проверяем доступность валют и получаем курс одним запросом
+    rate_data = await async_validate_pair_and_quote(from_currency, to_currency)
+
+    if not rate_data["from_available"]:
+        await bot.send_message(
+            chat_id,
+            f"❌ Валюта {from_currency} недоступна в API.\n\n"
+            "Пожалуйста, начните создание путешествия заново.",
+            reply_markup=create_main_menu()
+        )
+        clear_user_state(user_id)
+        return
+
+    if not rate_data["to_available"]:
+        await bot.send_message(
+            chat_id,
+            f"❌ Валюта {to_currency} недоступна в API.\n\n"
+            "Пожалуйста, введите другую страну назначения:"
+        )
+        return
+
+    if not rate_data["success"]:
+        error_msg = rate_data.get("error", "Неизвестная ошибка")
+        await bot.send_message(
+            chat_id,
+            f"❌ Ошибка при получении курса обмена: {error_msg}\n\n"
+            "Пожалуйста, попробуйте позже или начните заново.",
+            reply_markup=create_main_menu()
+        )
+        clear_user_state(user_id)
+        return
+
+    rate = normalize_rate(rate_data["rate"])
+
+    set_user_state(user_id, "waiting_rate_confirmation", {
+        "from_country": from_country,
+        "to_country": country.name_ru,
+        "from_currency": from_currency,
+        "to_currency": to_currency,
+        "rate": rate,
+        "quote": {
+            "quote_id": rate_data["quote_id"],
+            "timestamp": rate_data["timestamp"],
+            "rate": rate,
+            "source": from_currency,
+            "target": to_currency
+        }
+    })
+
+    await bot.send_message(
+        chat_id,
+        rate_offer_text(from_currency, to_currency, rate),
+        reply_markup=create_yes_no_keyboard("rate_yes", "rate_no")
+    )
+
+
+@router.callback("rate_yes")
+async def callback_rate_yes(call):
+    """Подтверждение курса"""
+    user_id = call.from_user.id
+    state_data = get_user_state(user_id)
+
+    if state_data.get("state") != "waiting_rate_confirmation":
+        await bot.answer_callback_query(call.id, "❌ Ошибка состояния")
+        return
+
+    data = state_data.get("data", {})
+    if not data:
+        await bot.answer_callback_query(call.id, "❌ Ошибка данных")
+        return
+
+    set_user_state(user_id, "waiting_initial_amount", data)
+
+    await bot.edit_message_text(
+        f"✅ Курс подтверждён!\n\n"
+        f"{initial_amount_prompt(data['from_currency'])}",
+        call.message.chat.id,
+        call.message.message_id
+    )
+
+
+@router.callback("rate_no")
+async def callback_rate_no(call):
+    """Отказ от курса, запрос ручного ввода"""
+    user_id = call.from_user.id
+    state_data = get_user_state(user_id)
+
+    if state_data.get("state") != "waiting_rate_confirmation":
+        await bot.answer_callback_query(call.id, "❌ Ошибка состояния")
+        return
+
+    data = state_data.get("data", {})
+    if not data:
+        await bot.answer_callback_query(call.id, "❌ Ошибка данных")
+        return
+    set_user_state(user_id, "waiting_manual_rate", data)
+
+    await bot.edit_message_text(
+        f"Введите курс обмена вручную:\n"
+        f"Сколько {data['to_currency']} за 1 {data['from_currency']}?",
+        call.message.chat.id,
+        call.message.message_id
+    )
+
+
+@router.state("waiting_manual_rate")
+async def handle_manual_rate(message, rate_text: str):
+    """Обработка ручного ввода курса"""
+    user_id = message.from_user.id
+    rate = parse_amount(rate_text)
+
+    if rate is None:
+        await bot.send_message(message.chat.id, "❌ Пожалуйста, введите число (например: 12.5 или 12,5):")
+        return
+
+    rate = normalize_rate(rate)
+
+    if rate <= 0:
+        await bot.send_message(message.chat.id, "❌ Курс должен быть положительным числом. Введите ещё раз:")
+        return
+
+    state_data = get_user_state(user_id)
+    data = state_data["data"]
+    data["rate"] = rate
+    # Курс, введённый вручную, не заменяется курсом из API
+    data["quote"] = {
+        "quote_id": uuid.uuid4().hex,
+        "rate": rate,
+        "source": data["from_currency"],
+        "target": data["to_currency"],
+        "manual": True
+    }
+    set_user_state(user_id, "waiting_initial_amount", data)
+
+    await bot.send_message(
+        message.chat.id,
+        f"✅ Курс установлен: 1 {data['from_currency']} = {format_number(rate)} {data['to_currency']}\n\n"
+        f"{initial_amount_prompt(data['from_currency'])}"
+    )
+
+
+@router.state("waiting_initial_amount")
+async def handle_initial_amount(message, amount_text: str):
+    """Обработка ввода начальной суммы"""
+    user_id = message.from_user.id
+    amount_from = parse_amount(amount_text)
+
+    if amount_from is None:
+        await bot.send_message(message.chat.id, "❌ Пожалуйста, введите число (например: 1000 или 1000,50):")
+        return
+
+    if amount_from <= 0:
+        await bot.send_message(message.chat.id, "❌ Сумма должна быть положительным числом. Введите ещё раз:")
+        return
+
+    state_data = get_user_state(user_id)
+    data = state_data.get("data", {})
+
+    if not data or "from_currency" not in data or "to_currency" not in data:
+        await bot.send_message(
+            message.chat.id,
+            "❌ Ошибка состояния. Начните создание путешествия заново.",
+            reply_markup=create_main_menu()
+        )
+        clear_user_state(user_id)
+        return
+
+    amount_from = quantize(amount_from, data["from_currency"])
+    rate = normalize_rate(data.get("rate", 1))
+    quote = data.get("quote")
+
+    # Конвертируем по подтверждённой котировке; к API обращаемся,
+    # только если она устарела
+    conversion = await async_convert_currency(amount_from, data["from_currency"],
+                                              data["to_currency"], quote=quote)
+
+    if not conversion or not conversion.get("success"):
+        # Используем сохранённый курс, если API недоступен
+        amount_to = quantize(amount_from * rate, data["to_currency"])
+        await bot.send_message(
+            message.chat.id,
+            "⚠️ Не удалось получить актуальный курс через API. Используется сохранённый курс."
+        )
+    else:
+        if quote and conversion.get("quote_id") != quote.get("quote_id"):
+            await bot.send_message(
+                message.chat.id,
+                "ℹ️ Подтверждённый курс устарел. Используется актуальный курс."
+            )
+        rate = normalize_rate(conversion["rate"])
+        data["rate"] = rate
+        amount_to = quantize(amount_from * rate, data["to_currency"])
+
+    trip_name = f"{data['from_country']} → {data['to_country']}"
+
+    await db.create_trip(
+        user_id=user_id,
+        name=trip_name,
+        from_country=data["from_country"],
+        to_country=data["to_country"],
+        from_currency=data["from_currency"],
+        to_currency=data["to_currency"],
+        exchange_rate=rate,
+        initial_amount_from=amount_from,
+        initial_amount_to=amount_to
+    )
+
+    clear_user_state(user_id)
+
+    await send_main_menu(message.chat.id, trip_created_text(trip_name, data, rate, amount_from, amount_to))
+
+
+async def handle_expense_input(message, amount: Decimal):
+    """Обработка ввода суммы расхода"""
+    user_id = message.from_user.id
+
+    if amount <= 0:
+        await send_main_menu(message.chat.id, "❌ Сумма должна быть положительным числом.")
+        return
+
+    trip = await db.get_active_trip(user_id)
+
+    if not trip:
+        await send_main_menu(message.chat.id, NO_ACTIVE_TRIP_HINT_TEXT)
+        return
+
+    # Курс: сколько to_currency за 1 from_currency; расход переводим обратно делением
+    rate = trip['exchange_rate']
+    amount = quantize(amount, trip['to_currency'])
+    amount_from = quantize(amount / rate, trip['from_currency'])
+
+    set_user_state(user_id, "waiting_expense_confirmation", {
+        "trip_id": trip['id'],
+        "amount_to": amount,
+        "amount_from": amount_from
+    })
+
+    await bot.send_message(
+        message.chat.id,
+        expense_prompt_text(trip, amount, amount_from),
+        reply_markup=create_yes_no_keyboard("expense_yes", "expense_no")
+    )
+
+
+@router.callback("expense_yes")
+async def callback_expense_yes(call):
+    """Подтверждение расхода"""
+    user_id = call.from_user.id
+    state_data = get_user_state(user_id)
+
+    if state_data.get("state") != "waiting_expense_confirmation":
+        await bot.answer_callback_query(call.id, "❌ Ошибка состояния")
+        return
+
+    data = state_data.get("data", {})
+    if not data or "trip_id" not in data:
+        await bot.answer_callback_query(call.id, "❌ Ошибка данных")
+        return
+
+    expense_id = await db.add_expense(
+        trip_id=data["trip_id"],
+        amount_to=data["amount_to"],
+        amount_from=data["amount_from"]
+    )
+
+    trip = await db.get_active_trip(user_id)
+
+    if not trip:
+        await bot.edit_message_text(
+            "❌ Ошибка: путешествие не найдено",
+            call.message.chat.id,
+            call.message.message_id
+        )
+        clear_user_state(user_id)
+        return
+
+    set_user_state(user_id, "waiting_expense_description", {
+        "expense_id": expense_id,
+        "trip_id": data["trip_id"]
+    })
+
+    await bot.edit_message_text(expense_saved_text(trip), call.message.chat.id, call.message.message_id)
+
+
+@router.callback("expense_no")
+async def callback_expense_no(call):
+    """Отмена расхода"""
+    clear_user_state(call.from_user.id)
+
+    await bot.edit_message_text("❌ Расход не учтён.", call.message.chat.id, call.message.message_id)
+
+
+async def handle_bulk_expense_input(message, expenses: List[Tuple[Decimal, str]]):
+    """Обработка списка расходов: одно подтверждение на все строки"""
+    user_id = message.from_user.id
+
+    trip = await db.get_active_trip(user_id)
+
+    if not trip:
+        await send_main_menu(message.chat.id, NO_ACTIVE_TRIP_HINT_TEXT)
+        return
+
+    rate = trip['exchange_rate']
+    converted = []
+    for amount, description in expenses:
+        amount = quantize(amount, trip['to_currency'])
+        converted.append((amount, quantize(amount / rate, trip['from_currency']), description))
+
+    set_user_state(user_id, "waiting_bulk_expense_confirmation", {
+        "trip_id": trip['id'],
+        "expenses": converted
+    })
+
+    await bot.send_message(
+        message.chat.id,
+        bulk_expense_prompt_text(trip, converted),
+        reply_markup=create_yes_no_keyboard("bulk_expense_yes", "bulk_expense_no")
+    )
+
+
+@router.callback("bulk_expense_yes")
+async def callback_bulk_expense_yes(call):
+    """Подтверждение списка расходов: все строки одной транзакцией"""
+    user_id = call.from_user.id
+    state_data = get_user_state(user_id)
+
+    if state_data.get("state") != "waiting_bulk_expense_confirmation":
+        await bot.answer_callback_query(call.id, "❌ Ошибка состояния")
+        return
+
+    data = state_data.get("data", {})
+    if not data or "trip_id" not in data:
+        await bot.answer_callback_query(call.id, "❌ Ошибка данных")
+        return
+
+    count = await db.add_expenses(data["trip_id"], [tuple(expense) for expense in data["expenses"]])
+    clear_user_state(user_id)
+
+    trip = await db.get_active_trip(user_id)
+
+    if not trip:
+        await bot.edit_message_text(
+            "❌ Ошибка: путешествие не найдено",
+            call.message.chat.id,
+            call.message.message_id
+        )
+        return
+
+    await bot.edit_message_text(bulk_expense_saved_text(trip, count), call.message.chat.id,
+                                call.message.message_id, reply_markup=create_main_menu())
+
+
+@router.callback("bulk_expense_no")
+async def callback_bulk_expense_no(call):
+    """Отмена списка расходов"""
+    clear_user_state(call.from_user.id)
+
+    await bot.edit_message_text("❌ Расходы не учтены.", call.message.chat.id, call.message.message_id)
+
+
+@router.state("waiting_expense_description")
+async def handle_expense_description(message, description: str):
+    """Обработка ввода наименования расхода"""
+    user_id = message.from_user.id
+    state_data = get_user_state(user_id)
+
+    if description.strip().lower() == "/skip":
+        clear_user_state(user_id)
+        await bot.send_message(message.chat.id, "✅ Расход сохранён без наименования.",
+                               reply_markup=create_main_menu())
+        return
+
+    expense_id = state_data.get("data", {}).get("expense_id")
+
+    if not expense_id:
+        await bot.send_message(message.chat.id, "❌ Ошибка: не найден ID расхода.",
+                               reply_markup=create_main_menu())
+        clear_user_state(user_id)
+        return
+
+    await db.update_expense_description(expense_id, description.strip())
+
+    clear_user_state(user_id)
+
+    await bot.send_message(
+        message.chat.id,
+        f"✅ Наименование расхода сохранено: {description.strip()}",
+        reply_markup=create_main_menu()
+    )
+
+
+@router.state("waiting_new_rate")
+async def handle_new_rate(message, rate_text: str):
+    """Обработка нового курса"""
+    user_id = message.from_user.id
+    state_data = get_user_state(user_id)
+    rate = parse_amount(rate_text)
+
+    if rate is None:
+        await bot.send_message(message.chat.id, "❌ Пожалуйста, введите число (например: 12.5 или 12,5):")
+        return
+
+    rate = normalize_rate(rate)
+
+    if rate <= 0:
+        await bot.send_message(message.chat.id, "❌ Курс должен быть положительным числом. Введите ещё раз:")
+        return
+
+    trip_id = state_data.get("data", {}).get("trip_id")
+
+    if not trip_id:
+        await bot.send_message(
+            message.chat.id,
+            "❌ Ошибка состояния. Начните изменение курса заново.",
+            reply_markup=create_main_menu()
+        )
+        clear_user_state(user_id)
+        return
+    await db.update_exchange_rate(trip_id, rate)
+
+    clear_user_state(user_id)
+
+    trip = await db.get_active_trip(user_id)
+
+    await bot.send_message(message.chat.id, rate_updated_text(trip, rate), reply_markup=create_main_menu())
+
+
+async def main():
+    try:
+        await bot.infinity_polling()
+    finally:
+        await get_async_client().close()
+        await bot.close_session()
+        close_state_store()
+        db.close()
+
+
+if __name__ == "__main__":
+    init_supported_currencies()
+    metrics.start_from_env()
+    print("🚀 Бот запущен (asyncio)!")
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+"""
+Бенчмарк накладных расходов на вызов database.Database
+
+Сравнивает прежнюю схему (новое соединение на каждый вызов, журнал отката)
+с постоянным соединением на поток в режиме WAL. Измеряется типичная пара
+вызовов при подтверждении расхода: add_expense + get_active_trip.
+
+Запуск:
+    python benchmarks/bench_db_connection.py [--iterations 2000]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database  # noqa: E402
+
+
+class PerCallConnectionDatabase:
+    """Прежняя схема: sqlite3.connect() и close() в каждом методе"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+
+    def add_expense(self, trip_id: int, amount_to: float, amount_from: float):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO expenses (trip_id, amount_to, amount_from, description) VALUES (?, ?, ?, ?)",
+            (trip_id, amount_to, amount_from, None)
+        )
+        cursor.execute(
+            "UPDATE trips SET balance_to = balance_to - ?, balance_from = balance_from - ? WHERE id = ?",
+            (amount_to, amount_from, trip_id)
+        )
+        conn.commit()
+        conn.close()
+
+    def get_active_trip(self, user_id: int):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, name, from_country, to_country, from_currency, to_currency, "
+            "exchange_rate, balance_from, balance_to FROM trips "
+            "WHERE user_id = ? AND is_active = 1 LIMIT 1",
+            (user_id,)
+        )
+        row = cursor.fetchone()
+        conn.close()
+        return row
+
+
+def run(db, trip_id: int, user_id: int, iterations: int) -> float:
+    """Среднее время пары вызовов в микросекундах"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        db.add_expense(trip_id, 10.0, 1.0)
+        db.get_active_trip(user_id)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def prepare(db_path: str) -> int:
+    db = Database(db_path)
+    db.add_user(1, "bench")
+    trip_id = db.create_trip(1, "bench", "Россия", "Китай", "RUB", "CNY",
+                             0.08, 1_000_000, 80_000)
+    db.close()
+    return trip_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.db")
+        trip_id = prepare(legacy_path)
+        # Возвращаем журнал отката, как было до перехода на WAL
+        conn = sqlite3.connect(legacy_path)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.close()
+        before = run(PerCallConnectionDatabase(legacy_path), trip_id, 1, args.iterations)
+
+        pooled_path = os.path.join(tmp, "pooled.db")
+        trip_id = prepare(pooled_path)
+        db = Database(pooled_path)
+        after = run(db, trip_id, 1, args.iterations)
+        db.close()
+
+    print(f"Итераций: {args.iterations}")
+    print(f"Соединение на вызов, DELETE-журнал: {before:10.1f} мкс")
+    print(f"Постоянное соединение, WAL:         {after:10.1f} мкс")
+    print(f"Ускорение: x{before / after:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+"""
+Нагрузочный тест сценариев бота: обработчики bot.py на синтетических обновлениях
+
+Обновления (Message, CallbackQuery) проходят весь путь бота — telebot,
+ShardedDispatcher, FSM, Database, currency_api. Вместо внешних сервисов:
+- заглушка Telegram API (apihelper.CUSTOM_REQUEST_SENDER, задержка --telegram-latency);
+- локальный HTTP-сервер в формате exchangerate.host (/live, /list),
+  адрес передаётся боту через CURRENCY_API_URL.
+
+Для каждого размера базы (--users, всего --expenses расходов) создаётся
+отдельная база в отдельном процессе; затем для сценариев
+- create_trip  — создание путешествия (5 обновлений),
+- expense      — ввод расхода с подтверждением и /skip (3 обновления),
+- history      — просмотр истории (1 обновление),
+- stats        — статистика расходов (1 обновление),
+- switch_trip  — переключение путешествия (1 обновление)
+измеряются задержка сценария (по одному пользователю за раз, p50/p95/p99)
+и пропускная способность (сценарии --samples случайных пользователей
+пакетами по --batch-size обновлений, как приходят из getUpdates).
+
+Результаты пишутся в JSON (--output); --compare сравнивает их с прежним
+файлом и возвращает код 1, если пропускная способность какого-либо
+сценария упала больше чем на --max-regression.
+
+Запуск:
+    python benchmarks/bench_flows.py [--users 1000 10000 100000] [--expenses 1000000]
+        [--samples 500] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Курсы относительно USD для заглушки API курсов
+USD_RATES = {"USD": 1.0, "RUB": 90.0, "JPY": 150.0, "CNY": 7.2, "EUR": 0.9, "GBP": 0.78}
+
+SCENARIOS = ("create_trip", "expense", "history", "stats", "switch_trip")
+
+
+class FakeRateHandler(BaseHTTPRequestHandler):
+    """Ответы в формате exchangerate.host: /live и /list"""
+
+    requests_served = 0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        type(self).requests_served += 1
+        if url.path.endswith("/live"):
+            source = params.get("source", "USD")
+            codes = params.get("currencies", "").split(",") if params.get("currencies") else USD_RATES
+            body = {"success": True, "source": source, "quotes": {
+                f"{source}{code}": USD_RATES[code] / USD_RATES[source]
+                for code in codes if code in USD_RATES
+            }}
+        elif url.path.endswith("/list"):
+            body = {"success": True, "currencies": {code: code for code in USD_RATES}}
+        else:
+            self.send_error(404)
+            return
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_rate_server() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeRateHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stub_telegram(latency: float):
+    """Заглушка Telegram Bot API: ответ без сети с задержкой latency"""
+    from telebot import apihelper
+
+    class Response:
+        status_code = 200
+        reason = "OK"
+
+        def __init__(self, result):
+            self.text = json.dumps({"ok": True, "result": result})
+
+        def json(self):
+            return json.loads(self.text)
+
+    def send(method, url, **kwargs):
+        if latency:
+            time.sleep(latency)
+        if "send" in url or "edit" in url:
+            return Response({"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}})
+        return Response(True)
+
+    apihelper.CUSTOM_REQUEST_SENDER = send
+
+
+def seed(db_path: str, users: int, expenses: int):
+    """
+    Наполнение базы: у каждого пользователя два путешествия (RUB → JPY),
+    активно второе; расходы распределены по активным путешествиям поровну.
+    Путешествия пользователя с номером i имеют id 2i+1 и 2i+2.
+    """
+    from database import Database
+    from money import rate_to_scaled
+
+    Database(db_path).close()
+    conn = sqlite3.connect(db_path)
+    rate = rate_to_scaled(USD_RATES["JPY"] / USD_RATES["RUB"])
+    with conn:
+        conn.executemany("INSERT INTO users (user_id, username) VALUES (?, ?)",
+                         ((user_id, f"user{user_id}") for user_id in range(1, users + 1)))
+        conn.executemany("""
+            INSERT INTO trips (id, user_id, name, from_country, to_country, from_currency,
+                               to_currency, exchange_rate_scaled, balance_from_minor,
+                               balance_to_minor, is_active)
+            VALUES (?, ?, ?, 'Россия', 'Япония', 'RUB', 'JPY', ?, ?, ?, ?)
+        """, ((2 * (user_id - 1) + 1 + second, user_id, f"Trip {second}", rate,
+               100000000, 166666667, second)
+              for user_id in range(1, users + 1) for second in (0, 1)))
+        conn.executemany("""
+            INSERT INTO expenses (trip_id, amount_to_minor, amount_from_minor, description)
+            VALUES (?, 15000, 9000, ?)
+        """, ((2 * (i % users) + 2, "кофе" if i % 3 == 0 else None) for i in range(expenses)))
+    conn.close()
+    # Расходы добавлены в обход add_expense — сводку пересчитываем целиком
+    db = Database(db_path)
+    db.rebuild_expense_rollups()
+    db.close()
+
+
+class Updates:
+    """Синтетические обновления Telegram"""
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def message(self, user_id: int, text: str):
+        from telebot import types
+
+        entities = ([{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+                    if text.startswith("/") else [])
+        return types.Update.de_json({"update_id": next(self._ids), "message": {
+            "message_id": 1, "date": 0, "text": text, "entities": entities,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "u"}}})
+
+    def callback(self, user_id: int, data: str):
+        from telebot import types
+
+        return types.Update.de_json({"update_id": next(self._ids), "callback_query": {
+            "id": "c", "data": data, "chat_instance": "x",
+            "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+            "message": {"message_id": 1, "date": 0, "text": "t",
+                        "chat": {"id": user_id, "type": "private"}}}})
+
+    def flow(self, scenario: str, user_id: int) -> list:
+        if scenario == "create_trip":
+            return [self.callback(user_id, "new_trip"), self.message(user_id, "Россия"),
+                    self.message(user_id, "Япония"), self.callback(user_id, "rate_yes"),
+                    self.message(user_id, "10000")]
+        if scenario == "expense":
+            return [self.message(user_id, "150"), self.callback(user_id, "expense_yes"),
+                    self.message(user_id, "/skip")]
+        if scenario == "history":
+            return [self.callback(user_id, "history")]
+        if scenario == "stats":
+            return [self.callback(user_id, "stats")]
+        if scenario == "switch_trip":
+            # Одно из двух путешествий пользователя (см. seed)
+            trip_id = 2 * (user_id - 1) + 1 + random.randint(0, 1)
+            return [self.callback(user_id, f"switch_trip_{trip_id}")]
+        raise ValueError(scenario)
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+
+    def pick(q):
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    return {
+        "mean": round(statistics.fmean(values), 3),
+        "p50": round(pick(0.50), 3),
+        "p95": round(pick(0.95), 3),
+        "p99": round(pick(0.99), 3),
+    }
+
+
+def run_scale(users: int, expenses: int, samples: int, batch_size: int,
+              telegram_latency: float, seed_value: int) -> Dict:
+    """Прогон всех сценариев на одной базе (выполняется в отдельном процессе)"""
+    random.seed(seed_value)
+    rate_server = start_rate_server()
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": "1:bench",
+        "CURRENCY_API_URL": f"http://127.0.0.1:{rate_server.server_address[1]}",
+        "CURRENCY_API_KEY": "bench",
+        "STATE_BACKEND": "memory",
+        "METRICS_ENABLED": "1",
+    })
+    os.environ.pop("METRICS_PORT", None)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        started = time.perf_counter()
+        seed(os.path.join(tmp, "travel_wallet.db"), users, expenses)
+        seed_seconds = time.perf_counter() - started
+
+        stub_telegram(telegram_latency)
+        import bot
+        import currency_api
+        import metrics
+
+        currency_api.init_supported_currencies()
+        updates = Updates()
+
+        def process(batch):
+            bot.bot.process_new_updates(batch)
+
+        results = []
+        for scenario in SCENARIOS:
+            # Задержка: сценарии по одному, каждый шаг дожидается обработки
+            latencies = []
+            for user_id in random.sample(range(1, users + 1), min(samples, users)):
+                flow = updates.flow(scenario, user_id)
+                flow_started = time.perf_counter()
+                for update in flow:
+                    process([update])
+                    bot.update_dispatcher.drain()
+                latencies.append((time.perf_counter() - flow_started) * 1000)
+
+            # Пропускная способность: сценарии разных пользователей вперемешку
+            flows = [updates.flow(scenario, user_id)
+                     for user_id in random.sample(range(1, users + 1), min(samples, users))]
+            stream = [update for step in itertools.zip_longest(*flows)
+                      for update in step if update is not None]
+            flow_started = time.perf_counter()
+            for i in range(0, len(stream), batch_size):
+                process(stream[i:i + batch_size])
+            bot.update_dispatcher.drain()
+            elapsed = time.perf_counter() - flow_started
+
+            results.append({
+                "users": users,
+                "expenses": expenses,
+                "scenario": scenario,
+                "updates_per_flow": len(flows[0]),
+                "latency_ms": percentiles(latencies),
+                "flows_per_sec": round(len(flows) / elapsed, 1),
+                "updates_per_sec": round(len(stream) / elapsed, 1),
+            })
+
+        bot.update_dispatcher.shutdown()
+        bot.close_state_store()
+        currency_api.supported_currencies.stop_refresh()
+        rate_server.shutdown()
+        db_calls = {
+            row["labels"]["method"]: {key: round(row[key] * 1000, 3) for key in ("p50", "p95", "p99")}
+            for row in metrics.summary() if row["metric"] == "db_seconds"
+        }
+        return {
+            "users": users,
+            "expenses": expenses,
+            "seed_seconds": round(seed_seconds, 2),
+            "rate_api_requests": FakeRateHandler.requests_served,
+            "db_calls_ms": db_calls,
+            "scenarios": results,
+        }
+
+
+def _run_scale_process(queue, *args):
+    queue.put(run_scale(*args))
+
+
+def compare(current: Dict, baseline: Dict, max_regression: float) -> bool:
+    """Печать изменений относительно baseline; False, если есть регрессия"""
+    def index(data):
+        return {(row["users"], row["scenario"]): row
+                for scale in data["scales"] for row in scale["scenarios"]}
+
+    old = index(baseline)
+    ok = True
+    print("\nСравнение с прежними результатами (пропускная способность, p95):")
+    for key, row in index(current).items():
+        before = old.get(key)
+        if before is None:
+            continue
+        change = row["flows_per_sec"] / before["flows_per_sec"] - 1
+        p95_change = row["latency_ms"]["p95"] / before["latency_ms"]["p95"] - 1
+        mark = ""
+        if change < -max_regression:
+            ok = False
+            mark = "  ⚠️ регрессия"
+        print(f"  users={key[0]:>7} {key[1]:<12} {change:+7.1%} сценариев/с, p95 {p95_change:+7.1%}{mark}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест сценариев бота")
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--expenses", type=int, default=1000000,
+                        help="Число расходов в базе (на каждый размер)")
+    parser.add_argument("--samples", type=int, default=500,
+                        help="Число сценариев каждого типа для замера")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--telegram-latency", type=float, default=0.0,
+                        help="Задержка ответа заглушки Telegram API (сек)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Файл для результатов (JSON)")
+    parser.add_argument("--compare", help="Прежние результаты для сравнения (JSON)")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Допустимое падение пропускной способности (доля)")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    scales = []
+    for users in args.users:
+        queue = ctx.Queue()
+        process = ctx.Process(target=_run_scale_process, args=(
+            queue, users, args.expenses, args.samples, args.batch_size,
+            args.telegram_latency, args.seed
+        ))
+        process.start()
+        scale = queue.get()
+        process.join()
+        scales.append(scale)
+
+        print(f"\nПользователей: {users}, расходов: {args.expenses} "
+              f"(наполнение {scale['seed_seconds']} с, запросов к API курсов: "
+              f"{scale['rate_api_requests']})")
+        for row in scale["scenarios"]:
+            latency = row["latency_ms"]
+            print(f"  {row['scenario']:<12} p50 {latency['p50']:7.2f} мс  p95 {latency['p95']:7.2f} мс  "
+                  f"p99 {latency['p99']:7.2f} мс  {row['flows_per_sec']:8.1f} сценариев/с")
+
+    result = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "params": vars(args),
+        },
+        "scales": scales,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты записаны в {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare(result, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Бенчмарк накладных расходов metrics.timed
+
+Сравнивает вызов пустой функции без декоратора и с timed, в одном потоке
+и в нескольких потоках одновременно (у каждого потока свои счётчики).
+
+Запуск:
+    python benchmarks/bench_metrics.py [--iterations 1000000] [--threads 4]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics  # noqa: E402
+
+
+def noop():
+    pass
+
+
+def per_call(func, iterations: int) -> float:
+    """Время одного вызова (мкс)"""
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def per_call_threads(func, iterations: int, threads: int) -> float:
+    """Время одного вызова (мкс) при вызовах из нескольких потоков"""
+    workers = [threading.Thread(target=per_call, args=(func, iterations)) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - started) / (iterations * threads) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=1000000)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    family = metrics.histogram("bench_seconds", "Бенчмарк", ("function",))
+    timed_noop = metrics.timed(family)(noop)
+
+    plain = per_call(noop, args.iterations)
+    single = per_call(timed_noop, args.iterations)
+    threaded = per_call_threads(timed_noop, args.iterations // args.threads, args.threads)
+    count = sum(family.labels("noop").snapshot()[0])
+
+    print(f"Итераций: {args.iterations}, записано замеров: {count}")
+    print(f"Без замера:              {plain:8.3f} мкс")
+    print(f"timed, один поток:       {single:8.3f} мкс (+{single - plain:.3f})")
+    print(f"timed, потоков {args.threads}:        {threaded:8.3f} мкс (+{threaded - plain:.3f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Нагрузочный тест многопроцессного запуска (supervisor.py)
+
+Для каждого числа процессов N запускает Supervisor с заглушкой Telegram API
+(ответ с задержкой --latency) и котировками без сети, прогоняет сценарий
+для --users пользователей (создание путешествия и --expenses расходов)
+и измеряет пропускную способность — от первого обновления до обработки
+последнего.
+
+Запуск:
+    python benchmarks/bench_sharded.py [--workers 1 2 4] [--users 200] [--expenses 5]
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+QUOTES = {"RUB": 90.0, "CNY": 7.2, "JPY": 150.0, "EUR": 0.9}
+
+
+def fake_quotes(base: str, currencies: list) -> dict:
+    return dict(QUOTES)
+
+
+def stub_worker():
+    """Инициализация рабочего процесса: Telegram API и API курсов без сети"""
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1:bench")
+    from telebot import apihelper
+
+    latency = float(os.environ.get("BENCH_LATENCY", "0"))
+
+    class Response:
+        status_code = 200
+        reason = "OK"
+
+        def __init__(self, result):
+            self.text = json.dumps({"ok": True, "result": result})
+
+        def json(self):
+            return json.loads(self.text)
+
+    def send(method, url, **kwargs):
+        if latency:
+            time.sleep(latency)
+        if "send" in url or "edit" in url:
+            return Response({"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}})
+        return Response(True)
+
+    apihelper.CUSTOM_REQUEST_SENDER = send
+
+    import currency_api
+    currency_api._fetch_quotes = fake_quotes
+    currency_api.supported_currencies._fetch_codes = lambda: list(QUOTES) + ["USD"]
+
+
+def make_updates(users: int, expenses: int) -> list:
+    from telebot import types
+
+    ids = itertools.count(1)
+
+    def message(user_id, text):
+        entities = ([{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+                    if text.startswith("/") else [])
+        return types.Update.de_json({"update_id": next(ids), "message": {
+            "message_id": 1, "date": 0, "text": text, "entities": entities,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "u"}}})
+
+    def callback(user_id, data):
+        return types.Update.de_json({"update_id": next(ids), "callback_query": {
+            "id": "c", "data": data, "chat_instance": "x",
+            "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+            "message": {"message_id": 1, "date": 0, "text": "t",
+                        "chat": {"id": user_id, "type": "private"}}}})
+
+    scripts = []
+    for user_id in range(1, users + 1):
+        script = [message(user_id, "/start"), message(user_id, "/newtrip"),
+                  message(user_id, "Россия"), message(user_id, "Япония"),
+                  callback(user_id, "rate_yes"), message(user_id, "10000")]
+        for _ in range(expenses):
+            script += [message(user_id, "150"), callback(user_id, "expense_yes"),
+                       message(user_id, "/skip")]
+        scripts.append(script)
+    # Обновления разных пользователей перемешаны, порядок для каждого сохранён
+    return [update for step in itertools.zip_longest(*scripts) for update in step if update]
+
+
+def run(workers: int, updates: list, batch_size: int) -> dict:
+    from supervisor import Supervisor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            supervisor = Supervisor(workers=workers, fetch_quotes=fake_quotes,
+                                    initializer=stub_worker)
+            supervisor.start()
+            # Процессы импортируют бота; ждём, пока все будут готовы
+            supervisor.route([updates[0]])
+            while sum(supervisor.stats()["processed"]) < 1:
+                time.sleep(0.01)
+            started = time.perf_counter()
+            for i in range(1, len(updates), batch_size):
+                supervisor.route(updates[i:i + batch_size])
+            supervisor.stop()
+            elapsed = time.perf_counter() - started
+            processed = sum(supervisor.stats()["processed"])
+        finally:
+            os.chdir(cwd)
+    return {
+        "workers": workers,
+        "updates": len(updates) - 1,
+        "processed": processed - 1,
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round((len(updates) - 1) / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Масштабирование бота по числу процессов")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--expenses", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=100,
+                        help="Обновлений в одном пакете (как getUpdates)")
+    parser.add_argument("--latency", type=float, default=0.002,
+                        help="Задержка ответа заглушки Telegram API (сек)")
+    args = parser.parse_args()
+
+    os.environ["BENCH_LATENCY"] = str(args.latency)
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1:bench")
+    updates = make_updates(args.users, args.expenses)
+
+    baseline = None
+    for workers in args.workers:
+        result = run(workers, updates, args.batch_size)
+        baseline = baseline or result["updates_per_sec"]
+        print(f"N={result['workers']}: {result['processed']}/{result['updates']} обновлений "
+              f"за {result['seconds']} с, {result['updates_per_sec']} обн/с "
+              f"(x{result['updates_per_sec'] / baseline:.2f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,42 @@
 """
 Telegram-бот миникошелёк для путешественника
 """
+import requests
 import telebot
-from telebot import types
 from dotenv import load_dotenv
+from telebot import apihelper
 import os
 import re
-from typing import Optional
-
+import signal
+import tempfile
+import threading
+import uuid
+from decimal import Decimal
+from typing import List, Optional, Tuple
+
+import dispatcher
 from database import Database
-from currency_api import get_exchange_rate, convert_currency, check_currency_available
-from country_currency import get_currency_by_country, format_currency_name
+from export import export_filename, parse_export_args, write_export
+from importer import MAX_FILE_SIZE, import_expenses
+from fsm import Router
+import metrics
+from metrics import HANDLER_SECONDS, timed
+from currency_api import convert_currency, validate_pair_and_quote, init_supported_currencies
+from country_resolver import Country, get_country, resolve as resolve_country
+from money import normalize_rate, parse_amount, parse_expense_lines, quantize
+from user_state import (
+    get_user_state, set_user_state, clear_user_state, init_state_store, close_state_store
+)
+from views import (
+    WELCOME_TEXT, NEW_TRIP_TEXT, NO_USER_TEXT, NO_TRIPS_TEXT, NO_ACTIVE_TRIP_TEXT,
+    NO_ACTIVE_TRIP_HINT_TEXT, UNKNOWN_COMMAND_TEXT, HISTORY_PAGE_SIZE,
+    format_number, create_main_menu, create_back_keyboard, create_yes_no_keyboard,
+    country_suggestions, trips_list, balance_text, history_page, stats_text, export_caption,
+    import_prompt_text, import_summary_text,
+    change_rate_text, rate_offer_text, initial_amount_prompt, trip_created_text,
+    expense_prompt_text, expense_saved_text, bulk_expense_prompt_text, bulk_expense_saved_text,
+    rate_updated_text
+)
 
 load_dotenv()
 
@@ -19,52 +45,36 @@ BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 if not BOT_TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN не найден в переменных окружения!")
 
-bot = telebot.TeleBot(BOT_TOKEN)
+# Обработчики выполняются в потоках диспетчера: по одному шарду на группу
+# пользователей, порядок обновлений одного пользователя сохраняется
+HANDLER_WORKERS = int(os.getenv("HANDLER_WORKERS", "8"))
+HANDLER_QUEUE_SIZE = int(os.getenv("HANDLER_QUEUE_SIZE", "1000"))
+
+# Способ получения обновлений: polling (по умолчанию) или webhook
+UPDATE_MODE = os.getenv("UPDATE_MODE", "polling")
+# Webhook: публичный адрес (если задан, регистрируется в Telegram при запуске),
+# адрес локального сервера, путь и секрет заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "100"))
+
+# Пользователи, которым доступна команда /metrics
+ADMIN_IDS = metrics.admin_ids()
+
+bot = telebot.TeleBot(BOT_TOKEN, threaded=False)
+update_dispatcher = dispatcher.install(bot, workers=HANDLER_WORKERS, queue_size=HANDLER_QUEUE_SIZE)
+# Маршрутизация текста по состоянию FSM и нажатий по callback_data
+router = Router()
+# Ответ в этих состояниях ожидается нажатием кнопки
+router.ignore("waiting_rate_confirmation", "waiting_expense_confirmation",
+              "waiting_bulk_expense_confirmation")
+router.set_timing_hook(metrics.fsm_timing_hook)
+metrics.instrument_telegram()
 db = Database()
-
-# Состояния пользователей для FSM
-user_states = {}
-
-
-def get_user_state(user_id: int) -> dict:
-    """Получение состояния пользователя"""
-    if user_id not in user_states:
-        user_states[user_id] = {}
-    return user_states[user_id]
-
-
-def set_user_state(user_id: int, state: str, data: dict = None):
-    """Установка состояния пользователя"""
-    user_states[user_id] = {"state": state, "data": data or {}}
-
-
-def clear_user_state(user_id: int):
-    """Очистка состояния пользователя"""
-    if user_id in user_states:
-        del user_states[user_id]
-
-
-def format_number(num: float) -> str:
-    """Форматирование числа с пробелами для тысяч"""
-    return f"{num:,.2f}".replace(",", " ").replace(".", ",")
-
-
-def create_main_menu() -> types.InlineKeyboardMarkup:
-    """Создание главного меню"""
-    keyboard = types.InlineKeyboardMarkup(row_width=2)
-    keyboard.add(
-        types.InlineKeyboardButton("✈️ Создать путешествие", callback_data="new_trip"),
-        types.InlineKeyboardButton("📋 Мои путешествия", callback_data="my_trips")
-    )
-    keyboard.add(
-        types.InlineKeyboardButton("💰 Баланс", callback_data="balance"),
-        types.InlineKeyboardButton("📊 История расходов", callback_data="history")
-    )
-    keyboard.add(
-        types.InlineKeyboardButton("💱 Изменить курс", callback_data="change_rate")
-    )
-    return keyboard
-
+init_state_store(db)
 
 def send_main_menu(chat_id: int, text: str = "🏠 Главное меню"):
     """Отправка главного меню"""
@@ -72,6 +82,7 @@ def send_main_menu(chat_id: int, text: str = "🏠 Главное меню"):
 
 
 @bot.message_handler(commands=['start'])
+@timed(HANDLER_SECONDS)
 def start_command(message):
     """Обработка команды /start"""
     user_id = message.from_user.id
@@ -80,21 +91,12 @@ def start_command(message):
     db.add_user(user_id, username)
     clear_user_state(user_id)
     
-    welcome_text = (
-        "👋 Добро пожаловать в миникошелёк для путешественника!\n\n"
-        "Я помогу вам отслеживать расходы во время путешествий и конвертировать валюты.\n\n"
-        "Используйте меню ниже или команды:\n"
-        "/newtrip - создать новое путешествие\n"
-        "/switch - переключить путешествие\n"
-        "/balance - показать баланс\n"
-        "/history - история расходов\n"
-        "/setrate - изменить курс обмена"
-    )
-    
-    send_main_menu(message.chat.id, welcome_text)
+    send_main_menu(message.chat.id, WELCOME_TEXT)
 
 
-@bot.message_handler(commands=['newtrip', 'switch', 'balance', 'history', 'setrate'])
+@bot.message_handler(commands=['newtrip', 'switch', 'balance', 'history', 'stats', 'export',
+                               'import', 'setrate'])
+@timed(HANDLER_SECONDS)
 def handle_commands(message):
     """Обработка команд меню"""
     command = message.text.split()[0][1:]  # Убираем /
@@ -107,11 +109,17 @@ def handle_commands(message):
         show_balance(message)
     elif command == "history":
         show_history(message)
+    elif command == "stats":
+        show_stats(message)
+    elif command == "export":
+        send_export(message)
+    elif command == "import":
+        start_import(message)
     elif command == "setrate":
         start_change_rate(message)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "new_trip")
+@router.callback("new_trip")
 def callback_new_trip(call):
     """Обработка нажатия на кнопку создания путешествия"""
     user_id = call.from_user.id
@@ -119,8 +127,7 @@ def callback_new_trip(call):
     bot.answer_callback_query(call.id)
     bot.send_message(
         call.message.chat.id,
-        "✈️ Создание нового путешествия\n\n"
-        "Введите страну отправления (например: Россия, Russia, RU):"
+        NEW_TRIP_TEXT
     )
 
 
@@ -129,7 +136,7 @@ def start_new_trip(message):
     if not hasattr(message, 'from_user') or not message.from_user:
         bot.send_message(
             message.chat.id,
-            "❌ Ошибка: не удалось определить пользователя."
+            NO_USER_TEXT
         )
         return
     
@@ -137,12 +144,11 @@ def start_new_trip(message):
     set_user_state(user_id, "waiting_from_country")
     bot.send_message(
         message.chat.id,
-        "✈️ Создание нового путешествия\n\n"
-        "Введите страну отправления (например: Россия, Russia, RU):"
+        NEW_TRIP_TEXT
     )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "my_trips")
+@router.callback("my_trips")
 def callback_my_trips(call):
     """Обработка нажатия на кнопку 'Мои путешествия'"""
     user_id = call.from_user.id
@@ -152,29 +158,12 @@ def callback_my_trips(call):
         bot.answer_callback_query(call.id)
         bot.send_message(
             call.message.chat.id,
-            "📋 У вас пока нет путешествий.\n\n"
-            "Создайте новое путешествие через меню или команду /newtrip",
+            NO_TRIPS_TEXT,
             reply_markup=create_main_menu()
         )
         return
     
-    keyboard = types.InlineKeyboardMarkup()
-    for trip in trips:
-        active_mark = "✅ " if trip['is_active'] else ""
-        button_text = f"{active_mark}{trip['name']} ({trip['from_country']} → {trip['to_country']})"
-        keyboard.add(types.InlineKeyboardButton(
-            button_text,
-            callback_data=f"switch_trip_{trip['id']}"
-        ))
-    keyboard.add(types.InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu"))
-    
-    trips_text = "📋 Ваши путешествия:\n\n"
-    for trip in trips:
-        active_mark = "✅ " if trip['is_active'] else ""
-        trips_text += f"{active_mark}{trip['name']}\n"
-        trips_text += f"   {trip['from_country']} ({trip['from_currency']}) → "
-        trips_text += f"{trip['to_country']} ({trip['to_currency']})\n"
-        trips_text += f"   Курс: 1 {trip['from_currency']} = {format_number(trip['exchange_rate'])} {trip['to_currency']}\n\n"
+    trips_text, keyboard = trips_list(trips)
     
     bot.answer_callback_query(call.id)
     bot.send_message(call.message.chat.id, trips_text, reply_markup=keyboard)
@@ -185,7 +174,7 @@ def show_trips_list(message):
     if not hasattr(message, 'from_user') or not message.from_user:
         bot.send_message(
             message.chat.id,
-            "❌ Ошибка: не удалось определить пользователя."
+            NO_USER_TEXT
         )
         return
     
@@ -196,34 +185,17 @@ def show_trips_list(message):
     if not trips:
         bot.send_message(
             message.chat.id,
-            "📋 У вас пока нет путешествий.\n\n"
-            "Создайте новое путешествие через меню или команду /newtrip",
+            NO_TRIPS_TEXT,
             reply_markup=create_main_menu()
         )
         return
     
-    keyboard = types.InlineKeyboardMarkup()
-    for trip in trips:
-        active_mark = "✅ " if trip['is_active'] else ""
-        button_text = f"{active_mark}{trip['name']} ({trip['from_country']} → {trip['to_country']})"
-        keyboard.add(types.InlineKeyboardButton(
-            button_text,
-            callback_data=f"switch_trip_{trip['id']}"
-        ))
-    keyboard.add(types.InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu"))
-    
-    trips_text = "📋 Ваши путешествия:\n\n"
-    for trip in trips:
-        active_mark = "✅ " if trip['is_active'] else ""
-        trips_text += f"{active_mark}{trip['name']}\n"
-        trips_text += f"   {trip['from_country']} ({trip['from_currency']}) → "
-        trips_text += f"{trip['to_country']} ({trip['to_currency']})\n"
-        trips_text += f"   Курс: 1 {trip['from_currency']} = {format_number(trip['exchange_rate'])} {trip['to_currency']}\n\n"
+    trips_text, keyboard = trips_list(trips)
     
     bot.send_message(message.chat.id, trips_text, reply_markup=keyboard)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("switch_trip_"))
+@router.callback(prefix="switch_trip_")
 def callback_switch_trip(call):
     """Переключение активного путешествия"""
     user_id = call.from_user.id
@@ -238,34 +210,17 @@ def callback_switch_trip(call):
     if not trips:
         bot.send_message(
             call.message.chat.id,
-            "📋 У вас пока нет путешествий.\n\n"
-            "Создайте новое путешествие через меню или команду /newtrip",
+            NO_TRIPS_TEXT,
             reply_markup=create_main_menu()
         )
         return
     
-    keyboard = types.InlineKeyboardMarkup()
-    for trip in trips:
-        active_mark = "✅ " if trip['is_active'] else ""
-        button_text = f"{active_mark}{trip['name']} ({trip['from_country']} → {trip['to_country']})"
-        keyboard.add(types.InlineKeyboardButton(
-            button_text,
-            callback_data=f"switch_trip_{trip['id']}"
-        ))
-    keyboard.add(types.InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu"))
-    
-    trips_text = "📋 Ваши путешествия:\n\n"
-    for trip in trips:
-        active_mark = "✅ " if trip['is_active'] else ""
-        trips_text += f"{active_mark}{trip['name']}\n"
-        trips_text += f"   {trip['from_country']} ({trip['from_currency']}) → "
-        trips_text += f"{trip['to_country']} ({trip['to_currency']})\n"
-        trips_text += f"   Курс: 1 {trip['from_currency']} = {format_number(trip['exchange_rate'])} {trip['to_currency']}\n\n"
+    trips_text, keyboard = trips_list(trips)
     
     bot.send_message(call.message.chat.id, trips_text, reply_markup=keyboard)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "balance")
+@router.callback("balance")
 def callback_balance(call):
     """Обработка нажатия на кнопку 'Баланс'"""
     user_id = call.from_user.id
@@ -275,27 +230,13 @@ def callback_balance(call):
         bot.answer_callback_query(call.id)
         bot.send_message(
             call.message.chat.id,
-            "❌ У вас нет активного путешествия.\n\n"
-            "Создайте новое путешествие или выберите существующее.",
+            NO_ACTIVE_TRIP_HINT_TEXT,
             reply_markup=create_main_menu()
         )
         return
     
-    balance_text = (
-        f"💰 Баланс путешествия: {trip['name']}\n\n"
-        f"📍 {trip['from_country']} ({trip['from_currency']}) → "
-        f"{trip['to_country']} ({trip['to_currency']})\n\n"
-        f"💵 Остаток:\n"
-        f"   {format_number(trip['balance_to'])} {trip['to_currency']} = "
-        f"{format_number(trip['balance_from'])} {trip['from_currency']}\n\n"
-        f"💱 Курс: 1 {trip['from_currency']} = {format_number(trip['exchange_rate'])} {trip['to_currency']}"
-    )
-    
-    keyboard = types.InlineKeyboardMarkup()
-    keyboard.add(types.InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu"))
-    
     bot.answer_callback_query(call.id)
-    bot.send_message(call.message.chat.id, balance_text, reply_markup=keyboard)
+    bot.send_message(call.message.chat.id, balance_text(trip), reply_markup=create_back_keyboard())
 
 
 def show_balance(message):
@@ -303,7 +244,7 @@ def show_balance(message):
     if not hasattr(message, 'from_user') or not message.from_user:
         bot.send_message(
             message.chat.id,
-            "❌ Ошибка: не удалось определить пользователя."
+            NO_USER_TEXT
         )
         return
     
@@ -314,29 +255,15 @@ def show_balance(message):
     if not trip:
         bot.send_message(
             message.chat.id,
-            "❌ У вас нет активного путешествия.\n\n"
-            "Создайте новое путешествие или выберите существующее.",
+            NO_ACTIVE_TRIP_HINT_TEXT,
             reply_markup=create_main_menu()
         )
         return
     
-    balance_text = (
-        f"💰 Баланс путешествия: {trip['name']}\n\n"
-        f"📍 {trip['from_country']} ({trip['from_currency']}) → "
-        f"{trip['to_country']} ({trip['to_currency']})\n\n"
-        f"💵 Остаток:\n"
-        f"   {format_number(trip['balance_to'])} {trip['to_currency']} = "
-        f"{format_number(trip['balance_from'])} {trip['from_currency']}\n\n"
-        f"💱 Курс: 1 {trip['from_currency']} = {format_number(trip['exchange_rate'])} {trip['to_currency']}"
-    )
-    
-    keyboard = types.InlineKeyboardMarkup()
-    keyboard.add(types.InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu"))
-    
-    bot.send_message(message.chat.id, balance_text, reply_markup=keyboard)
+    bot.send_message(message.chat.id, balance_text(trip), reply_markup=create_back_keyboard())
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "history")
+@router.callback("history")
 def callback_history(call):
     """Обработка нажатия на кнопку 'История расходов'"""
     user_id = call.from_user.id
@@ -346,66 +273,16 @@ def callback_history(call):
         bot.answer_callback_query(call.id)
         bot.send_message(
             call.message.chat.id,
-            "❌ У вас нет активного путешествия.",
+            NO_ACTIVE_TRIP_TEXT,
             reply_markup=create_main_menu()
         )
         return
     
-    expenses = db.get_expenses(trip['id'], limit=20)
-    
-    if not expenses:
-        history_text = (
-            f"📊 История расходов: {trip['name']}\n\n"
-            "Пока нет расходов."
-        )
-    else:
-        history_text = f"📊 История расходов: {trip['name']}\n\n"
-        total_to = 0
-        total_from = 0
-        
-        for expense in expenses:
-            total_to += expense['amount_to']
-            total_from += expense['amount_from']
-            
-            # Форматируем дату и время
-            if expense['created_at']:
-                dt_str = expense['created_at']
-                if len(dt_str) >= 16:
-                    date_part = dt_str[:10]  # 2026-02-05
-                    time_part = dt_str[11:16]  # 16:06
-                    # Преобразуем дату из формата YYYY-MM-DD в DD.MM.YYYY
-                    date_parts = date_part.split('-')
-                    if len(date_parts) == 3:
-                        formatted_date = f"{date_parts[2]}.{date_parts[1]}.{date_parts[0]}"
-                        datetime_str = f"{formatted_date} {time_part}"
-                    else:
-                        datetime_str = dt_str[:16]
-                else:
-                    datetime_str = dt_str[:10] if len(dt_str) >= 10 else dt_str
-            else:
-                datetime_str = ""
-            
-            desc = expense['description'] or ""
-            history_text += (
-                f"📅 {datetime_str}\n"
-                f"   {format_number(expense['amount_to'])} {trip['to_currency']} = "
-                f"{format_number(expense['amount_from'])} {trip['from_currency']}\n"
-            )
-            if desc:
-                history_text += f"   💬 {desc}\n"
-            history_text += "\n"
-        
-        history_text += (
-            f"\n📊 Всего потрачено:\n"
-            f"   {format_number(total_to)} {trip['to_currency']} = "
-            f"{format_number(total_from)} {trip['from_currency']}"
-        )
-    
-    keyboard = types.InlineKeyboardMarkup()
-    keyboard.add(types.InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu"))
+    page = db.get_expenses_page(trip['id'], HISTORY_PAGE_SIZE)
+    text, keyboard = history_page(trip, page)
     
     bot.answer_callback_query(call.id)
-    bot.send_message(call.message.chat.id, history_text, reply_markup=keyboard)
+    bot.send_message(call.message.chat.id, text, reply_markup=keyboard)
 
 
 def show_history(message):
@@ -413,7 +290,7 @@ def show_history(message):
     if not hasattr(message, 'from_user') or not message.from_user:
         bot.send_message(
             message.chat.id,
-            "❌ Ошибка: не удалось определить пользователя."
+            NO_USER_TEXT
         )
         return
     
@@ -424,68 +301,186 @@ def show_history(message):
     if not trip:
         bot.send_message(
             message.chat.id,
-            "❌ У вас нет активного путешествия.",
+            NO_ACTIVE_TRIP_TEXT,
             reply_markup=create_main_menu()
         )
         return
     
-    expenses = db.get_expenses(trip['id'], limit=20)
+    page = db.get_expenses_page(trip['id'], HISTORY_PAGE_SIZE)
+    text, keyboard = history_page(trip, page)
     
-    if not expenses:
-        history_text = (
-            f"📊 История расходов: {trip['name']}\n\n"
-            "Пока нет расходов."
+    bot.send_message(message.chat.id, text, reply_markup=keyboard)
+
+
+@router.callback(prefix="hist_")
+def callback_history_page(call):
+    """Переход по страницам истории: hist_<before|after>_<trip_id>_<id>_<created_at>"""
+    _, direction, trip_id, expense_id, created_at = call.data.split("_", 4)
+    trip = db.get_active_trip(call.from_user.id)
+    bot.answer_callback_query(call.id)
+
+    if not trip:
+        bot.send_message(call.message.chat.id, NO_ACTIVE_TRIP_TEXT,
+                         reply_markup=create_main_menu())
+        return
+
+    # Кнопки от другого путешествия (пользователь переключился) —
+    # показываем начало истории текущего
+    cursor = {}
+    if trip['id'] == int(trip_id) and direction in ("before", "after"):
+        cursor[direction] = (created_at, int(expense_id))
+    page = db.get_expenses_page(trip['id'], HISTORY_PAGE_SIZE, **cursor)
+    text, keyboard = history_page(trip, page)
+
+    bot.edit_message_text(text, call.message.chat.id, call.message.message_id,
+                          reply_markup=keyboard)
+
+
+@router.callback("stats")
+def callback_stats(call):
+    """Обработка нажатия на кнопку 'Статистика'"""
+    user_id = call.from_user.id
+    trip = db.get_active_trip(user_id)
+    
+    if not trip:
+        bot.answer_callback_query(call.id)
+        bot.send_message(
+            call.message.chat.id,
+            NO_ACTIVE_TRIP_HINT_TEXT,
+            reply_markup=create_main_menu()
         )
-    else:
-        history_text = f"📊 История расходов: {trip['name']}\n\n"
-        total_to = 0
-        total_from = 0
-        
-        for expense in expenses:
-            total_to += expense['amount_to']
-            total_from += expense['amount_from']
-            
-            # Форматируем дату и время
-            if expense['created_at']:
-                dt_str = expense['created_at']
-                if len(dt_str) >= 16:
-                    date_part = dt_str[:10]  # 2026-02-05
-                    time_part = dt_str[11:16]  # 16:06
-                    # Преобразуем дату из формата YYYY-MM-DD в DD.MM.YYYY
-                    date_parts = date_part.split('-')
-                    if len(date_parts) == 3:
-                        formatted_date = f"{date_parts[2]}.{date_parts[1]}.{date_parts[0]}"
-                        datetime_str = f"{formatted_date} {time_part}"
-                    else:
-                        datetime_str = dt_str[:16]
-                else:
-                    datetime_str = dt_str[:10] if len(dt_str) >= 10 else dt_str
-            else:
-                datetime_str = ""
-            
-            desc = expense['description'] or ""
-            history_text += (
-                f"📅 {datetime_str}\n"
-                f"   {format_number(expense['amount_to'])} {trip['to_currency']} = "
-                f"{format_number(expense['amount_from'])} {trip['from_currency']}\n"
-            )
-            if desc:
-                history_text += f"   💬 {desc}\n"
-            history_text += "\n"
-        
-        history_text += (
-            f"\n📊 Всего потрачено:\n"
-            f"   {format_number(total_to)} {trip['to_currency']} = "
-            f"{format_number(total_from)} {trip['from_currency']}"
+        return
+    
+    stats = db.get_trip_stats(trip['id'])
+    
+    bot.answer_callback_query(call.id)
+    bot.send_message(call.message.chat.id, stats_text(trip, stats), reply_markup=create_back_keyboard())
+
+
+def show_stats(message):
+    """Показать статистику расходов активного путешествия"""
+    if not hasattr(message, 'from_user') or not message.from_user:
+        bot.send_message(
+            message.chat.id,
+            NO_USER_TEXT
         )
+        return
     
-    keyboard = types.InlineKeyboardMarkup()
-    keyboard.add(types.InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu"))
+    trip = db.get_active_trip(message.from_user.id)
     
-    bot.send_message(message.chat.id, history_text, reply_markup=keyboard)
+    if not trip:
+        bot.send_message(
+            message.chat.id,
+            NO_ACTIVE_TRIP_HINT_TEXT,
+            reply_markup=create_main_menu()
+        )
+        return
+    
+    stats = db.get_trip_stats(trip['id'])
+    
+    bot.send_message(message.chat.id, stats_text(trip, stats), reply_markup=create_back_keyboard())
+
+
+def send_export(message):
+    """Выгрузка расходов файлом: активное путешествие или все (/export all), CSV или JSON Lines"""
+    if not hasattr(message, 'from_user') or not message.from_user:
+        bot.send_message(message.chat.id, NO_USER_TEXT)
+        return
+
+    user_id = message.from_user.id
+    fmt, all_trips = parse_export_args(message.text.split()[1:])
+
+    trip = None
+    if not all_trips:
+        trip = db.get_active_trip(user_id)
+        if not trip:
+            bot.send_message(message.chat.id, NO_ACTIVE_TRIP_HINT_TEXT, reply_markup=create_main_menu())
+            return
 
+    # Файл пишется на диск потоком: в памяти — только текущая пачка строк
+    with tempfile.TemporaryFile() as f:
+        count = write_export(db, user_id, f, fmt, trip['id'] if trip else None)
+        f.seek(0)
+        bot.send_document(message.chat.id, f, caption=export_caption(count, trip),
+                          visible_file_name=export_filename(fmt, trip))
 
-@bot.callback_query_handler(func=lambda call: call.data == "change_rate")
+
+def start_import(message):
+    """Начало импорта расходов из CSV-выписки"""
+    if not hasattr(message, 'from_user') or not message.from_user:
+        bot.send_message(message.chat.id, NO_USER_TEXT)
+        return
+
+    user_id = message.from_user.id
+    trip = db.get_active_trip(user_id)
+
+    if not trip:
+        bot.send_message(message.chat.id, NO_ACTIVE_TRIP_HINT_TEXT, reply_markup=create_main_menu())
+        return
+
+    set_user_state(user_id, "waiting_import_file", {"trip_id": trip['id']})
+    bot.send_message(message.chat.id, import_prompt_text(trip), reply_markup=create_back_keyboard())
+
+
+def download_document(file_id: str, fileobj):
+    """Скачивание файла из Telegram в fileobj частями (файл не читается в память целиком)"""
+    file_path = bot.get_file(file_id).file_path
+    url = (apihelper.FILE_URL or "https://api.telegram.org/file/bot{0}/{1}").format(BOT_TOKEN, file_path)
+    with requests.get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            fileobj.write(chunk)
+
+
+@bot.message_handler(content_types=['document'])
+@timed(HANDLER_SECONDS)
+def handle_document(message):
+    """Файл выписки для /import"""
+    if not hasattr(message, 'from_user') or not message.from_user:
+        return
+
+    user_id = message.from_user.id
+    state_data = get_user_state(user_id)
+
+    if state_data.get("state") != "waiting_import_file":
+        send_main_menu(message.chat.id, "📎 Чтобы загрузить расходы из выписки, отправьте /import")
+        return
+
+    if (message.document.file_size or 0) > MAX_FILE_SIZE:
+        bot.send_message(message.chat.id, "❌ Файл больше 20 МБ. Разделите выписку на части.",
+                         reply_markup=create_back_keyboard())
+        return
+
+    trip = db.get_active_trip(user_id)
+    if not trip or trip['id'] != state_data.get("data", {}).get("trip_id"):
+        clear_user_state(user_id)
+        send_main_menu(message.chat.id, NO_ACTIVE_TRIP_HINT_TEXT)
+        return
+
+    # Файл скачивается на диск и читается построчно; в памяти — только пачка строк
+    with tempfile.TemporaryFile() as f:
+        download_document(message.document.file_id, f)
+        f.seek(0)
+        try:
+            summary = import_expenses(db, trip, f)
+        except ValueError as e:
+            bot.send_message(message.chat.id,
+                             f"❌ Не удалось прочитать выписку: {e}\n\nОтправьте другой файл.",
+                             reply_markup=create_back_keyboard())
+            return
+
+    clear_user_state(user_id)
+    send_main_menu(message.chat.id, import_summary_text(db.get_active_trip(user_id), summary))
+
+
+@router.state("waiting_import_file")
+def handle_import_text(message, text: str):
+    """Текст вместо файла выписки: импорт отменяется, текст обрабатывается как обычно"""
+    clear_user_state(message.from_user.id)
+    handle_free_text(message, text)
+
+
+@router.callback("change_rate")
 def callback_change_rate(call):
     """Обработка нажатия на кнопку 'Изменить курс'"""
     user_id = call.from_user.id
@@ -495,7 +490,7 @@ def callback_change_rate(call):
         bot.answer_callback_query(call.id)
         bot.send_message(
             call.message.chat.id,
-            "❌ У вас нет активного путешествия.",
+            NO_ACTIVE_TRIP_TEXT,
             reply_markup=create_main_menu()
         )
         return
@@ -505,9 +500,7 @@ def callback_change_rate(call):
     bot.answer_callback_query(call.id)
     bot.send_message(
         call.message.chat.id,
-        f"💱 Изменение курса для путешествия: {trip['name']}\n\n"
-        f"Текущий курс: 1 {trip['from_currency']} = {format_number(trip['exchange_rate'])} {trip['to_currency']}\n\n"
-        f"Введите новый курс обмена (сколько {trip['to_currency']} за 1 {trip['from_currency']}):"
+        change_rate_text(trip)
     )
 
 
@@ -516,7 +509,7 @@ def start_change_rate(message):
     if not hasattr(message, 'from_user') or not message.from_user:
         bot.send_message(
             message.chat.id,
-            "❌ Ошибка: не удалось определить пользователя."
+            NO_USER_TEXT
         )
         return
     
@@ -527,7 +520,7 @@ def start_change_rate(message):
     if not trip:
         bot.send_message(
             message.chat.id,
-            "❌ У вас нет активного путешествия.",
+            NO_ACTIVE_TRIP_TEXT,
             reply_markup=create_main_menu()
         )
         return
@@ -536,19 +529,28 @@ def start_change_rate(message):
     
     bot.send_message(
         message.chat.id,
-        f"💱 Изменение курса для путешествия: {trip['name']}\n\n"
-        f"Текущий курс: 1 {trip['from_currency']} = {format_number(trip['exchange_rate'])} {trip['to_currency']}\n\n"
-        f"Введите новый курс обмена (сколько {trip['to_currency']} за 1 {trip['from_currency']}):"
+        change_rate_text(trip)
     )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "main_menu")
+@router.callback("main_menu")
 def callback_main_menu(call):
     """Обработка нажатия на кнопку 'Главное меню'"""
     send_main_menu(call.message.chat.id)
 
 
+@bot.message_handler(commands=['metrics'])
+@timed(HANDLER_SECONDS)
+def metrics_command(message):
+    """Сводка времени выполнения (только для ADMIN_IDS)"""
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    for part in metrics.split_message(metrics.summary_text()):
+        bot.send_message(message.chat.id, part)
+
+
 @bot.message_handler(func=lambda message: True)
+@timed(HANDLER_SECONDS)
 def handle_message(message):
     """Обработка всех текстовых сообщений"""
     # Получаем user_id с проверкой
@@ -564,94 +566,122 @@ def handle_message(message):
     # Проверяем команду /skip для пропуска наименования расхода
     if text.lower() == "/skip":
         if state == "waiting_expense_description":
-            handle_expense_description(message, text)
+            router.dispatch_message(state, message, text)
         return
     
     # Проверяем, не является ли это командой (команды обрабатываются отдельно)
     if text.startswith('/'):
         return
     
-    # Если пользователь в процессе создания путешествия
-    if state == "waiting_from_country":
-        handle_from_country(message, text)
-        return
-    elif state == "waiting_to_country":
-        handle_to_country(message, text)
-        return
-    elif state == "waiting_rate_confirmation":
-        # Это обрабатывается через callback
-        return
-    elif state == "waiting_manual_rate":
-        handle_manual_rate(message, text)
-        return
-    elif state == "waiting_initial_amount":
-        handle_initial_amount(message, text)
-        return
-    elif state == "waiting_new_rate":
-        handle_new_rate(message, text)
-        return
-    elif state == "waiting_expense_confirmation":
-        # Это обрабатывается через callback
-        return
-    elif state == "waiting_expense_description":
-        handle_expense_description(message, text)
-        return
-    
-    # Если состояние не установлено, проверяем, является ли сообщение числом (расход)
+    router.dispatch_message(state, message, text)
+
+
+@bot.callback_query_handler(func=lambda call: True)
+@timed(HANDLER_SECONDS)
+def handle_callback(call):
+    """Обработка нажатий: обработчик выбирается по callback_data из таблицы router"""
+    router.dispatch_callback(call)
+
+
+@router.default
+def handle_free_text(message, text: str):
+    """Текст вне диалога: число считается расходом, строки "сумма описание" — списком расходов"""
     if is_number(text):
-        handle_expense_input(message, float(text.replace(",", ".")))
+        handle_expense_input(message, parse_amount(text))
+        return
+    expenses = parse_expense_lines(text)
+    if expenses:
+        handle_bulk_expense_input(message, expenses)
     else:
         # Неизвестная команда или текст
-        send_main_menu(message.chat.id, "❓ Не понимаю команду. Используйте меню ниже:")
+        send_main_menu(message.chat.id, UNKNOWN_COMMAND_TEXT)
 
 
 def is_number(text: str) -> bool:
     """Проверка, является ли текст числом"""
-    try:
-        # Заменяем запятую на точку для русской локали
-        text = text.replace(",", ".").replace(" ", "")
-        float(text)
-        return True
-    except ValueError:
-        return False
+    # Допускается запятая как десятичный разделитель (русская локаль)
+    return parse_amount(text) is not None
+
+
+def resolve_country_or_ask(chat_id: int, country_name: str, retry_text: str) -> Optional[Country]:
+    """Страна по вводу пользователя; если не определена — просим уточнить"""
+    query = country_name.strip()
+    resolution = resolve_country(query)
+    # Без валюты (Антарктика) страну выбрать нельзя
+    candidates = [country for country in resolution.candidates if country.currency]
+    if candidates:
+        text, keyboard = country_suggestions(query, candidates)
+        bot.send_message(chat_id, text, reply_markup=keyboard)
+        return None
+    if not resolution.found or not resolution.country.currency:
+        bot.send_message(
+            chat_id,
+            f"❌ Не удалось определить валюту для страны '{query}'.\n\n" + retry_text
+        )
+        return None
+    return resolution.country
+
+
+@router.callback(prefix="country_")
+def callback_country(call):
+    """Выбор страны из предложенных вариантов"""
+    user_id = call.from_user.id
+    country = get_country(call.data[len("country_"):])
+    state = get_user_state(user_id).get("state")
+    select = {
+        "waiting_from_country": select_from_country,
+        "waiting_to_country": select_to_country
+    }.get(state)
+    if country is None or select is None:
+        bot.answer_callback_query(call.id, "❌ Ошибка состояния")
+        return
+    bot.answer_callback_query(call.id)
+    select(call.message.chat.id, user_id, country)
 
 
+@router.state("waiting_from_country")
 def handle_from_country(message, country_name: str):
     """Обработка ввода страны отправления"""
     if not hasattr(message, 'from_user') or not message.from_user:
         return
     
-    user_id = message.from_user.id
-    # Нормализуем ввод: убираем лишние пробелы и приводим к нижнему регистру для поиска
-    country_normalized = country_name.strip()
-    currency = get_currency_by_country(country_normalized)
-    
-    if not currency:
-        bot.send_message(
-            message.chat.id,
-            f"❌ Не удалось определить валюту для страны '{country_name}'.\n\n"
-            "Пожалуйста, введите название страны ещё раз (например: Россия, Russia, RU):"
-        )
-        return
-    
+    country = resolve_country_or_ask(
+        message.chat.id, country_name,
+        "Пожалуйста, введите название страны ещё раз (например: Россия, Russia, RU):"
+    )
+    if country:
+        select_from_country(message.chat.id, message.from_user.id, country)
+
+
+def select_from_country(chat_id: int, user_id: int, country: Country):
+    """Страна отправления выбрана: запрашиваем страну назначения"""
     set_user_state(user_id, "waiting_to_country", {
-        "from_country": country_normalized,
-        "from_currency": currency
+        "from_country": country.name_ru,
+        "from_currency": country.currency
     })
-    
+
     bot.send_message(
-        message.chat.id,
-        f"✅ Страна отправления: {country_normalized} ({currency})\n\n"
+        chat_id,
+        f"✅ Страна отправления: {country.name_ru} ({country.currency})\n\n"
         "Введите страну назначения (например: Китай, China, CN):"
     )
 
 
+@router.state("waiting_to_country")
 def handle_to_country(message, country_name: str):
     """Обработка ввода страны назначения"""
     if not hasattr(message, 'from_user') or not message.from_user:
         return
     
-    user_id = message.from_user.id
+    country = resolve_country_or_ask(
+        message.chat.id, country_name, "Пожалуйста, введите название страны ещё раз:"
+    )
+    if country:
+        select_to_country(message.chat.id, message.from_user.id, country)
+
+
+def select_to_country(chat_id: int, user_id: int, country: Country):
+    """Страна назначения выбрана: получаем курс и просим его подтвердить"""
     state_data = get_user_state(user_id)
     data = state_data.get("data", {})
     from_country = data.get("from_country")
@@ -659,28 +689,18 @@ def handle_to_country(message, country_name: str):
     
     if not from_country or not from_currency:
         bot.send_message(
-            message.chat.id,
+            chat_id,
             "❌ Ошибка состояния. Начните создание путешествия заново.",
             reply_markup=create_main_menu()
         )
         clear_user_state(user_id)
         return
     
-    # Нормализуем ввод
-    country_normalized = country_name.strip()
-    currency = get_currency_by_country(country_normalized)
-    
-    if not currency:
-        bot.send_message(
-            message.chat.id,
-            f"❌ Не удалось определить валюту для страны '{country_normalized}'.\n\n"
-            "Пожалуйста, введите название страны ещё раз:"
-        )
-        return
-    
+    currency = country.currency
+
     if currency == from_currency:
         bot.send_message(
-            message.chat.id,
+            chat_id,
             "❌ Валюты стран отправления и назначения совпадают.\n\n"
             "Введите другую страну назначения:"
         )
@@ -688,10 +708,12 @@ def handle_to_country(message, country_name: str):
     
     to_currency = currency
     
-    # Проверяем доступность валют в API
-    if not check_currency_available(from_currency):
+    # Проверяем доступность валют и получаем курс одним запросом
+    rate_data = validate_pair_and_quote(from_currency, to_currency)
+    
+    if not rate_data["from_available"]:
         bot.send_message(
-            message.chat.id,
+            chat_id,
             f"❌ Валюта {from_currency} недоступна в API.\n\n"
             "Пожалуйста, начните создание путешествия заново.",
             reply_markup=create_main_menu()
@@ -699,21 +721,18 @@ def handle_to_country(message, country_name: str):
         clear_user_state(user_id)
         return
     
-    if not check_currency_available(to_currency):
+    if not rate_data["to_available"]:
         bot.send_message(
-            message.chat.id,
+            chat_id,
             f"❌ Валюта {to_currency} недоступна в API.\n\n"
             "Пожалуйста, введите другую страну назначения:"
         )
         return
     
-    # Получаем курс обмена
-    rate_data = get_exchange_rate(from_currency, to_currency)
-    
-    if not rate_data or not rate_data.get("success"):
-        error_msg = rate_data.get("error", "Неизвестная ошибка") if rate_data else "Ошибка запроса"
+    if not rate_data["success"]:
+        error_msg = rate_data.get("error", "Неизвестная ошибка")
         bot.send_message(
-            message.chat.id,
+            chat_id,
             f"❌ Ошибка при получении курса обмена: {error_msg}\n\n"
             "Пожалуйста, попробуйте позже или начните заново.",
             reply_markup=create_main_menu()
@@ -721,33 +740,34 @@ def handle_to_country(message, country_name: str):
         clear_user_state(user_id)
         return
     
-    rate = rate_data["rate"]
+    rate = normalize_rate(rate_data["rate"])
     
     # Сохраняем данные и запрашиваем подтверждение курса
     set_user_state(user_id, "waiting_rate_confirmation", {
         "from_country": from_country,
-        "to_country": country_normalized,
+        "to_country": country.name_ru,
         "from_currency": from_currency,
         "to_currency": to_currency,
-        "rate": rate
+        "rate": rate,
+        # Котировка, которую подтверждает пользователь: переиспользуется
+        # при конвертации начальной суммы, пока не устарела
+        "quote": {
+            "quote_id": rate_data["quote_id"],
+            "timestamp": rate_data["timestamp"],
+            "rate": rate,
+            "source": from_currency,
+            "target": to_currency
+        }
     })
     
-    keyboard = types.InlineKeyboardMarkup()
-    keyboard.add(
-        types.InlineKeyboardButton("✅ Да", callback_data="rate_yes"),
-        types.InlineKeyboardButton("❌ Нет", callback_data="rate_no")
-    )
-    
     bot.send_message(
-        message.chat.id,
-        f"💱 Курс обмена:\n\n"
-        f"1 {from_currency} = {format_number(rate)} {to_currency}\n\n"
-        f"Подходит ли этот курс?",
-        reply_markup=keyboard
+        chat_id,
+        rate_offer_text(from_currency, to_currency, rate),
+        reply_markup=create_yes_no_keyboard("rate_yes", "rate_no")
     )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "rate_yes")
+@router.callback("rate_yes")
 def callback_rate_yes(call):
     """Подтверждение курса"""
     user_id = call.from_user.id
@@ -767,13 +787,13 @@ def callback_rate_yes(call):
     
     bot.edit_message_text(
         f"✅ Курс подтверждён!\n\n"
-        f"Введите начальную сумму в {format_currency_name(data['from_currency'])}:",
+        f"{initial_amount_prompt(data['from_currency'])}",
         call.message.chat.id,
         call.message.message_id
     )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "rate_no")
+@router.callback("rate_no")
 def callback_rate_no(call):
     """Отказ от курса, запрос ручного ввода"""
     user_id = call.from_user.id
@@ -797,6 +817,7 @@ def callback_rate_no(call):
     )
 
 
+@router.state("waiting_manual_rate")
 def handle_manual_rate(message, rate_text: str):
     """Обработка ручного ввода курса"""
     user_id = message.from_user.id
@@ -808,7 +829,7 @@ def handle_manual_rate(message, rate_text: str):
         )
         return
     
-    rate = float(rate_text.replace(",", "."))
+    rate = normalize_rate(parse_amount(rate_text))
     
     if rate <= 0:
         bot.send_message(
@@ -819,15 +840,24 @@ def handle_manual_rate(message, rate_text: str):
     
     state_data = get_user_state(user_id)
     state_data["data"]["rate"] = rate
+    # Курс, введённый вручную, не заменяется курсом из API
+    state_data["data"]["quote"] = {
+        "quote_id": uuid.uuid4().hex,
+        "rate": rate,
+        "source": state_data["data"]["from_currency"],
+        "target": state_data["data"]["to_currency"],
+        "manual": True
+    }
     set_user_state(user_id, "waiting_initial_amount", state_data["data"])
     
     bot.send_message(
         message.chat.id,
         f"✅ Курс установлен: 1 {state_data['data']['from_currency']} = {format_number(rate)} {state_data['data']['to_currency']}\n\n"
-        f"Введите начальную сумму в {format_currency_name(state_data['data']['from_currency'])}:"
+        f"{initial_amount_prompt(state_data['data']['from_currency'])}"
     )
 
 
+@router.state("waiting_initial_amount")
 def handle_initial_amount(message, amount_text: str):
     """Обработка ввода начальной суммы"""
     user_id = message.from_user.id
@@ -839,7 +869,7 @@ def handle_initial_amount(message, amount_text: str):
         )
         return
     
-    amount_from = float(amount_text.replace(",", "."))
+    amount_from = parse_amount(amount_text)
     
     if amount_from <= 0:
         bot.send_message(
@@ -860,23 +890,32 @@ def handle_initial_amount(message, amount_text: str):
         clear_user_state(user_id)
         return
     
-    rate = data.get("rate", 1.0)
+    amount_from = quantize(amount_from, data["from_currency"])
+    rate = normalize_rate(data.get("rate", 1))
+    quote = data.get("quote")
     
-    # Конвертируем через API для точности
-    conversion = convert_currency(amount_from, data["from_currency"], data["to_currency"])
+    # Конвертируем по подтверждённой котировке; к API обращаемся,
+    # только если она устарела
+    conversion = convert_currency(amount_from, data["from_currency"], data["to_currency"],
+                                  quote=quote)
     
     if not conversion or not conversion.get("success"):
         # Используем сохранённый курс, если API недоступен
-        amount_to = amount_from * rate
+        amount_to = quantize(amount_from * rate, data["to_currency"])
         bot.send_message(
             message.chat.id,
             "⚠️ Не удалось получить актуальный курс через API. Используется сохранённый курс."
         )
     else:
-        amount_to = conversion["converted_amount"]
-        # Обновляем курс на актуальный из API
-        rate = conversion["rate"]
+        if quote and conversion.get("quote_id") != quote.get("quote_id"):
+            # Подтверждённый курс устарел — используем актуальный из API
+            bot.send_message(
+                message.chat.id,
+                "ℹ️ Подтверждённый курс устарел. Используется актуальный курс."
+            )
+        rate = normalize_rate(conversion["rate"])
         data["rate"] = rate
+        amount_to = quantize(amount_from * rate, data["to_currency"])
     
     # Создаём название путешествия
     trip_name = f"{data['from_country']} → {data['to_country']}"
@@ -896,20 +935,12 @@ def handle_initial_amount(message, amount_text: str):
     
     clear_user_state(user_id)
     
-    success_text = (
-        f"✅ Путешествие создано!\n\n"
-        f"📍 {trip_name}\n"
-        f"💱 Курс: 1 {data['from_currency']} = {format_number(rate)} {data['to_currency']}\n\n"
-        f"💰 Начальный баланс:\n"
-        f"   {format_number(amount_to)} {data['to_currency']} = "
-        f"{format_number(amount_from)} {data['from_currency']}\n\n"
-        f"Теперь вы можете вводить суммы расходов, и я буду их конвертировать!"
-    )
+    success_text = trip_created_text(trip_name, data, rate, amount_from, amount_to)
     
     send_main_menu(message.chat.id, success_text)
 
 
-def handle_expense_input(message, amount: float):
+def handle_expense_input(message, amount: Decimal):
     """Обработка ввода суммы расхода"""
     user_id = message.from_user.id
     
@@ -920,18 +951,16 @@ def handle_expense_input(message, amount: float):
     trip = db.get_active_trip(user_id)
     
     if not trip:
-        send_main_menu(
-            message.chat.id,
-            "❌ У вас нет активного путешествия.\n\n"
-            "Создайте новое путешествие или выберите существующее."
-        )
+        send_main_menu(message.chat.id, NO_ACTIVE_TRIP_HINT_TEXT)
         return
     
     # Конвертируем расход в домашнюю валюту используя курс из базы данных
     # Курс хранится как: сколько to_currency за 1 from_currency
     # Для обратной конвертации (to_currency -> from_currency) нужно делить на курс
     rate = trip['exchange_rate']
-    amount_from = amount / rate  # Обратная конвертация: amount_to / rate = amount_from
+    amount = quantize(amount, trip['to_currency'])
+    # Обратная конвертация: amount_to / rate = amount_from
+    amount_from = quantize(amount / rate, trip['from_currency'])
     
     # Сохраняем данные для подтверждения
     set_user_state(user_id, "waiting_expense_confirmation", {
@@ -940,22 +969,14 @@ def handle_expense_input(message, amount: float):
         "amount_from": amount_from
     })
     
-    keyboard = types.InlineKeyboardMarkup()
-    keyboard.add(
-        types.InlineKeyboardButton("✅ Да", callback_data="expense_yes"),
-        types.InlineKeyboardButton("❌ Нет", callback_data="expense_no")
-    )
-    
     bot.send_message(
         message.chat.id,
-        f"💵 {format_number(amount)} {trip['to_currency']} = "
-        f"{format_number(amount_from)} {trip['from_currency']}\n\n"
-        f"Учесть как расход?",
-        reply_markup=keyboard
+        expense_prompt_text(trip, amount, amount_from),
+        reply_markup=create_yes_no_keyboard("expense_yes", "expense_no")
     )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "expense_yes")
+@router.callback("expense_yes")
 def callback_expense_yes(call):
     """Подтверждение расхода"""
     user_id = call.from_user.id
@@ -996,17 +1017,13 @@ def callback_expense_yes(call):
     })
     
     bot.edit_message_text(
-        f"✅ Расход учтён!\n\n"
-        f"💰 Остаток:\n"
-        f"   {format_number(trip['balance_to'])} {trip['to_currency']} = "
-        f"{format_number(trip['balance_from'])} {trip['from_currency']}\n\n"
-        f"💬 Введите наименование расхода (или отправьте /skip чтобы пропустить):",
+        expense_saved_text(trip),
         call.message.chat.id,
         call.message.message_id
     )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "expense_no")
+@router.callback("expense_no")
 def callback_expense_no(call):
     """Отмена расхода"""
     user_id = call.from_user.id
@@ -1019,6 +1036,84 @@ def callback_expense_no(call):
     )
 
 
+def handle_bulk_expense_input(message, expenses: List[Tuple[Decimal, str]]):
+    """Обработка списка расходов: одно подтверждение на все строки"""
+    user_id = message.from_user.id
+
+    trip = db.get_active_trip(user_id)
+
+    if not trip:
+        send_main_menu(message.chat.id, NO_ACTIVE_TRIP_HINT_TEXT)
+        return
+
+    rate = trip['exchange_rate']
+    converted = []
+    for amount, description in expenses:
+        amount = quantize(amount, trip['to_currency'])
+        converted.append((amount, quantize(amount / rate, trip['from_currency']), description))
+
+    set_user_state(user_id, "waiting_bulk_expense_confirmation", {
+        "trip_id": trip['id'],
+        "expenses": converted
+    })
+
+    bot.send_message(
+        message.chat.id,
+        bulk_expense_prompt_text(trip, converted),
+        reply_markup=create_yes_no_keyboard("bulk_expense_yes", "bulk_expense_no")
+    )
+
+
+@router.callback("bulk_expense_yes")
+def callback_bulk_expense_yes(call):
+    """Подтверждение списка расходов: все строки одной транзакцией"""
+    user_id = call.from_user.id
+    state_data = get_user_state(user_id)
+
+    if state_data.get("state") != "waiting_bulk_expense_confirmation":
+        bot.answer_callback_query(call.id, "❌ Ошибка состояния")
+        return
+
+    data = state_data.get("data", {})
+    if not data or "trip_id" not in data:
+        bot.answer_callback_query(call.id, "❌ Ошибка данных")
+        return
+
+    count = db.add_expenses(data["trip_id"], [tuple(expense) for expense in data["expenses"]])
+    clear_user_state(user_id)
+
+    trip = db.get_active_trip(user_id)
+
+    if not trip:
+        bot.edit_message_text(
+            "❌ Ошибка: путешествие не найдено",
+            call.message.chat.id,
+            call.message.message_id
+        )
+        return
+
+    bot.edit_message_text(
+        bulk_expense_saved_text(trip, count),
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=create_main_menu()
+    )
+
+
+@router.callback("bulk_expense_no")
+def callback_bulk_expense_no(call):
+    """Отмена списка расходов"""
+    user_id = call.from_user.id
+    clear_user_state(user_id)
+
+    bot.edit_message_text(
+        "❌ Расходы не учтены.",
+        call.message.chat.id,
+        call.message.message_id
+    )
+
+
+@router.state("waiting_expense_description")
 def handle_expense_description(message, description: str):
     """Обработка ввода наименования расхода"""
     user_id = message.from_user.id
@@ -1058,6 +1153,7 @@ def handle_expense_description(message, description: str):
     )
 
 
+@router.state("waiting_new_rate")
 def handle_new_rate(message, rate_text: str):
     """Обработка нового курса"""
     user_id = message.from_user.id
@@ -1070,7 +1166,7 @@ def handle_new_rate(message, rate_text: str):
         )
         return
     
-    rate = float(rate_text.replace(",", "."))
+    rate = normalize_rate(parse_amount(rate_text))
     
     if rate <= 0:
         bot.send_message(
@@ -1098,15 +1194,49 @@ def handle_new_rate(message, rate_text: str):
     
     bot.send_message(
         message.chat.id,
-        f"✅ Курс обновлён!\n\n"
-        f"Новый курс: 1 {trip['from_currency']} = {format_number(rate)} {trip['to_currency']}\n\n"
-        f"💰 Баланс пересчитан:\n"
-        f"   {format_number(trip['balance_to'])} {trip['to_currency']} = "
-        f"{format_number(trip['balance_from'])} {trip['from_currency']}",
+        rate_updated_text(trip, rate),
         reply_markup=create_main_menu()
     )
 
 
+def run_webhook():
+    """Приём обновлений через webhook до получения SIGINT/SIGTERM"""
+    from webhook import WebhookServer
+
+    if not WEBHOOK_SECRET:
+        raise ValueError("WEBHOOK_SECRET не найден в переменных окружения!")
+
+    server = WebhookServer(
+        bot.process_new_updates,
+        host=WEBHOOK_HOST,
+        port=WEBHOOK_PORT,
+        path=WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        batch_size=WEBHOOK_BATCH_SIZE
+    )
+    stop_event = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop_event.set())
+
+    server.start()
+    if WEBHOOK_URL:
+        bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+    print(f"🌐 Webhook слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    stop_event.wait()
+    # Сначала перестаём принимать запросы и передаём принятое в обработку,
+    # затем дожидаемся обработчиков
+    server.stop()
+
+
 if __name__ == "__main__":
+    init_supported_currencies()
+    metrics.start_from_env()
     print("🚀 Бот запущен!")
-    bot.infinity_polling(none_stop=True)
+    try:
+        if UPDATE_MODE == "webhook":
+            run_webhook()
+        else:
+            bot.infinity_polling(none_stop=True)
+    finally:
+        update_dispatcher.shutdown()
+        close_state_store()
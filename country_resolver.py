@@ -0,0 +1,215 @@
+"""
+Определение страны по введённому названию
+
+Данные — data/countries.json: все страны ISO 3166-1 с кодами alpha-2/alpha-3,
+названиями на русском и английском, официальными и местными названиями,
+распространёнными вариантами написания и валютой (ISO 4217).
+
+При первом обращении строится неизменяемый индекс:
+- точный: нормализованное название -> страны. Нормализация: регистр
+  (casefold), удаление диакритики, транслитерация кириллицы в латиницу,
+  знаки препинания -> пробелы. "Таиланд", "Тайланд" и "Thailand",
+  "Korea, Republic of" и "korea republic of" дают одинаковые ключи;
+- триграммный: триграмма -> названия, для поиска с опечатками
+  (сходство Дайса по общим триграммам).
+
+Результат resolve — страна, несколько вариантов на выбор (неоднозначный
+ввод: "Конго", опечатка, близкая к нескольким названиям) или ничего.
+Повторные запросы обслуживаются кэшем.
+"""
+import json
+import os
+import re
+import threading
+import unicodedata
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "countries.json")
+
+# Порог сходства, при котором страна определяется без вопросов, и насколько
+# лучший вариант должен опережать следующий
+ACCEPT_SCORE = 0.7
+ACCEPT_MARGIN = 0.1
+# Минимальное сходство варианта, который предлагается на выбор
+SUGGEST_SCORE = 0.35
+MAX_SUGGESTIONS = 4
+# Более короткий ввод ищется только точно (коды стран, аббревиатуры)
+MIN_FUZZY_LENGTH = 4
+
+_TRANSLIT = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ж": "zh", "з": "z",
+    "и": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r",
+    "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh",
+    "щ": "shch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+    # Украинский, белорусский, казахский и т.п.
+    "і": "i", "ї": "i", "є": "e", "ґ": "g", "ў": "u", "қ": "k", "ғ": "g", "ң": "n",
+    "ө": "o", "ұ": "u", "ү": "u", "һ": "h", "ҷ": "j", "ә": "a",
+    "ʻ": "", "'": "", "’": "", "ß": "ss", "ə": "a", "ı": "i", "ø": "o", "æ": "ae",
+})
+_NON_WORD_RE = re.compile(r"[\W_]+")
+
+
+def normalize(text: str) -> str:
+    """Ключ поиска: без регистра, диакритики и пунктуации, кириллица — латиницей"""
+    # NFKD отделяет диакритику (й -> и + кратка, ё -> е + диерезис, é -> e + акут)
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return _NON_WORD_RE.sub(" ", stripped.translate(_TRANSLIT)).strip()
+
+
+def _trigrams(key: str) -> FrozenSet[str]:
+    padded = f"  {key} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class Country:
+    __slots__ = ("alpha2", "alpha3", "numeric", "name_ru", "name_en", "currency")
+
+    def __init__(self, alpha2: str, alpha3: str, numeric: str, name_ru: str, name_en: str,
+                 currency: Optional[str]):
+        self.alpha2 = alpha2
+        self.alpha3 = alpha3
+        self.numeric = numeric
+        self.name_ru = name_ru
+        self.name_en = name_en
+        self.currency = currency
+
+    def __repr__(self) -> str:
+        return f"Country({self.alpha2}, {self.name_ru}, {self.currency})"
+
+
+class Resolution:
+    """Результат resolve: country — если страна определена однозначно"""
+
+    __slots__ = ("country", "candidates")
+
+    def __init__(self, country: Optional[Country] = None, candidates: Tuple[Country, ...] = ()):
+        self.country = country
+        # Варианты на выбор при неоднозначном вводе
+        self.candidates = candidates
+
+    @property
+    def found(self) -> bool:
+        return self.country is not None
+
+    @property
+    def ambiguous(self) -> bool:
+        return self.country is None and bool(self.candidates)
+
+
+class _Index:
+    def __init__(self, countries: List[Country], names: List[Tuple[str, Country]]):
+        self.countries: Dict[str, Country] = {country.alpha2: country for country in countries}
+        exact: Dict[str, List[Country]] = {}
+        for name, country in names:
+            key = normalize(name)
+            if key and country not in exact.setdefault(key, []):
+                exact[key].append(country)
+        self.exact: Dict[str, Tuple[Country, ...]] = {
+            key: tuple(matches) for key, matches in exact.items()
+        }
+
+        # Для нечёткого поиска — только названия (коды ищутся точно)
+        self.keys: List[str] = [key for key in self.exact if len(key) >= MIN_FUZZY_LENGTH]
+        self.key_sizes: List[int] = []
+        postings: Dict[str, List[int]] = {}
+        for key_id, key in enumerate(self.keys):
+            grams = _trigrams(key)
+            self.key_sizes.append(len(grams))
+            for gram in grams:
+                postings.setdefault(gram, []).append(key_id)
+        self.postings: Dict[str, Tuple[int, ...]] = {
+            gram: tuple(ids) for gram, ids in postings.items()
+        }
+
+    def fuzzy(self, key: str) -> List[Tuple[float, Country]]:
+        """Страны по убыванию сходства названия с key"""
+        grams = _trigrams(key)
+        shared: Dict[int, int] = {}
+        for gram in grams:
+            for key_id in self.postings.get(gram, ()):
+                shared[key_id] = shared.get(key_id, 0) + 1
+
+        size = len(grams)
+        best: Dict[str, Tuple[float, Country]] = {}
+        for key_id, count in shared.items():
+            score = 2.0 * count / (size + self.key_sizes[key_id])
+            if score < SUGGEST_SCORE:
+                continue
+            for country in self.exact[self.keys[key_id]]:
+                previous = best.get(country.alpha2)
+                if previous is None or score > previous[0]:
+                    best[country.alpha2] = (score, country)
+        return sorted(best.values(), key=lambda item: (-item[0], item[1].name_ru))
+
+
+_index: Optional[_Index] = None
+_index_lock = threading.Lock()
+
+
+def load_index(path: str = DATA_PATH) -> _Index:
+    """Загрузка data/countries.json и построение индекса (один раз на процесс)"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+                countries = []
+                names = []
+                for item in data["countries"]:
+                    country = Country(item["alpha2"], item["alpha3"], item["numeric"],
+                                      item["name_ru"], item["name_en"], item["currency"])
+                    countries.append(country)
+                    for name in (country.alpha2, country.alpha3, country.name_ru,
+                                 country.name_en, *item["aliases"]):
+                        names.append((name, country))
+                _index = _Index(countries, names)
+    return _index
+
+
+@lru_cache(maxsize=4096)
+def _resolve_key(key: str) -> Resolution:
+    index = load_index()
+    matches = index.exact.get(key)
+    if matches:
+        if len(matches) == 1:
+            return Resolution(matches[0])
+        return Resolution(candidates=matches[:MAX_SUGGESTIONS])
+    if len(key) < MIN_FUZZY_LENGTH:
+        return Resolution()
+
+    ranked = index.fuzzy(key)
+    if not ranked:
+        return Resolution()
+    best_score, best = ranked[0]
+    runner_up = ranked[1][0] if len(ranked) > 1 else 0.0
+    if best_score >= ACCEPT_SCORE and best_score - runner_up >= ACCEPT_MARGIN:
+        return Resolution(best)
+    return Resolution(candidates=tuple(country for _, country in ranked[:MAX_SUGGESTIONS]))
+
+
+def resolve(text: str) -> Resolution:
+    """
+    Определение страны по названию, коду или варианту написания
+
+    Args:
+        text: Ввод пользователя ("Тайланд", "Korea, Republic of", "Deutschland", "DE")
+
+    Returns:
+        Resolution: country — страна, если определена однозначно; иначе
+        candidates — варианты на выбор (пусто, если ничего похожего нет)
+    """
+    return _resolve_key(normalize(text))
+
+
+def get_country(alpha2: str) -> Optional[Country]:
+    """Страна по коду ISO 3166-1 alpha-2"""
+    return load_index().countries.get(alpha2.upper())
+
+
+def all_currencies() -> FrozenSet[str]:
+    """Валюты всех стран справочника"""
+    return frozenset(country.currency for country in load_index().countries.values()
+                     if country.currency)
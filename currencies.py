@@ -0,0 +1,92 @@
+"""
+Справочник валют
+
+Данные — data/currencies.json: для каждой валюты ISO 4217 название на
+русском, формы единицы измерения для 1, 2 и 5 ("рубль", "рубля",
+"рублей"), число знаков после запятой (минимальная единица) и символ.
+
+Справочник загружается при первом обращении и дальше не изменяется.
+"""
+import json
+import os
+import threading
+from decimal import Decimal
+from types import MappingProxyType
+from typing import Mapping, Optional, Tuple, Union
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "currencies.json")
+
+# Число знаков после запятой для валют, которых нет в справочнике
+DEFAULT_EXPONENT = 2
+
+
+def plural_form(amount: Union[Decimal, int], forms: Tuple[str, str, str]) -> str:
+    """Форма слова для числа: forms — формы для 1, 2 и 5 ("день", "дня", "дней")"""
+    if isinstance(amount, Decimal) and amount != amount.to_integral_value():
+        # Дробное число согласуется с формой родительного падежа единственного числа
+        return forms[1]
+    n = abs(int(amount))
+    if n % 10 == 1 and n % 100 != 11:
+        return forms[0]
+    if 2 <= n % 10 <= 4 and not 12 <= n % 100 <= 14:
+        return forms[1]
+    return forms[2]
+
+
+class Currency:
+    __slots__ = ("code", "name_ru", "plural", "exponent", "symbol")
+
+    def __init__(self, code: str, name_ru: str, plural: Tuple[str, str, str], exponent: int,
+                 symbol: str):
+        self.code = code
+        self.name_ru = name_ru
+        # Формы для 1, 2 и 5 единиц
+        self.plural = plural
+        self.exponent = exponent
+        self.symbol = symbol
+
+    def plural_form(self, amount: Union[Decimal, int]) -> str:
+        """Единица валюты, согласованная с числом: 1 рубль, 2 рубля, 5 рублей, 1,5 рубля"""
+        return plural_form(amount, self.plural)
+
+    def __repr__(self) -> str:
+        return f"Currency({self.code}, {self.exponent})"
+
+
+_currencies: Optional[Mapping[str, Currency]] = None
+_currencies_lock = threading.Lock()
+
+
+def load_currencies(path: str = DATA_PATH) -> Mapping[str, Currency]:
+    """Загрузка data/currencies.json (один раз на процесс); код -> Currency"""
+    global _currencies
+    if _currencies is None:
+        with _currencies_lock:
+            if _currencies is None:
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+                _currencies = MappingProxyType({
+                    item["code"]: Currency(item["code"], item["name_ru"], tuple(item["plural"]),
+                                           item["exponent"], item["symbol"])
+                    for item in data["currencies"]
+                })
+    return _currencies
+
+
+def get_currency(code: str) -> Optional[Currency]:
+    """Валюта по коду ISO 4217"""
+    return (_currencies or load_currencies()).get(code)
+
+
+def get_exponent(code: str) -> int:
+    """Число знаков после запятой для валюты"""
+    currency = (_currencies or load_currencies()).get(code)
+    return currency.exponent if currency else DEFAULT_EXPONENT
+
+
+def format_currency_name(currency_code: str) -> str:
+    """Форматирование названия валюты для отображения: "рублей (RUB)" """
+    currency = get_currency(currency_code)
+    if currency is None:
+        return f"({currency_code})"
+    return f"{currency.plural[2]} ({currency_code})"
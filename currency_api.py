@@ -1,64 +1,279 @@
 """
 Модуль для работы с API exchangerate.host
-Использует функции из current_api.py
+Все запросы выполняются через общий клиент provider_client
+
+Функции с префиксом async_ — то же для асинхронной версии бота: матрица
+и кэш курсов общие, запросы выполняются через AsyncRateProviderClient.
 """
+import asyncio
 import requests
 from dotenv import load_dotenv
 import os
+import time
+import uuid
+from decimal import Decimal
 from typing import Optional, Dict
 
+from metrics import CURRENCY_SECONDS, timed
+from money import to_decimal
+from provider_client import DeadlineExceeded, get_async_client, get_client
+from rate_cache import RateCache
+from rate_matrix import RateMatrix
+from supported_currencies import SupportedCurrencies
+
 load_dotenv()
-API_KEY = os.getenv("CURRENCY_API_KEY")
+
+# Общий кэш курсов: время жизни записи (сек) и максимальное число пар
+RATE_CACHE_TTL = float(os.getenv("RATE_CACHE_TTL", "300"))
+RATE_CACHE_MAX_SIZE = int(os.getenv("RATE_CACHE_MAX_SIZE", "1024"))
+
+# Базовая валюта матрицы курсов: все котировки запрашиваются относительно неё
+RATE_MATRIX_BASE = os.getenv("RATE_MATRIX_BASE", "USD")
+# Пауза после неудачного обновления матрицы (сек): пока она не истекла,
+# курсы запрашиваются по парам или берутся из устаревшей матрицы
+RATE_MATRIX_RETRY_AFTER = float(os.getenv("RATE_MATRIX_RETRY_AFTER", "30"))
+
+# Максимальный возраст подтверждённого пользователем курса (сек): более старый
+# курс при конвертации запрашивается заново
+QUOTE_MAX_AGE = float(os.getenv("QUOTE_MAX_AGE", "600"))
+
+# Период обновления списка поддерживаемых валют (сек)
+SUPPORTED_CURRENCIES_REFRESH = float(os.getenv("SUPPORTED_CURRENCIES_REFRESH", "86400"))
+
+
+def _fetch_quotes(base: str, currencies: list) -> Dict[str, float]:
+    """
+    Запрос котировок всех валют относительно base одним вызовом /live
+
+    Returns:
+        Словарь {код валюты: сколько валюты за 1 base}
+    """
+    return _parse_quotes(get_client().live(base, currencies), base)
+
+
+def _parse_quotes(data: Dict, base: str) -> Dict[str, float]:
+    """Котировки из ответа /live: {код валюты: сколько валюты за 1 base}"""
+    if data.get("success") is False:
+        return {}
+    quotes = data.get("quotes", {})
+    return {key[len(base):]: rate for key, rate in quotes.items() if key.startswith(base)}
+
+
+def _fetch_supported_codes() -> list:
+    """Запрос списка поддерживаемых валют через эндпоинт /list"""
+    data = get_client().list_currencies()
+    if data.get("success") is False:
+        return []
+    return list(data.get("currencies", {}))
+
+
+rate_cache = RateCache(ttl=RATE_CACHE_TTL, max_size=RATE_CACHE_MAX_SIZE)
+rate_matrix = RateMatrix(_fetch_quotes, base=RATE_MATRIX_BASE, ttl=RATE_CACHE_TTL,
+                         retry_after=RATE_MATRIX_RETRY_AFTER)
+supported_currencies = SupportedCurrencies(_fetch_supported_codes)
 
 
+def init_supported_currencies():
+    """Загрузка списка валют при запуске и включение его периодического обновления"""
+    supported_currencies.load()
+    supported_currencies.start_refresh(SUPPORTED_CURRENCIES_REFRESH)
+
+
+@timed(CURRENCY_SECONDS)
 def get_exchange_rate(source_currency: str, target_currency: str) -> Optional[Dict]:
     """
-    Получение курса обмена между двумя валютами через api.exchangerate.host
-    
+    Получение курса обмена между двумя валютами
+
+    Курс берётся из общего кэша; при промахе он вычисляется по матрице курсов
+    (один запрос на все валюты), и только для валют вне матрицы выполняется
+    отдельный запрос пары.
+
     Args:
         source_currency: Исходная валюта (например, "RUB")
         target_currency: Целевая валюта (например, "CNY")
-    
+
     Returns:
         Словарь с данными курса или None в случае ошибки
     """
-    url = "https://api.exchangerate.host/live"
-    params = {
-        "access_key": API_KEY,
+    return rate_cache.get_or_load(
+        (source_currency, target_currency),
+        lambda: _load_exchange_rate(source_currency, target_currency)
+    )
+
+
+def _load_exchange_rate(source_currency: str, target_currency: str) -> Optional[Dict]:
+    """
+    Курс из матрицы курсов или, если пары в ней нет либо матрицу не удалось
+    обновить, отдельным запросом
+    """
+    covered = _matrix_covers(source_currency, target_currency)
+    if covered and rate_matrix.ensure_fresh():
+        return _matrix_quote(source_currency, target_currency)
+    quote = _fetch_exchange_rate(source_currency, target_currency)
+    if covered:
+        return _stale_fallback(source_currency, target_currency, quote)
+    return quote
+
+
+def _stale_fallback(source_currency: str, target_currency: str,
+                    quote: Optional[Dict]) -> Optional[Dict]:
+    """
+    Котировка по устаревшей матрице, если и запрос пары не удался
+
+    Такая котировка помечается stale и не попадает в кэш курсов.
+    """
+    if (quote and quote.get("success")) or rate_matrix.loaded_at is None:
+        return quote
+    stale = _matrix_quote(source_currency, target_currency)
+    if not stale.get("success"):
+        return quote
+    stale["stale"] = True
+    return stale
+
+
+def _matrix_covers(source_currency: str, target_currency: str) -> bool:
+    return rate_matrix.covers(source_currency) and rate_matrix.covers(target_currency)
+
+
+def _matrix_quote(source_currency: str, target_currency: str) -> Dict:
+    """Котировка по уже загруженной матрице курсов, со временем загрузки матрицы"""
+    # Время — до чтения курсов: при одновременном обновлении котировка
+    # окажется не новее, чем указано
+    loaded_at = rate_matrix.loaded_at_wall()
+    rate = rate_matrix.cross_rate(source_currency, target_currency)
+    if rate is not None:
+        return _make_quote(source_currency, target_currency, rate, loaded_at)
+    # Матрица загружена, но котировки нет — повторный запрос ничего не даст
+    return {
+        "success": False,
+        "error": f"Currency pair {source_currency}/{target_currency} not found",
+        "unavailable": [c for c in (source_currency, target_currency)
+                        if c not in rate_matrix]
+    }
+
+
+def _make_quote(source_currency: str, target_currency: str, rate: float,
+                timestamp: Optional[float] = None) -> Dict:
+    """
+    Котировка с уникальным ID и временем получения
+
+    Args:
+        timestamp: Когда получен курс (Unix time); по умолчанию — сейчас
+    """
+    return {
+        "success": True,
+        "rate": rate,
+        "source": source_currency,
+        "target": target_currency,
+        "quote_id": uuid.uuid4().hex,
+        "timestamp": time.time() if timestamp is None else timestamp
+    }
+
+
+def is_quote_fresh(quote: Optional[Dict], max_age: float = QUOTE_MAX_AGE) -> bool:
+    """
+    Проверка, можно ли использовать котировку без повторного запроса
+
+    Курс, введённый пользователем вручную (manual), не устаревает.
+    """
+    if not quote or quote.get("rate") is None:
+        return False
+    if quote.get("manual"):
+        return True
+    timestamp = quote.get("timestamp")
+    return timestamp is not None and time.time() - timestamp <= max_age
+
+
+@timed(CURRENCY_SECONDS)
+def validate_pair_and_quote(source_currency: str, target_currency: str) -> Dict:
+    """
+    Проверка доступности обеих валют и получение курса за один запрос
+
+    Args:
+        source_currency: Исходная валюта
+        target_currency: Целевая валюта
+
+    Returns:
+        Словарь с полями success, from_available, to_available, rate,
+        quote_id, timestamp (и error в случае ошибки)
+    """
+    unsupported = _unsupported_pair(source_currency, target_currency)
+    if unsupported:
+        return unsupported
+    return _pair_result(source_currency, target_currency,
+                        get_exchange_rate(source_currency, target_currency))
+
+
+def _unsupported_pair(source_currency: str, target_currency: str) -> Optional[Dict]:
+    """Результат validate_pair_and_quote, если одной из валют нет в списке поддерживаемых"""
+    unavailable = [c for c in (source_currency, target_currency)
+                   if not check_currency_available(c)]
+    if not unavailable:
+        return None
+    return {
+        "success": False,
+        "from_available": source_currency not in unavailable,
+        "to_available": target_currency not in unavailable,
+        "rate": None,
+        "source": source_currency,
+        "target": target_currency,
+        "error": f"Currency {unavailable[0]} is not supported"
+    }
+
+
+def _pair_result(source_currency: str, target_currency: str, quote: Optional[Dict]) -> Dict:
+    """Результат validate_pair_and_quote по полученной котировке"""
+    if quote and quote.get("success"):
+        return {
+            "success": True,
+            "from_available": True,
+            "to_available": True,
+            "rate": quote["rate"],
+            "source": source_currency,
+            "target": target_currency,
+            "quote_id": quote["quote_id"],
+            "timestamp": quote["timestamp"]
+        }
+
+    quote = quote or {}
+    unavailable = set(quote.get("unavailable", []))
+    # Коды ошибок exchangerate.host: 201 — неверная исходная валюта,
+    # 202 — неверные целевые валюты
+    if quote.get("code") == 201:
+        unavailable.add(source_currency)
+    elif quote.get("code") == 202:
+        unavailable.add(target_currency)
+
+    return {
+        "success": False,
+        "from_available": source_currency not in unavailable,
+        "to_available": target_currency not in unavailable,
+        "rate": None,
         "source": source_currency,
-        "currencies": target_currency
+        "target": target_currency,
+        "error": quote.get("error", "Ошибка запроса")
     }
 
+
+def get_cache_stats() -> Dict:
+    """Статистика кэша курсов (hits/misses/stale)"""
+    return rate_cache.stats()
+
+
+def _fetch_exchange_rate(source_currency: str, target_currency: str) -> Optional[Dict]:
+    """
+    Запрос курса обмена между двумя валютами через api.exchangerate.host
+    
+    Args:
+        source_currency: Исходная валюта (например, "RUB")
+        target_currency: Целевая валюта (например, "CNY")
+    
+    Returns:
+        Словарь с данными курса или None в случае ошибки
+    """
     try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        
-        # Проверяем успешность запроса
-        if data.get("success") is False:
-            error_info = data.get("error", {})
-            return {
-                "success": False,
-                "error": error_info.get("info", "Unknown error")
-            }
-        
-        # Извлекаем курс из ответа
-        quotes = data.get("quotes", {})
-        rate_key = f"{source_currency}{target_currency}"
-        
-        if rate_key in quotes:
-            return {
-                "success": True,
-                "rate": quotes[rate_key],
-                "source": source_currency,
-                "target": target_currency
-            }
-        else:
-            return {
-                "success": False,
-                "error": f"Currency pair {source_currency}/{target_currency} not found"
-            }
-            
+        data = get_client().live(source_currency, [target_currency])
+        return _parse_pair_response(data, source_currency, target_currency)
     except requests.exceptions.RequestException as e:
         return {
             "success": False,
@@ -71,7 +286,33 @@ def get_exchange_rate(source_currency: str, target_currency: str) -> Optional[Di
         }
 
 
-def convert_currency(amount: float, source_currency: str, target_currency: str) -> Optional[Dict]:
+def _parse_pair_response(data: Dict, source_currency: str, target_currency: str) -> Dict:
+    """Котировка пары из ответа /live"""
+    # Проверяем успешность запроса
+    if data.get("success") is False:
+        error_info = data.get("error", {})
+        return {
+            "success": False,
+            "error": error_info.get("info", "Unknown error"),
+            "code": error_info.get("code")
+        }
+    
+    # Извлекаем курс из ответа
+    quotes = data.get("quotes", {})
+    rate_key = f"{source_currency}{target_currency}"
+    
+    if rate_key in quotes:
+        return _make_quote(source_currency, target_currency, quotes[rate_key])
+    return {
+        "success": False,
+        "error": f"Currency pair {source_currency}/{target_currency} not found"
+    }
+
+
+@timed(CURRENCY_SECONDS)
+def convert_currency(amount: float, source_currency: str, target_currency: str,
+                     quote: Optional[Dict] = None,
+                     max_age: float = QUOTE_MAX_AGE) -> Optional[Dict]:
     """
     Конвертация суммы из одной валюты в другую
     
@@ -79,16 +320,36 @@ def convert_currency(amount: float, source_currency: str, target_currency: str)
         amount: Сумма для конвертации
         source_currency: Исходная валюта
         target_currency: Целевая валюта
+        quote: Ранее полученная котировка; используется без запроса к API,
+            если она для той же пары и не старше max_age секунд
+        max_age: Максимальный возраст котировки (сек)
     
     Returns:
         Словарь с результатом конвертации или None в случае ошибки
     """
-    rate_data = get_exchange_rate(source_currency, target_currency)
-    
-    if not rate_data or not rate_data.get("success"):
-        return rate_data
-    
+    if _is_reusable(quote, source_currency, target_currency, max_age):
+        rate_data = quote
+    else:
+        rate_data = get_exchange_rate(source_currency, target_currency)
+        if not rate_data or not rate_data.get("success"):
+            return rate_data
+    return _conversion(amount, source_currency, target_currency, rate_data)
+
+
+def _is_reusable(quote: Optional[Dict], source_currency: str, target_currency: str,
+                 max_age: float) -> bool:
+    """Можно ли конвертировать по ранее полученной котировке"""
+    return (is_quote_fresh(quote, max_age)
+            and quote.get("source") == source_currency
+            and quote.get("target") == target_currency)
+
+
+def _conversion(amount, source_currency: str, target_currency: str, rate_data: Dict) -> Dict:
+    """Результат конвертации по котировке rate_data"""
     rate = rate_data["rate"]
+    if isinstance(amount, Decimal):
+        # Точная арифметика для сумм в Decimal
+        rate = to_decimal(rate)
     converted_amount = amount * rate
     
     return {
@@ -97,25 +358,117 @@ def convert_currency(amount: float, source_currency: str, target_currency: str)
         "converted_amount": converted_amount,
         "rate": rate,
         "source": source_currency,
-        "target": target_currency
+        "target": target_currency,
+        "quote_id": rate_data.get("quote_id"),
+        "timestamp": rate_data.get("timestamp")
     }
 
 
+@timed(CURRENCY_SECONDS)
 def check_currency_available(currency: str) -> bool:
     """
     Проверка доступности валюты в API
-    
+
+    Проверяется вхождение в список валют, загруженный при запуске,
+    без сетевых запросов.
+
     Args:
         currency: Код валюты для проверки
-    
+
     Returns:
         True если валюта доступна, False иначе
     """
-    # Проверяем через запрос к USD (базовая валюта обычно доступна)
-    result = get_exchange_rate("USD", currency)
-    if result and result.get("success"):
+    codes = supported_currencies.codes
+    # Если список получить не удалось, не блокируем пользователя
+    return not codes or currency in codes
+
+
+# Асинхронные версии: общий кэш и матрица, запросы через aiohttp.
+# Вызываются из одного цикла событий.
+
+_matrix_refresh_lock: Optional[asyncio.Lock] = None
+
+
+async def _async_ensure_matrix() -> bool:
+    """Обновление матрицы курсов, если она устарела (один запрос на все задачи)"""
+    global _matrix_refresh_lock
+    if rate_matrix.is_fresh():
         return True
-    
-    # Пробуем обратный запрос
-    result = get_exchange_rate(currency, "USD")
-    return result and result.get("success")
+    if rate_matrix.recently_failed():
+        return False
+    if _matrix_refresh_lock is None:
+        _matrix_refresh_lock = asyncio.Lock()
+    async with _matrix_refresh_lock:
+        if not rate_matrix.is_fresh() and not rate_matrix.recently_failed():
+            try:
+                data = await get_async_client().live(rate_matrix.base, rate_matrix.quote_codes())
+                quotes = _parse_quotes(data, rate_matrix.base)
+            except Exception:
+                # При ошибке остаются прежние котировки (если они были)
+                quotes = None
+            if not rate_matrix.load_quotes(quotes):
+                rate_matrix.mark_failed()
+    return rate_matrix.is_fresh()
+
+
+async def _async_fetch_exchange_rate(source_currency: str, target_currency: str) -> Dict:
+    """Асинхронный запрос курса одной пары"""
+    import aiohttp
+
+    try:
+        data = await get_async_client().live(source_currency, [target_currency])
+        return _parse_pair_response(data, source_currency, target_currency)
+    except (aiohttp.ClientError, asyncio.TimeoutError, DeadlineExceeded) as e:
+        return {
+            "success": False,
+            "error": f"Network error: {str(e)}"
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"Unexpected error: {str(e)}"
+        }
+
+
+@timed(CURRENCY_SECONDS)
+async def async_get_exchange_rate(source_currency: str, target_currency: str) -> Optional[Dict]:
+    """Асинхронная версия get_exchange_rate: тот же кэш с отдачей устаревших записей"""
+    return await rate_cache.async_get_or_load(
+        (source_currency, target_currency),
+        lambda: _async_load_exchange_rate(source_currency, target_currency)
+    )
+
+
+async def _async_load_exchange_rate(source_currency: str, target_currency: str) -> Optional[Dict]:
+    """Асинхронная версия _load_exchange_rate"""
+    covered = _matrix_covers(source_currency, target_currency)
+    if covered and await _async_ensure_matrix():
+        return _matrix_quote(source_currency, target_currency)
+    quote = await _async_fetch_exchange_rate(source_currency, target_currency)
+    if covered:
+        return _stale_fallback(source_currency, target_currency, quote)
+    return quote
+
+
+@timed(CURRENCY_SECONDS)
+async def async_validate_pair_and_quote(source_currency: str, target_currency: str) -> Dict:
+    """Асинхронная версия validate_pair_and_quote"""
+    unsupported = _unsupported_pair(source_currency, target_currency)
+    if unsupported:
+        return unsupported
+    return _pair_result(source_currency, target_currency,
+                        await async_get_exchange_rate(source_currency, target_currency))
+
+
+@timed(CURRENCY_SECONDS)
+async def async_convert_currency(amount: float, source_currency: str, target_currency: str,
+                                 quote: Optional[Dict] = None,
+                                 max_age: float = QUOTE_MAX_AGE) -> Optional[Dict]:
+    """Асинхронная версия convert_currency"""
+    if _is_reusable(quote, source_currency, target_currency, max_age):
+        rate_data = quote
+    else:
+        rate_data = await async_get_exchange_rate(source_currency, target_currency)
+        if not rate_data or not rate_data.get("success"):
+            return rate_data
+    return _conversion(amount, source_currency, target_currency, rate_data)
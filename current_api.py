@@ -1,24 +1,11 @@
-import requests
-from dotenv import load_dotenv
-import os
-import json
-
-load_dotenv()
-API_KEY = os.getenv("CURRENCY_API_KEY")
+from provider_client import get_client
 
 
 
 def get_current_rate(default: str = "USD", currencies: list[str] = ["EUR", "GBP", "JPY"]) :
-    url = "https://api.exchangerate.host/live"
-    params = {
-        "access_key": API_KEY,
-        "source": default,
-        "currencies": ",".join(currencies)
-        # ",".join(currencies) означает объединение в строку с разделителем-запятой
-    }
-
-    response = requests.get(url, params=params)
-    data = response.json()
+    # Запрос идёт через общий клиент: keep-alive соединения, таймауты и повторы
+    data = get_client().live(default, currencies)
+    # Валюты объединяются в строку с разделителем-запятой внутри клиента
     return data
 
 if __name__ == "__main__":
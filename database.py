@@ -1,257 +1,720 @@
+import asyncio
 import sqlite3
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional, List, Dict, Tuple
+from typing import Optional, Iterator, List, Dict, Tuple
+
+from metrics import DB_SECONDS, timed
+from migrations import ROLLUP_CATEGORY, ROLLUP_DAY, ROLLUP_EXPENSES, migrate
+from money import Number, from_minor, rate_from_scaled, rate_to_scaled, to_minor
 
 DB_PATH = "travel_wallet.db"
 
+# Настройки, применяемые к каждому соединению
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",        # 16 МБ страничного кэша
+    "PRAGMA mmap_size=268435456",      # 256 МБ отображения файла в память
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Размер кэша подготовленных выражений каждого соединения
+STATEMENT_CACHE_SIZE = 256
+
+# Размер пачки строк при выгрузке расходов
+EXPORT_BATCH_SIZE = 1000
+
+# Межпроцессная блокировка записи (задаёт supervisor.py в рабочих процессах):
+# писатели разных процессов ждут друг друга на ней, а не в busy_timeout SQLite
+_process_write_lock = None
+
+
+def set_process_write_lock(lock):
+    """Блокировка записи для всех Database, создаваемых в этом процессе"""
+    global _process_write_lock
+    _process_write_lock = lock
+
+# Частые запросы: каждый должен обслуживаться индексом (см. find_table_scans)
+SQL_GET_ACTIVE_TRIP = """
+    SELECT id, name, from_country, to_country, from_currency, 
+           to_currency, exchange_rate_scaled, balance_from_minor, balance_to_minor
+    FROM trips
+    WHERE user_id = ? AND is_active = 1
+    LIMIT 1
+"""
+
+SQL_GET_USER_TRIPS = """
+    SELECT id, name, from_country, to_country, from_currency, 
+           to_currency, exchange_rate_scaled, balance_from_minor, balance_to_minor, is_active
+    FROM trips
+    WHERE user_id = ?
+    ORDER BY created_at DESC
+"""
+
+# История расходов — от новых к старым, порядок (created_at, id). Индекс
+# idx_expenses_trip_created неявно содержит id (rowid), поэтому страница
+# после курсора (created_at, id) — два поиска по индексу: расходы с тем же
+# created_at и меньшим id, затем расходы с меньшим created_at. Стоимость не
+# зависит от глубины страницы, в отличие от OFFSET
+SQL_GET_EXPENSES = """
+    SELECT id, amount_to_minor, amount_from_minor, description, created_at
+    FROM expenses
+    WHERE trip_id = ?
+    ORDER BY created_at DESC, id DESC
+    LIMIT ?
+"""
+
+SQL_GET_EXPENSES_BEFORE_TIE = """
+    SELECT id, amount_to_minor, amount_from_minor, description, created_at
+    FROM expenses
+    WHERE trip_id = ? AND created_at = ? AND id < ?
+    ORDER BY id DESC
+    LIMIT ?
+"""
+
+SQL_GET_EXPENSES_BEFORE = """
+    SELECT id, amount_to_minor, amount_from_minor, description, created_at
+    FROM expenses
+    WHERE trip_id = ? AND created_at < ?
+    ORDER BY created_at DESC, id DESC
+    LIMIT ?
+"""
+
+# Страница новее курсора: строки идут от старых к новым
+SQL_GET_EXPENSES_AFTER_TIE = """
+    SELECT id, amount_to_minor, amount_from_minor, description, created_at
+    FROM expenses
+    WHERE trip_id = ? AND created_at = ? AND id > ?
+    ORDER BY id ASC
+    LIMIT ?
+"""
+
+SQL_GET_EXPENSES_AFTER = """
+    SELECT id, amount_to_minor, amount_from_minor, description, created_at
+    FROM expenses
+    WHERE trip_id = ? AND created_at > ?
+    ORDER BY created_at ASC, id ASC
+    LIMIT ?
+"""
+
+# Выгрузка расходов путешествия — от старых к новым, по тому же индексу
+SQL_EXPORT_EXPENSES = """
+    SELECT id, amount_to_minor, amount_from_minor, description, created_at
+    FROM expenses
+    WHERE trip_id = ?
+    ORDER BY created_at ASC, id ASC
+"""
+
+# Сводка расходов путешествия: строки (день, категория), O(дней × категорий)
+SQL_GET_ROLLUPS = """
+    SELECT day, category, amount_to_minor, amount_from_minor, expense_count
+    FROM expense_rollups
+    WHERE trip_id = ?
+    ORDER BY day
+"""
+
+# Учёт одного расхода в сводке: sign = 1 — добавить, -1 — убрать
+SQL_ROLLUP_EXPENSE = f"""
+    INSERT INTO expense_rollups (trip_id, day, category, amount_to_minor,
+                                 amount_from_minor, expense_count)
+    SELECT trip_id, {ROLLUP_DAY}, {ROLLUP_CATEGORY},
+           ? * amount_to_minor, ? * amount_from_minor, ?
+    FROM expenses
+    WHERE id = ?
+    ON CONFLICT (trip_id, day, category) DO UPDATE SET
+        amount_to_minor = amount_to_minor + excluded.amount_to_minor,
+        amount_from_minor = amount_from_minor + excluded.amount_from_minor,
+        expense_count = expense_count + excluded.expense_count
+"""
+
+# Учёт в сводке расходов путешествия, добавленных после id = ? (пакетная
+# вставка): одна строка на (день, категорию). Новые строки ищутся по
+# диапазону первичного ключа; NOT INDEXED не даёт планировщику выбрать индекс
+# по путешествию — с ним читались бы все расходы путешествия на каждую пачку
+SQL_ROLLUP_EXPENSES_AFTER = ROLLUP_EXPENSES + """    NOT INDEXED
+    WHERE id > ? AND trip_id = ?
+    GROUP BY 1, 2, 3
+    ON CONFLICT (trip_id, day, category) DO UPDATE SET
+        amount_to_minor = amount_to_minor + excluded.amount_to_minor,
+        amount_from_minor = amount_from_minor + excluded.amount_from_minor,
+        expense_count = expense_count + excluded.expense_count
+"""
+
+# Расход из файла выписки; строка с уже известным import_hash пропускается
+SQL_INSERT_IMPORTED_EXPENSE = """
+    INSERT INTO expenses (trip_id, amount_to_minor, amount_from_minor, description,
+                          created_at, import_hash)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (trip_id, import_hash) WHERE import_hash IS NOT NULL DO NOTHING
+"""
+
+HOT_QUERIES = {
+    "get_active_trip": (SQL_GET_ACTIVE_TRIP, (1,)),
+    "get_user_trips": (SQL_GET_USER_TRIPS, (1,)),
+    "get_expenses": (SQL_GET_EXPENSES, (1, 20)),
+    "get_expenses_before_tie": (SQL_GET_EXPENSES_BEFORE_TIE, (1, "2026-01-01 00:00:00", 1, 20)),
+    "get_expenses_before": (SQL_GET_EXPENSES_BEFORE, (1, "2026-01-01 00:00:00", 20)),
+    "get_expenses_after_tie": (SQL_GET_EXPENSES_AFTER_TIE, (1, "2026-01-01 00:00:00", 1, 20)),
+    "get_expenses_after": (SQL_GET_EXPENSES_AFTER, (1, "2026-01-01 00:00:00", 20)),
+    "get_rollups": (SQL_GET_ROLLUPS, (1,)),
+    "export_expenses": (SQL_EXPORT_EXPENSES, (1,)),
+}
+
 
 class Database:
-    def __init__(self):
+    def __init__(self, db_path: str = DB_PATH, write_lock=None):
+        self.db_path = db_path
+        self.write_lock = write_lock if write_lock is not None else _process_write_lock
+        # Одно долгоживущее соединение на поток
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
         self.init_db()
 
-    def get_connection(self):
-        return sqlite3.connect(DB_PATH)
-
-    def init_db(self):
-        """Инициализация базы данных с созданием таблиц"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        # Таблица пользователей
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    def get_connection(self) -> sqlite3.Connection:
+        """Соединение текущего потока (создаётся при первом обращении)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: транзакциями управляет transaction()
+            conn = sqlite3.connect(
+                self.db_path,
+                isolation_level=None,
+                check_same_thread=False,
+                cached_statements=STATEMENT_CACHE_SIZE
             )
-        """)
+            for pragma in SQLITE_PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """
+        Транзакция на соединении текущего потока
 
-        # Таблица путешествий
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS trips (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                name TEXT NOT NULL,
-                from_country TEXT NOT NULL,
-                to_country TEXT NOT NULL,
-                from_currency TEXT NOT NULL,
-                to_currency TEXT NOT NULL,
-                exchange_rate REAL NOT NULL,
-                balance_from REAL NOT NULL DEFAULT 0,
-                balance_to REAL NOT NULL DEFAULT 0,
-                is_active INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-        """)
+        Вложенный вызов выполняется в рамках уже открытой транзакции.
+        """
+        conn = self.get_connection()
+        if conn.in_transaction:
+            yield conn.cursor()
+            return
+        if self.write_lock is not None:
+            self.write_lock.acquire()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn.cursor()
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            if self.write_lock is not None:
+                self.write_lock.release()
+
+    def close(self):
+        """Закрытие всех соединений"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
 
-        # Таблица расходов
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS expenses (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                trip_id INTEGER NOT NULL,
-                amount_to REAL NOT NULL,
-                amount_from REAL NOT NULL,
-                description TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (trip_id) REFERENCES trips(id)
-            )
-        """)
+    def init_db(self):
+        """Инициализация базы данных: применение миграций схемы"""
+        migrate(self.get_connection())
 
-        conn.commit()
-        conn.close()
+    def find_table_scans(self) -> Dict[str, List[str]]:
+        """
+        Проверка планов частых запросов через EXPLAIN QUERY PLAN
 
+        Returns:
+            Словарь {имя запроса: строки плана с полным сканированием
+            таблицы или временным B-деревом для сортировки}; пустой, если
+            все запросы обслуживаются индексами
+        """
+        conn = self.get_connection()
+        problems = {}
+        for name, (sql, params) in HOT_QUERIES.items():
+            plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+            bad = [step for step in plan
+                   if step.startswith("SCAN") or "TEMP B-TREE" in step]
+            if bad:
+                problems[name] = bad
+        return problems
+
+    @timed(DB_SECONDS)
     def add_user(self, user_id: int, username: Optional[str] = None):
         """Добавление пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        try:
+        with self.transaction() as cursor:
             cursor.execute(
                 "INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)",
                 (user_id, username)
             )
-            conn.commit()
-        finally:
-            conn.close()
 
+    @staticmethod
+    def _trip_from_row(row: Tuple) -> Dict:
+        """Путешествие из строки SQL_GET_ACTIVE_TRIP / SQL_GET_USER_TRIPS"""
+        return {
+            'id': row[0],
+            'name': row[1],
+            'from_country': row[2],
+            'to_country': row[3],
+            'from_currency': row[4],
+            'to_currency': row[5],
+            'exchange_rate': rate_from_scaled(row[6]),
+            'balance_from': from_minor(row[7], row[4]),
+            'balance_to': from_minor(row[8], row[5])
+        }
+
+    @staticmethod
+    def _trip_currencies(cursor: sqlite3.Cursor, trip_id: int) -> Tuple[str, str]:
+        """Валюты путешествия: (from_currency, to_currency)"""
+        cursor.execute("SELECT from_currency, to_currency FROM trips WHERE id = ?", (trip_id,))
+        row = cursor.fetchone()
+        if row is None:
+            raise ValueError(f"Путешествие {trip_id} не найдено")
+        return row[0], row[1]
+
+    @timed(DB_SECONDS)
     def create_trip(self, user_id: int, name: str, from_country: str, to_country: str,
-                    from_currency: str, to_currency: str, exchange_rate: float,
-                    initial_amount_from: float, initial_amount_to: float) -> int:
+                    from_currency: str, to_currency: str, exchange_rate: Number,
+                    initial_amount_from: Number, initial_amount_to: Number) -> int:
         """Создание нового путешествия"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.transaction() as cursor:
+            # Деактивируем все другие путешествия пользователя
+            cursor.execute(
+                "UPDATE trips SET is_active = 0 WHERE user_id = ?",
+                (user_id,)
+            )
 
-        # Деактивируем все другие путешествия пользователя
-        cursor.execute(
-            "UPDATE trips SET is_active = 0 WHERE user_id = ?",
-            (user_id,)
-        )
+            # Создаём новое путешествие
+            cursor.execute("""
+                INSERT INTO trips (user_id, name, from_country, to_country, 
+                                 from_currency, to_currency, exchange_rate_scaled,
+                                 balance_from_minor, balance_to_minor, is_active)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+            """, (user_id, name, from_country, to_country, from_currency,
+                  to_currency, rate_to_scaled(exchange_rate),
+                  to_minor(initial_amount_from, from_currency),
+                  to_minor(initial_amount_to, to_currency)))
 
-        # Создаём новое путешествие
-        cursor.execute("""
-            INSERT INTO trips (user_id, name, from_country, to_country, 
-                             from_currency, to_currency, exchange_rate,
-                             balance_from, balance_to, is_active)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
-        """, (user_id, name, from_country, to_country, from_currency,
-              to_currency, exchange_rate, initial_amount_from, initial_amount_to))
-
-        trip_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return trip_id
+            return cursor.lastrowid
 
+    @timed(DB_SECONDS)
     def get_active_trip(self, user_id: int) -> Optional[Dict]:
         """Получение активного путешествия пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id, name, from_country, to_country, from_currency, 
-                   to_currency, exchange_rate, balance_from, balance_to
-            FROM trips
-            WHERE user_id = ? AND is_active = 1
-            LIMIT 1
-        """, (user_id,))
-        row = cursor.fetchone()
-        conn.close()
+        row = self.get_connection().execute(SQL_GET_ACTIVE_TRIP, (user_id,)).fetchone()
 
         if row:
-            return {
-                'id': row[0],
-                'name': row[1],
-                'from_country': row[2],
-                'to_country': row[3],
-                'from_currency': row[4],
-                'to_currency': row[5],
-                'exchange_rate': row[6],
-                'balance_from': row[7],
-                'balance_to': row[8]
-            }
+            return self._trip_from_row(row)
         return None
 
+    @timed(DB_SECONDS)
     def get_user_trips(self, user_id: int) -> List[Dict]:
         """Получение всех путешествий пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id, name, from_country, to_country, from_currency, 
-                   to_currency, exchange_rate, balance_from, balance_to, is_active
-            FROM trips
-            WHERE user_id = ?
-            ORDER BY created_at DESC
-        """, (user_id,))
-        rows = cursor.fetchall()
-        conn.close()
-
-        return [{
-            'id': row[0],
-            'name': row[1],
-            'from_country': row[2],
-            'to_country': row[3],
-            'from_currency': row[4],
-            'to_currency': row[5],
-            'exchange_rate': row[6],
-            'balance_from': row[7],
-            'balance_to': row[8],
-            'is_active': row[9]
-        } for row in rows]
+        rows = self.get_connection().execute(SQL_GET_USER_TRIPS, (user_id,)).fetchall()
+
+        return [dict(self._trip_from_row(row), is_active=row[9]) for row in rows]
 
+    @timed(DB_SECONDS)
     def switch_trip(self, user_id: int, trip_id: int):
         """Переключение активного путешествия"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        # Деактивируем все путешествия пользователя
-        cursor.execute("UPDATE trips SET is_active = 0 WHERE user_id = ?", (user_id,))
-        # Активируем выбранное
-        cursor.execute("UPDATE trips SET is_active = 1 WHERE id = ? AND user_id = ?",
-                      (trip_id, user_id))
-        conn.commit()
-        conn.close()
-
-    def add_expense(self, trip_id: int, amount_to: float, amount_from: float,
+        with self.transaction() as cursor:
+            # Деактивируем все путешествия пользователя
+            cursor.execute("UPDATE trips SET is_active = 0 WHERE user_id = ?", (user_id,))
+            # Активируем выбранное
+            cursor.execute("UPDATE trips SET is_active = 1 WHERE id = ? AND user_id = ?",
+                          (trip_id, user_id))
+
+    @timed(DB_SECONDS)
+    def add_expense(self, trip_id: int, amount_to: Number, amount_from: Number,
                    description: Optional[str] = None):
         """Добавление расхода и обновление баланса"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.transaction() as cursor:
+            from_currency, to_currency = self._trip_currencies(cursor, trip_id)
+            amount_to_minor = to_minor(amount_to, to_currency)
+            amount_from_minor = to_minor(amount_from, from_currency)
+
+            # Добавляем расход
+            cursor.execute("""
+                INSERT INTO expenses (trip_id, amount_to_minor, amount_from_minor, description)
+                VALUES (?, ?, ?, ?)
+            """, (trip_id, amount_to_minor, amount_from_minor, description))
+
+            expense_id = cursor.lastrowid
+            cursor.execute(SQL_ROLLUP_EXPENSE, (1, 1, 1, expense_id))
+
+            # Обновляем баланс (целочисленное вычитание — без накопления ошибки)
+            cursor.execute("""
+                UPDATE trips
+                SET balance_to_minor = balance_to_minor - ?,
+                    balance_from_minor = balance_from_minor - ?
+                WHERE id = ?
+            """, (amount_to_minor, amount_from_minor, trip_id))
 
-        # Добавляем расход
-        cursor.execute("""
-            INSERT INTO expenses (trip_id, amount_to, amount_from, description)
-            VALUES (?, ?, ?, ?)
-        """, (trip_id, amount_to, amount_from, description))
+        return expense_id
 
-        expense_id = cursor.lastrowid
+    @staticmethod
+    def _last_expense_id(cursor: sqlite3.Cursor) -> int:
+        """Наибольший id расхода (в транзакции записи все новые id будут больше)"""
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM expenses")
+        return cursor.fetchone()[0]
 
-        # Обновляем баланс
+    @staticmethod
+    def _apply_new_expenses(cursor: sqlite3.Cursor, trip_id: int, last_id: int) -> int:
+        """
+        Сводка и баланс для расходов путешествия, добавленных после last_id
+
+        Returns:
+            int: Число добавленных расходов
+        """
+        cursor.execute(SQL_ROLLUP_EXPENSES_AFTER, (last_id, trip_id))
+        cursor.execute("""
+            SELECT COUNT(*), COALESCE(SUM(amount_to_minor), 0), COALESCE(SUM(amount_from_minor), 0)
+            FROM expenses NOT INDEXED
+            WHERE id > ? AND trip_id = ?
+        """, (last_id, trip_id))
+        count, amount_to_minor, amount_from_minor = cursor.fetchone()
+
+        # Один пересчёт баланса на весь пакет
         cursor.execute("""
             UPDATE trips
-            SET balance_to = balance_to - ?,
-                balance_from = balance_from - ?
+            SET balance_to_minor = balance_to_minor - ?,
+                balance_from_minor = balance_from_minor - ?
             WHERE id = ?
-        """, (amount_to, amount_from, trip_id))
+        """, (amount_to_minor, amount_from_minor, trip_id))
+        return count
 
-        conn.commit()
-        conn.close()
-        return expense_id
+    @timed(DB_SECONDS)
+    def add_expenses(self, trip_id: int,
+                     expenses: List[Tuple[Number, Number, Optional[str]]]) -> int:
+        """
+        Добавление нескольких расходов одной транзакцией
+
+        Args:
+            expenses: [(сумма в валюте назначения, сумма в домашней валюте, описание), ...]
+
+        Returns:
+            int: Число добавленных расходов
+        """
+        if not expenses:
+            return 0
+        with self.transaction() as cursor:
+            from_currency, to_currency = self._trip_currencies(cursor, trip_id)
+            last_id = self._last_expense_id(cursor)
+            cursor.executemany("""
+                INSERT INTO expenses (trip_id, amount_to_minor, amount_from_minor, description)
+                VALUES (?, ?, ?, ?)
+            """, [
+                (trip_id, to_minor(amount_to, to_currency), to_minor(amount_from, from_currency),
+                 description or None)
+                for amount_to, amount_from, description in expenses
+            ])
+            return self._apply_new_expenses(cursor, trip_id, last_id)
+
+    @timed(DB_SECONDS)
+    def add_imported_expenses(self, trip_id: int,
+                              expenses: List[Tuple[str, Number, Number, Optional[str], str]]) -> int:
+        """
+        Добавление пачки расходов из файла выписки одной транзакцией
+
+        Строки, уже импортированные в это путешествие (тот же import_hash),
+        пропускаются.
 
+        Args:
+            expenses: [(created_at, сумма в валюте назначения, сумма в домашней
+                валюте, описание, import_hash), ...]
+
+        Returns:
+            int: Число добавленных расходов (без повторов)
+        """
+        if not expenses:
+            return 0
+        with self.transaction() as cursor:
+            from_currency, to_currency = self._trip_currencies(cursor, trip_id)
+            last_id = self._last_expense_id(cursor)
+            cursor.executemany(SQL_INSERT_IMPORTED_EXPENSE, [
+                (trip_id, to_minor(amount_to, to_currency), to_minor(amount_from, from_currency),
+                 description or None, created_at, import_hash)
+                for created_at, amount_to, amount_from, description, import_hash in expenses
+            ])
+            return self._apply_new_expenses(cursor, trip_id, last_id)
+
+    @timed(DB_SECONDS)
     def update_expense_description(self, expense_id: int, description: str):
-        """Обновление наименования расхода"""
+        """Обновление наименования расхода (расход переходит в другую категорию сводки)"""
+        with self.transaction() as cursor:
+            cursor.execute(SQL_ROLLUP_EXPENSE, (-1, -1, -1, expense_id))
+            cursor.execute("""
+                UPDATE expenses
+                SET description = ?
+                WHERE id = ?
+            """, (description, expense_id))
+            cursor.execute(SQL_ROLLUP_EXPENSE, (1, 1, 1, expense_id))
+            cursor.execute("""
+                DELETE FROM expense_rollups
+                WHERE trip_id = (SELECT trip_id FROM expenses WHERE id = ?)
+                  AND expense_count = 0
+            """, (expense_id,))
+
+    @timed(DB_SECONDS)
+    def rebuild_expense_rollups(self):
+        """Пересчёт сводки расходов по таблице expenses (после загрузки данных в обход add_expense)"""
+        with self.transaction() as cursor:
+            cursor.execute("DELETE FROM expense_rollups")
+            cursor.execute(ROLLUP_EXPENSES + " GROUP BY 1, 2, 3")
+
+    @timed(DB_SECONDS)
+    def get_trip_stats(self, trip_id: int) -> Dict:
+        """
+        Статистика расходов путешествия по сводке expense_rollups
+
+        Returns:
+            {'total_to', 'total_from', 'count',
+             'days': [{'day', 'amount_to', 'amount_from', 'count'}] — по возрастанию дня,
+             'categories': [{'category', 'amount_to', 'amount_from', 'count'}] —
+             по убыванию суммы; категории, различающиеся только регистром, объединены}
+        """
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE expenses
-            SET description = ?
-            WHERE id = ?
-        """, (description, expense_id))
-        conn.commit()
-        conn.close()
+        from_currency, to_currency = self._trip_currencies(conn.cursor(), trip_id)
+
+        days: Dict[str, List[int]] = {}
+        categories: Dict[str, List] = {}
+        for day, category, amount_to, amount_from, count in conn.execute(SQL_GET_ROLLUPS,
+                                                                          (trip_id,)):
+            totals = days.setdefault(day, [0, 0, 0])
+            totals[0] += amount_to
+            totals[1] += amount_from
+            totals[2] += count
+            # Название категории — в написании, встретившемся первым
+            totals = categories.setdefault(category.casefold(), [category, 0, 0, 0])
+            totals[1] += amount_to
+            totals[2] += amount_from
+            totals[3] += count
+
+        total_to = sum(totals[0] for totals in days.values())
+        total_from = sum(totals[1] for totals in days.values())
+        return {
+            'total_to': from_minor(total_to, to_currency),
+            'total_from': from_minor(total_from, from_currency),
+            'count': sum(totals[2] for totals in days.values()),
+            'days': [{
+                'day': day,
+                'amount_to': from_minor(totals[0], to_currency),
+                'amount_from': from_minor(totals[1], from_currency),
+                'count': totals[2]
+            } for day, totals in days.items()],
+            'categories': [{
+                'category': totals[0],
+                'amount_to': from_minor(totals[1], to_currency),
+                'amount_from': from_minor(totals[2], from_currency),
+                'count': totals[3]
+            } for totals in sorted(categories.values(), key=lambda totals: -totals[1])]
+        }
+
+    @staticmethod
+    def _expense_from_row(row: Tuple, from_currency: str, to_currency: str) -> Dict:
+        """Расход из строки SQL_GET_EXPENSES*"""
+        return {
+            'id': row[0],
+            'amount_to': from_minor(row[1], to_currency),
+            'amount_from': from_minor(row[2], from_currency),
+            'description': row[3],
+            'created_at': row[4]
+        }
 
+    @timed(DB_SECONDS)
     def get_expenses(self, trip_id: int, limit: int = 10) -> List[Dict]:
         """Получение истории расходов"""
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT amount_to, amount_from, description, created_at
-            FROM expenses
-            WHERE trip_id = ?
-            ORDER BY created_at DESC
-            LIMIT ?
-        """, (trip_id, limit))
-        rows = cursor.fetchall()
-        conn.close()
-
-        return [{
-            'amount_to': row[0],
-            'amount_from': row[1],
-            'description': row[2],
-            'created_at': row[3]
-        } for row in rows]
-
-    def update_exchange_rate(self, trip_id: int, new_rate: float):
+        from_currency, to_currency = self._trip_currencies(conn.cursor(), trip_id)
+        rows = conn.execute(SQL_GET_EXPENSES, (trip_id, limit)).fetchall()
+
+        return [self._expense_from_row(row, from_currency, to_currency) for row in rows]
+
+    @staticmethod
+    def _seek(conn: sqlite3.Connection, tie_sql: str, range_sql: str, trip_id: int,
+              cursor: Tuple[str, int], limit: int) -> List[Tuple]:
+        """Строки за курсором (created_at, id): сначала с тем же created_at, затем остальные"""
+        created_at, expense_id = cursor
+        rows = conn.execute(tie_sql, (trip_id, created_at, expense_id, limit)).fetchall()
+        if len(rows) < limit:
+            rows += conn.execute(range_sql, (trip_id, created_at, limit - len(rows))).fetchall()
+        return rows
+
+    @timed(DB_SECONDS)
+    def get_expenses_page(self, trip_id: int, limit: int = 20,
+                          before: Optional[Tuple[str, int]] = None,
+                          after: Optional[Tuple[str, int]] = None) -> Dict:
+        """
+        Страница истории расходов (от новых к старым)
+
+        Курсор — (created_at, id) крайнего расхода соседней страницы:
+        before — расходы старше курсора, after — новее; без курсора —
+        самые новые. Стоимость запроса не зависит от глубины страницы
+        (в отличие от OFFSET).
+
+        Returns:
+            {'expenses': [...], 'has_older': bool, 'has_newer': bool}
+        """
+        conn = self.get_connection()
+        from_currency, to_currency = self._trip_currencies(conn.cursor(), trip_id)
+        # Одна лишняя строка показывает, есть ли следующая страница
+        if after is not None:
+            rows = self._seek(conn, SQL_GET_EXPENSES_AFTER_TIE, SQL_GET_EXPENSES_AFTER,
+                              trip_id, after, limit + 1)
+            has_newer = len(rows) > limit
+            rows = rows[:limit][::-1]
+            # Курсор after взят со страницы старше этой
+            has_older = True
+        else:
+            if before is not None:
+                rows = self._seek(conn, SQL_GET_EXPENSES_BEFORE_TIE, SQL_GET_EXPENSES_BEFORE,
+                                  trip_id, before, limit + 1)
+            else:
+                rows = conn.execute(SQL_GET_EXPENSES, (trip_id, limit + 1)).fetchall()
+            has_older = len(rows) > limit
+            rows = rows[:limit]
+            has_newer = before is not None
+
+        return {
+            'expenses': [self._expense_from_row(row, from_currency, to_currency) for row in rows],
+            'has_older': has_older,
+            'has_newer': has_newer
+        }
+
+    def iter_expenses(self, trip_id: int, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Dict]:
+        """
+        Все расходы путешествия от старых к новым (для выгрузки)
+
+        Строки читаются курсором пачками по batch_size, поэтому память не
+        зависит от числа расходов. Генератор нужно исчерпать в том же потоке,
+        в котором он создан (соединение принадлежит потоку).
+        """
+        conn = self.get_connection()
+        from_currency, to_currency = self._trip_currencies(conn.cursor(), trip_id)
+        cursor = conn.execute(SQL_EXPORT_EXPENSES, (trip_id,))
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield self._expense_from_row(row, from_currency, to_currency)
+        finally:
+            cursor.close()
+
+    @timed(DB_SECONDS)
+    def update_exchange_rate(self, trip_id: int, new_rate: Number):
         """Обновление курса обмена для путешествия
         
         Курс хранится как: сколько to_currency за 1 from_currency
         Для обратной конвертации (to_currency -> from_currency) нужно делить на курс
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        new_rate = rate_from_scaled(rate_to_scaled(new_rate))
+        with self.transaction() as cursor:
+            from_currency, to_currency = self._trip_currencies(cursor, trip_id)
 
-        # Получаем текущий баланс в валюте назначения
-        cursor.execute("SELECT balance_to FROM trips WHERE id = ?", (trip_id,))
-        balance_to = cursor.fetchone()[0]
+            # Получаем текущий баланс в валюте назначения
+            cursor.execute("SELECT balance_to_minor FROM trips WHERE id = ?", (trip_id,))
+            balance_to = from_minor(cursor.fetchone()[0], to_currency)
 
-        # Пересчитываем баланс в домашней валюте с новым курсом
-        # Курс: сколько to_currency за 1 from_currency
-        # Для конвертации to_currency -> from_currency: делим на курс
-        new_balance_from = balance_to / new_rate
+            # Пересчитываем баланс в домашней валюте с новым курсом
+            # Курс: сколько to_currency за 1 from_currency
+            # Для конвертации to_currency -> from_currency: делим на курс
+            new_balance_from = balance_to / new_rate
 
-        cursor.execute("""
-            UPDATE trips
-            SET exchange_rate = ?,
-                balance_from = ?
-            WHERE id = ?
-        """, (new_rate, new_balance_from, trip_id))
+            cursor.execute("""
+                UPDATE trips
+                SET exchange_rate_scaled = ?,
+                    balance_from_minor = ?
+                WHERE id = ?
+            """, (rate_to_scaled(new_rate), to_minor(new_balance_from, from_currency), trip_id))
+
+
+class AsyncDatabase:
+    """
+    Асинхронная обёртка над Database для async_bot.py
+
+    Запросы выполняются в отдельном пуле потоков, у каждого потока пула —
+    своё соединение (см. Database.get_connection), поэтому цикл событий
+    не блокируется на обращениях к SQLite.
+    """
+
+    def __init__(self, db: Database, max_workers: int = 4):
+        self.db = db
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+
+    async def _run(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: method(*args, **kwargs))
+
+    async def add_user(self, user_id: int, username: Optional[str] = None):
+        return await self._run(self.db.add_user, user_id, username)
+
+    async def create_trip(self, **kwargs) -> int:
+        return await self._run(self.db.create_trip, **kwargs)
+
+    async def get_active_trip(self, user_id: int) -> Optional[Dict]:
+        return await self._run(self.db.get_active_trip, user_id)
+
+    async def get_user_trips(self, user_id: int) -> List[Dict]:
+        return await self._run(self.db.get_user_trips, user_id)
+
+    async def switch_trip(self, user_id: int, trip_id: int):
+        return await self._run(self.db.switch_trip, user_id, trip_id)
+
+    async def add_expense(self, **kwargs) -> int:
+        return await self._run(self.db.add_expense, **kwargs)
+
+    async def add_expenses(self, trip_id: int,
+                           expenses: List[Tuple[Number, Number, Optional[str]]]) -> int:
+        return await self._run(self.db.add_expenses, trip_id, expenses)
+
+    async def add_imported_expenses(self, trip_id: int,
+                                    expenses: List[Tuple[str, Number, Number, Optional[str], str]]
+                                    ) -> int:
+        return await self._run(self.db.add_imported_expenses, trip_id, expenses)
+
+    async def update_expense_description(self, expense_id: int, description: str):
+        return await self._run(self.db.update_expense_description, expense_id, description)
+
+    async def get_expenses(self, trip_id: int, limit: int = 10) -> List[Dict]:
+        return await self._run(self.db.get_expenses, trip_id, limit)
+
+    async def get_expenses_page(self, trip_id: int, limit: int = 20,
+                                before: Optional[Tuple[str, int]] = None,
+                                after: Optional[Tuple[str, int]] = None) -> Dict:
+        return await self._run(self.db.get_expenses_page, trip_id, limit, before, after)
+
+    async def get_trip_stats(self, trip_id: int) -> Dict:
+        return await self._run(self.db.get_trip_stats, trip_id)
+
+    async def update_exchange_rate(self, trip_id: int, new_rate: Number):
+        return await self._run(self.db.update_exchange_rate, trip_id, new_rate)
+
+    def close(self):
+        """Остановка пула и закрытие соединений"""
+        self._executor.shutdown(wait=True)
+        self.db.close()
+
+
+if __name__ == "__main__":
+    # Регрессионная проверка планов: код возврата 1, если частый запрос
+    # перешёл на полное сканирование
+    import sys
 
-        conn.commit()
-        conn.close()
+    problems = Database(sys.argv[1] if len(sys.argv) > 1 else DB_PATH).find_table_scans()
+    for query_name, steps in problems.items():
+        print(f"{query_name}: {'; '.join(steps)}")
+    if problems:
+        sys.exit(1)
+    print("Все частые запросы используют индексы")
@@ -0,0 +1,163 @@
+"""
+Параллельная обработка обновлений Telegram с сохранением порядка для пользователя
+
+Обновления распределяются по шардам по user_id: у каждого шарда своя
+ограниченная очередь и свой поток-обработчик. Обновления одного пользователя
+всегда попадают в один шард и обрабатываются строго по порядку, а медленный
+обработчик одного пользователя не задерживает пользователей других шардов.
+Когда очередь шарда заполнена, приём новых обновлений блокируется
+(обратное давление на цикл получения обновлений).
+"""
+import logging
+import queue
+import threading
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Поля Update, содержащие объект с отправителем
+_UPDATE_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query",
+    "chosen_inline_result", "shipping_query", "pre_checkout_query",
+    "poll_answer", "my_chat_member", "chat_member", "chat_join_request",
+    "business_message", "edited_business_message",
+)
+
+_STOP = object()
+
+
+def get_update_user_id(update) -> Optional[int]:
+    """ID пользователя, отправившего обновление (None, если его нет)"""
+    for field in _UPDATE_FIELDS:
+        obj = getattr(update, field, None)
+        if obj is None:
+            continue
+        user = getattr(obj, "from_user", None) or getattr(obj, "user", None)
+        if user is not None:
+            return user.id
+    return None
+
+
+def shard_key(update) -> int:
+    """Ключ распределения: user_id, а для обновлений без пользователя — update_id"""
+    user_id = get_update_user_id(update)
+    return user_id if user_id is not None else update.update_id
+
+
+class ShardedDispatcher:
+    def __init__(self, process: Callable[[list], None], workers: int = 8,
+                 queue_size: int = 1000, put_timeout: Optional[float] = None):
+        """
+        Args:
+            process: Обработка списка обновлений (например, исходный
+                TeleBot.process_new_updates)
+            workers: Число шардов (потоков-обработчиков)
+            queue_size: Максимальная длина очереди одного шарда
+            put_timeout: Сколько ждать места в очереди (сек); None — ждать
+                без ограничения, иначе по истечении обновление отбрасывается
+        """
+        self._process = process
+        self.workers = workers
+        self.put_timeout = put_timeout
+        self._queues: List[queue.Queue] = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.processed = 0
+        self.rejected = 0
+        self.failed = 0
+        self._max_depth = [0] * workers
+        self._threads = [
+            threading.Thread(target=self._run, args=(i,), name=f"dispatch-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def shard_for(self, update) -> int:
+        return shard_key(update) % self.workers
+
+    def submit(self, update) -> bool:
+        """
+        Постановка обновления в очередь его шарда
+
+        Returns:
+            False, если очередь переполнена дольше put_timeout
+        """
+        shard = self.shard_for(update)
+        q = self._queues[shard]
+        try:
+            q.put(update, timeout=self.put_timeout)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            logger.warning("Очередь шарда %d переполнена, обновление %s отброшено",
+                           shard, update.update_id)
+            return False
+        depth = q.qsize()
+        with self._lock:
+            self.submitted += 1
+            if depth > self._max_depth[shard]:
+                self._max_depth[shard] = depth
+        return True
+
+    def process_new_updates(self, updates: list):
+        """Замена TeleBot.process_new_updates: раздача обновлений по шардам"""
+        for update in updates:
+            self.submit(update)
+
+    def _run(self, shard: int):
+        q = self._queues[shard]
+        while True:
+            update = q.get()
+            try:
+                if update is _STOP:
+                    return
+                self._process([update])
+                with self._lock:
+                    self.processed += 1
+            except Exception:
+                with self._lock:
+                    self.failed += 1
+                logger.exception("Ошибка обработки обновления %s", update.update_id)
+            finally:
+                q.task_done()
+
+    def drain(self):
+        """Ожидание обработки всех поставленных в очередь обновлений"""
+        for q in self._queues:
+            q.join()
+
+    def shutdown(self, wait: bool = True):
+        """Остановка потоков после обработки уже принятых обновлений"""
+        for q in self._queues:
+            q.put(_STOP)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def stats(self) -> Dict:
+        """Метрики: глубина очередей по шардам и счётчики обновлений"""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_depth": [q.qsize() for q in self._queues],
+                "max_queue_depth": list(self._max_depth),
+                "submitted": self.submitted,
+                "processed": self.processed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+            }
+
+
+def install(bot, workers: int = 8, queue_size: int = 1000,
+            put_timeout: Optional[float] = None) -> ShardedDispatcher:
+    """
+    Подключение диспетчера к TeleBot
+
+    Бот должен быть создан с threaded=False: обработчики выполняются
+    в потоках диспетчера, а не в пуле telebot.
+    """
+    dispatcher = ShardedDispatcher(bot.process_new_updates, workers=workers,
+                                   queue_size=queue_size, put_timeout=put_timeout)
+    bot.process_new_updates = dispatcher.process_new_updates
+    return dispatcher
@@ -0,0 +1,140 @@
+"""
+Выгрузка расходов в CSV или JSON Lines (gzip)
+
+Расходы читаются из базы курсором пачками (Database.iter_expenses),
+строки формируются генераторами и сразу сжимаются в поток gzip, поэтому
+память не зависит от числа расходов: 10 и 1 000 000 строк выгружаются
+одинаково. Используется командой /export и для выгрузки данных вручную:
+    python export.py --user 123456 [--trip 7] [--format csv|jsonl] [-o trips.csv.gz]
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import sys
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from database import DB_PATH, EXPORT_BATCH_SIZE, Database
+
+COLUMNS = (
+    "trip_id", "trip", "expense_id", "created_at",
+    "amount", "currency", "amount_home", "home_currency", "description",
+)
+
+
+def export_rows(db: Database, trips: List[Dict]) -> Iterator[Tuple]:
+    """Строки выгрузки (в порядке COLUMNS): расходы путешествий по очереди, от старых к новым"""
+    for trip in trips:
+        for expense in db.iter_expenses(trip['id']):
+            yield (
+                trip['id'], trip['name'], expense['id'], expense['created_at'],
+                expense['amount_to'], trip['to_currency'],
+                expense['amount_from'], trip['from_currency'],
+                expense['description'] or "",
+            )
+
+
+def csv_chunks(rows: Iterable[Tuple]) -> Iterator[str]:
+    """CSV с заголовком; BOM — чтобы Excel открыл файл в UTF-8"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")
+    writer.writerow(COLUMNS)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def jsonl_chunks(rows: Iterable[Tuple]) -> Iterator[str]:
+    """JSON Lines: объект на строку; суммы — строками, без потери точности"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False, default=str))
+        if len(lines) == EXPORT_BATCH_SIZE:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+FORMATS: Dict[str, Callable[[Iterable[Tuple]], Iterator[str]]] = {
+    "csv": csv_chunks,
+    "jsonl": jsonl_chunks,
+}
+
+
+def parse_export_args(args: Iterable[str]) -> Tuple[str, bool]:
+    """Аргументы /export: формат ("json"/"jsonl" — JSON Lines) и все ли путешествия ("all"/"все")"""
+    words = {arg.lower() for arg in args}
+    fmt = "jsonl" if words & {"json", "jsonl"} else "csv"
+    return fmt, bool(words & {"all", "все"})
+
+
+def export_filename(fmt: str, trip: Optional[Dict] = None) -> str:
+    """Имя файла выгрузки: expenses_trip7.csv.gz или expenses_all.jsonl.gz"""
+    suffix = f"trip{trip['id']}" if trip else "all"
+    return f"expenses_{suffix}.{fmt}.gz"
+
+
+def write_export(db: Database, user_id: int, fileobj: BinaryIO, fmt: str = "csv",
+                 trip_id: Optional[int] = None) -> int:
+    """
+    Выгрузка расходов пользователя в fileobj (gzip)
+
+    Выполняется целиком в вызывающем потоке: курсор и соединение базы
+    принадлежат потоку.
+
+    Args:
+        trip_id: Только это путешествие; None — все путешествия пользователя
+
+    Returns:
+        int: Число выгруженных расходов
+    """
+    trips = db.get_user_trips(user_id)
+    if trip_id is not None:
+        trips = [trip for trip in trips if trip['id'] == trip_id]
+
+    count = 0
+
+    def counted(rows: Iterable[Tuple]) -> Iterator[Tuple]:
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+
+    # mtime=0: одинаковые данные дают одинаковый файл
+    with gzip.GzipFile(fileobj=fileobj, mode="wb", mtime=0) as stream:
+        for chunk in FORMATS[fmt](counted(export_rows(db, trips))):
+            stream.write(chunk.encode("utf-8"))
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Выгрузка расходов пользователя (gzip)")
+    parser.add_argument("--db", default=DB_PATH, help="Путь к файлу базы данных")
+    parser.add_argument("--user", type=int, required=True, help="ID пользователя Telegram")
+    parser.add_argument("--trip", type=int, help="Только это путешествие (по умолчанию — все)")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="csv", help="Формат строк")
+    parser.add_argument("-o", "--output", default="-", help="Файл выгрузки (- — stdout)")
+    args = parser.parse_args()
+
+    db = Database(args.db)
+    try:
+        if args.output == "-":
+            count = write_export(db, args.user, sys.stdout.buffer, args.format, args.trip)
+        else:
+            with open(args.output, "wb") as f:
+                count = write_export(db, args.user, f, args.format, args.trip)
+    finally:
+        db.close()
+
+    print(f"Выгружено расходов: {count}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Табличная маршрутизация обновлений по состояниям FSM
+
+Router заменяет цепочки if/elif и отдельные фильтры callback_query_handler
+(telebot проверяет фильтры по очереди для каждого нажатия) словарями:
+- состояние -> обработчик текстового сообщения;
+- callback_data -> обработчик нажатия (точное совпадение) и
+  префикс callback_data -> обработчик (например, "switch_trip_").
+Поиск обработчика — обращение к словарю; все вызовы проходят через одно
+место, где их длительность передаётся хуку (см. set_timing_hook).
+
+Transitions описывает допустимые переходы между состояниями и проверяет
+их при установке состояния (user_state.set_user_state).
+"""
+import time
+from typing import Callable, Dict, Iterable, Optional, Set
+
+# Хук замера: (тип, ключ, длительность в секундах), например
+# ("message", "waiting_from_country", 0.012) или ("callback", "rate_yes", 0.3)
+TimingHook = Callable[[str, str, float], None]
+
+# Ключ обработчика сообщений без состояния
+NO_STATE = "none"
+
+
+class InvalidTransition(ValueError):
+    """Переход между состояниями, не описанный в таблице"""
+
+
+class Transitions:
+    def __init__(self, transitions: Dict[Optional[str], Iterable[str]],
+                 entry_states: Iterable[str] = ()):
+        """
+        Args:
+            transitions: Состояние -> состояния, в которые из него можно
+                перейти (None — пользователь без состояния)
+            entry_states: Состояния, в которые можно перейти из любого
+                (начало диалога по команде или кнопке меню)
+        """
+        self.transitions: Dict[Optional[str], Set[str]] = {
+            state: frozenset(targets) for state, targets in transitions.items()
+        }
+        self.entry_states = frozenset(entry_states)
+
+    @property
+    def states(self) -> Set[str]:
+        """Все состояния, упомянутые в таблице"""
+        states = set(self.entry_states)
+        for state, targets in self.transitions.items():
+            if state is not None:
+                states.add(state)
+            states.update(targets)
+        return states
+
+    def is_allowed(self, from_state: Optional[str], to_state: str) -> bool:
+        return to_state in self.entry_states or to_state in self.transitions.get(from_state, ())
+
+    def check(self, from_state: Optional[str], to_state: str):
+        """Проверка перехода; InvalidTransition, если он не описан в таблице"""
+        if not self.is_allowed(from_state, to_state):
+            raise InvalidTransition(f"Недопустимый переход состояния: {from_state} -> {to_state}")
+
+
+class Router:
+    def __init__(self):
+        self._states: Dict[str, Callable] = {}
+        # Состояния, в которых текст игнорируется (ожидается нажатие кнопки)
+        self._ignored: Set[str] = set()
+        self._default: Optional[Callable] = None
+        self._exact: Dict[str, Callable] = {}
+        # Префиксы сгруппированы по длине: для поиска достаточно одного
+        # среза callback_data на каждую длину
+        self._prefixes: Dict[int, Dict[str, Callable]] = {}
+        self._timing_hook: Optional[TimingHook] = None
+
+    # Регистрация обработчиков
+
+    def state(self, *states: str):
+        """Декоратор: обработчик текста в указанных состояниях"""
+        def decorator(handler):
+            for state in states:
+                self._add(self._states, state, handler)
+            return handler
+        return decorator
+
+    def ignore(self, *states: str):
+        """Текст в этих состояниях не обрабатывается (ответ ждётся кнопкой)"""
+        self._ignored.update(states)
+
+    def default(self, handler):
+        """Декоратор: обработчик текста вне известных состояний"""
+        self._default = handler
+        return handler
+
+    def callback(self, *data: str, prefix: Optional[str] = None):
+        """Декоратор: обработчик нажатия по точному callback_data или префиксу"""
+        def decorator(handler):
+            for value in data:
+                self._add(self._exact, value, handler)
+            if prefix is not None:
+                self._add(self._prefixes.setdefault(len(prefix), {}), prefix, handler)
+            return handler
+        return decorator
+
+    @staticmethod
+    def _add(table: Dict[str, Callable], key: str, handler: Callable):
+        if key in table:
+            raise ValueError(f"Обработчик для '{key}' уже зарегистрирован")
+        table[key] = handler
+
+    def set_timing_hook(self, hook: Optional[TimingHook]):
+        """Хук, получающий длительность каждого вызова обработчика"""
+        self._timing_hook = hook
+
+    # Поиск обработчиков
+
+    def message_handler(self, state: Optional[str]) -> Optional[Callable]:
+        """Обработчик текста для состояния (None — текст игнорируется)"""
+        if state in self._ignored:
+            return None
+        return self._states.get(state, self._default)
+
+    def callback_handler(self, data: str) -> Optional[Callable]:
+        handler = self._exact.get(data)
+        if handler is not None:
+            return handler
+        for length, prefixes in self._prefixes.items():
+            handler = prefixes.get(data[:length])
+            if handler is not None:
+                return handler
+        return None
+
+    def _callback_key(self, data: str) -> str:
+        if data in self._exact:
+            return data
+        for length, prefixes in self._prefixes.items():
+            if data[:length] in prefixes:
+                return data[:length]
+        return data
+
+    # Вызов
+
+    def _record(self, kind: str, key: str, started: float):
+        if self._timing_hook is not None:
+            self._timing_hook(kind, key, time.perf_counter() - started)
+
+    def dispatch_message(self, state: Optional[str], message, text: str) -> bool:
+        """
+        Вызов обработчика текста для состояния
+
+        Returns:
+            True, если обработчик найден и вызван
+        """
+        handler = self.message_handler(state)
+        if handler is None:
+            return False
+        started = time.perf_counter()
+        try:
+            handler(message, text)
+        finally:
+            self._record("message", state or NO_STATE, started)
+        return True
+
+    def dispatch_callback(self, call) -> bool:
+        """Вызов обработчика нажатия; False, если callback_data неизвестен"""
+        handler = self.callback_handler(call.data)
+        if handler is None:
+            return False
+        started = time.perf_counter()
+        try:
+            handler(call)
+        finally:
+            self._record("callback", self._callback_key(call.data), started)
+        return True
+
+    async def dispatch_message_async(self, state: Optional[str], message, text: str) -> bool:
+        """То же, что dispatch_message, для асинхронных обработчиков"""
+        handler = self.message_handler(state)
+        if handler is None:
+            return False
+        started = time.perf_counter()
+        try:
+            await handler(message, text)
+        finally:
+            self._record("message", state or NO_STATE, started)
+        return True
+
+    async def dispatch_callback_async(self, call) -> bool:
+        """То же, что dispatch_callback, для асинхронных обработчиков"""
+        handler = self.callback_handler(call.data)
+        if handler is None:
+            return False
+        started = time.perf_counter()
+        try:
+            await handler(call)
+        finally:
+            self._record("callback", self._callback_key(call.data), started)
+        return True
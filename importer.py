@@ -0,0 +1,425 @@
+"""
+Импорт расходов из CSV (выписка по карте)
+
+Формат файла определяется по его началу (SAMPLE_SIZE байт):
+- кодировка: UTF-8 или Windows-1251;
+- разделитель: csv.Sniffer;
+- строка заголовка и столбцы даты, суммы и описания — по названиям в
+  заголовке, без заголовка — по содержимому;
+- десятичный разделитель (точка или запятая) и формат даты;
+- знак расходов: если в выписке есть отрицательные суммы, расходами
+  считаются они, а положительные (поступления) пропускаются.
+
+Суммы считаются в валюте страны пребывания и пересчитываются по курсу
+путешествия. Файл читается построчно, расходы добавляются пачками по
+IMPORT_BATCH_SIZE — каждая пачка в своей транзакции, в памяти только она.
+
+Повторный импорт того же файла ничего не добавляет: у строки есть
+import_hash — хэш даты, суммы, описания и номера повтора такой же строки
+среди строк с той же датой (две одинаковые покупки за день — два расхода).
+
+Загрузка файла вручную:
+    python importer.py --user 123456 --trip 7 statement.csv
+"""
+import argparse
+import codecs
+import csv
+import hashlib
+import io
+import os
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+from database import DB_PATH, Database
+from money import quantize
+
+# Число строк в одной транзакции
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+
+# Начало файла, по которому определяется формат, и число строк образца
+SAMPLE_SIZE = 64 * 1024
+SAMPLE_ROWS = 50
+
+# Наибольший размер файла, который бот может скачать через Bot API
+MAX_FILE_SIZE = 20 * 1024 * 1024
+
+# Форматы дат в порядке предпочтения: при неоднозначности (01/02/2024)
+# выбирается день перед месяцем
+DATE_FORMATS = (
+    ("%d.%m.%Y", "ДД.ММ.ГГГГ"),
+    ("%Y-%m-%d", "ГГГГ-ММ-ДД"),
+    ("%d/%m/%Y", "ДД/ММ/ГГГГ"),
+    ("%m/%d/%Y", "ММ/ДД/ГГГГ"),
+    ("%d-%m-%Y", "ДД-ММ-ГГГГ"),
+    ("%Y/%m/%d", "ГГГГ/ММ/ДД"),
+    ("%Y.%m.%d", "ГГГГ.ММ.ДД"),
+    ("%d.%m.%y", "ДД.ММ.ГГ"),
+)
+
+# Названия столбцов в заголовке (без регистра, вхождением); раньше в
+# списке — предпочтительнее: "Сумма операции", а не "Сумма платежа"
+HEADER_NAMES = {
+    "date": ("дата операции", "дата", "date", "время", "time"),
+    "amount": ("сумма операции", "сумма в валюте операции", "сумма", "amount", "списание",
+               "расход", "debit", "value"),
+    "description": ("описание", "назначение", "наименование", "место", "контрагент",
+                    "description", "details", "merchant", "payee", "memo", "категория",
+                    "category"),
+}
+
+_DELIMITERS = ";,\t|"
+_TIME_RE = re.compile(r"(\d{1,2}):(\d{2})(?::(\d{2}))?")
+# Всё, кроме цифр, разделителей и знака: пробелы, символы и коды валют
+_AMOUNT_NOISE_RE = re.compile(r"[^\d.,+\-−]")
+_AMOUNT_RE = re.compile(r"[+-]?\d+(?:\.\d+)?")
+
+
+def _split_datetime(text: str) -> Tuple[str, str]:
+    """Дата и время из "31.12.2024 18:45", "2024-12-31T18:45:00" """
+    parts = text.strip().replace("T", " ", 1).split(None, 1)
+    if not parts:
+        return "", ""
+    return parts[0], parts[1] if len(parts) > 1 else ""
+
+
+def _date_formats(text: str) -> List[str]:
+    """Форматы из DATE_FORMATS, подходящие к дате"""
+    date_text, _ = _split_datetime(text)
+    formats = []
+    for date_format, _ in DATE_FORMATS:
+        try:
+            datetime.strptime(date_text, date_format)
+        except ValueError:
+            continue
+        formats.append(date_format)
+    return formats
+
+
+@lru_cache(maxsize=1024)
+def _parse_day(date_text: str, date_format: str) -> Optional[str]:
+    # В выписке много строк с одной датой, а strptime медленный
+    try:
+        return datetime.strptime(date_text, date_format).date().isoformat()
+    except ValueError:
+        return None
+
+
+def parse_date(text: str, date_format: str) -> Optional[str]:
+    """Дата и время расхода в формате created_at ("2024-12-31 18:45:00")"""
+    date_text, time_text = _split_datetime(text)
+    day = _parse_day(date_text, date_format)
+    if day is None:
+        return None
+    match = _TIME_RE.match(time_text)
+    hours, minutes, seconds = (
+        (int(match.group(1)), int(match.group(2)), int(match.group(3) or 0)) if match else (0, 0, 0)
+    )
+    if hours > 23 or minutes > 59 or seconds > 59:
+        return None
+    return f"{day} {hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+def _amount_text(text: str) -> str:
+    return _AMOUNT_NOISE_RE.sub("", text).replace("−", "-")
+
+
+def _has_decimal_comma(text: str) -> bool:
+    """Запятая — десятичный разделитель: "89,5", "1 234,56", "1.234,56" (но не "1,234")"""
+    text = _amount_text(text)
+    comma = text.rfind(",")
+    if comma < 0 or comma < text.rfind("."):
+        return False
+    return "." in text or len(text) - comma - 1 != 3
+
+
+def parse_amount_value(text: str, decimal_comma: bool) -> Optional[Decimal]:
+    """Сумма из ячейки выписки ("-1 234,56 ₽", "1,234.56", "USD 12.50")"""
+    text = _amount_text(text)
+    if decimal_comma:
+        text = text.replace(".", "").replace(",", ".")
+    else:
+        text = text.replace(",", "")
+    if not _AMOUNT_RE.fullmatch(text):
+        return None
+    try:
+        return Decimal(text)
+    except InvalidOperation:
+        return None
+
+
+class ImportFormat:
+    """Формат файла выписки (см. detect_format)"""
+
+    __slots__ = ("encoding", "dialect", "has_header", "date_column", "amount_column",
+                 "description_column", "date_format", "decimal_comma", "negative_expenses")
+
+    def __init__(self, encoding: str, dialect, has_header: bool, date_column: int,
+                 amount_column: int, description_column: Optional[int], date_format: str,
+                 decimal_comma: bool, negative_expenses: bool):
+        self.encoding = encoding
+        self.dialect = dialect
+        self.has_header = has_header
+        self.date_column = date_column
+        self.amount_column = amount_column
+        # None — в выписке нет описаний
+        self.description_column = description_column
+        self.date_format = date_format
+        self.decimal_comma = decimal_comma
+        # True — расходы записаны отрицательными суммами, положительные — поступления
+        self.negative_expenses = negative_expenses
+
+    def parse(self, row: List[str]) -> Optional[Tuple[str, Decimal, str]]:
+        """Строка выписки -> (created_at, сумма со знаком, описание); None — строка не распознана"""
+        if len(row) <= max(self.date_column, self.amount_column):
+            return None
+        created_at = parse_date(row[self.date_column], self.date_format)
+        amount = parse_amount_value(row[self.amount_column], self.decimal_comma)
+        if created_at is None or amount is None:
+            return None
+        description = ""
+        if self.description_column is not None and self.description_column < len(row):
+            description = " ".join(row[self.description_column].split())
+        return created_at, amount, description
+
+    def expense_amount(self, amount: Decimal) -> Optional[Decimal]:
+        """Сумма расхода; None — поступление или нулевая сумма"""
+        if self.negative_expenses:
+            return -amount if amount < 0 else None
+        return abs(amount) or None
+
+    def describe(self) -> str:
+        """Описание формата для пользователя"""
+        delimiter = {"\t": "табуляция", " ": "пробел"}.get(self.dialect.delimiter,
+                                                             f"«{self.dialect.delimiter}»")
+        date_name = dict(DATE_FORMATS)[self.date_format]
+        return (f"разделитель {delimiter}, "
+                f"десятичная {'запятая' if self.decimal_comma else 'точка'}, даты {date_name}")
+
+    def __repr__(self) -> str:
+        return (f"ImportFormat({self.encoding}, {self.dialect.delimiter!r}, "
+                f"{self.date_column}/{self.amount_column}/{self.description_column}, "
+                f"{self.date_format}, decimal_comma={self.decimal_comma})")
+
+
+def _decode_sample(sample: bytes) -> Tuple[str, str]:
+    """Кодировка и текст начала файла (последний символ может быть обрезан)"""
+    try:
+        return "utf-8-sig", codecs.getincrementaldecoder("utf-8-sig")().decode(sample)
+    except UnicodeDecodeError:
+        return "cp1251", sample.decode("cp1251", errors="replace")
+
+
+def _find_column(header: List[str], names: Iterable[str], used: Iterable[int]) -> Optional[int]:
+    cells = [cell.strip().casefold() for cell in header]
+    for name in names:
+        for index, cell in enumerate(cells):
+            if name in cell and index not in used:
+                return index
+    return None
+
+
+def _column(rows: List[List[str]], index: int) -> List[str]:
+    return [row[index] for row in rows if index < len(row) and row[index].strip()]
+
+
+def _share(values: List[str], check) -> float:
+    return sum(1 for value in values if check(value)) / len(values) if values else 0.0
+
+
+def detect_format(sample: bytes) -> ImportFormat:
+    """
+    Определение формата выписки по началу файла
+
+    Raises:
+        ValueError: Не удалось найти столбцы даты и суммы
+    """
+    encoding, text = _decode_sample(sample)
+    lines = text.splitlines()
+    if len(sample) >= SAMPLE_SIZE and len(lines) > 1:
+        # Последняя строка образца может быть обрезана
+        lines = lines[:-1]
+    text = "\n".join(lines[:SAMPLE_ROWS + 1])
+
+    try:
+        dialect = csv.Sniffer().sniff(text, delimiters=_DELIMITERS)
+    except csv.Error:
+        first_line = lines[0] if lines else ""
+        delimiter = max(_DELIMITERS, key=first_line.count)
+        dialect = type("dialect", (csv.excel,), {"delimiter": delimiter})
+
+    rows = [row for row in csv.reader(io.StringIO(text), dialect) if any(cell.strip() for cell in row)]
+    if not rows:
+        raise ValueError("Файл пуст")
+
+    # Заголовок — первая строка, в которой нет ни одной даты
+    has_header = not any(_date_formats(cell) for cell in rows[0])
+    body = rows[1:] if has_header else rows
+    width = max(len(row) for row in rows)
+
+    date_column = amount_column = description_column = None
+    if has_header:
+        date_column = _find_column(rows[0], HEADER_NAMES["date"], ())
+        amount_column = _find_column(rows[0], HEADER_NAMES["amount"], (date_column,))
+        description_column = _find_column(rows[0], HEADER_NAMES["description"],
+                                          (date_column, amount_column))
+
+    # Без заголовка (или с незнакомыми названиями) — по содержимому столбцов
+    if date_column is None:
+        date_column = next((index for index in range(width)
+                            if _share(_column(body, index), _date_formats) >= 0.8), None)
+    if date_column is None:
+        raise ValueError("Не найден столбец с датой")
+    # Формат, подходящий к наибольшему числу дат (строка "Итого" не мешает);
+    # при равенстве — раньше в DATE_FORMATS
+    matches = [0] * len(DATE_FORMATS)
+    for value in _column(body, date_column):
+        formats = _date_formats(value)
+        for index, (date_format, _) in enumerate(DATE_FORMATS):
+            matches[index] += date_format in formats
+    best = max(range(len(DATE_FORMATS)), key=lambda index: (matches[index], -index))
+    if not matches[best]:
+        raise ValueError("Не удалось определить формат даты")
+    date_format = DATE_FORMATS[best][0]
+
+    def is_amount(value: str) -> bool:
+        return parse_amount_value(value, _has_decimal_comma(value)) is not None
+
+    if amount_column is None:
+        amount_column = next((index for index in range(width) if index != date_column
+                              and _share(_column(body, index), is_amount) >= 0.8), None)
+    if amount_column is None:
+        raise ValueError("Не найден столбец с суммой")
+    amount_values = _column(body, amount_column)
+    decimal_comma = any(_has_decimal_comma(value) for value in amount_values)
+
+    if description_column is None:
+        # Описание — столбец с самым длинным нечисловым текстом
+        candidates = [(sum(len(value) for value in values if not is_amount(value)), index)
+                      for index, values in ((index, _column(body, index)) for index in range(width))
+                      if index not in (date_column, amount_column)]
+        best = max(candidates, default=(0, None))
+        description_column = best[1] if best[0] else None
+
+    amounts = [amount for amount in (parse_amount_value(value, decimal_comma)
+                                     for value in amount_values) if amount is not None]
+    negative_expenses = any(amount < 0 for amount in amounts)
+
+    return ImportFormat(encoding, dialect, has_header, date_column, amount_column,
+                        description_column, date_format, decimal_comma, negative_expenses)
+
+
+def import_hash(created_at: str, amount: Decimal, description: str, occurrence: int) -> str:
+    """Хэш строки выписки для пропуска повторов"""
+    key = f"{created_at}|{amount}|{description}|{occurrence}"
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def import_expenses(db: Database, trip: Dict, fileobj: BinaryIO,
+                    batch_size: int = IMPORT_BATCH_SIZE) -> Dict:
+    """
+    Импорт расходов из CSV-файла в путешествие
+
+    Выполняется целиком в вызывающем потоке (соединение базы принадлежит потоку).
+
+    Args:
+        trip: Путешествие (Database.get_active_trip)
+        fileobj: Файл, открытый на чтение в двоичном режиме (с произвольным доступом)
+
+    Returns:
+        Dict: format (ImportFormat), rows — строк с данными, imported — добавлено
+        расходов, duplicates — уже были импортированы, skipped — поступления и
+        нулевые суммы, errors — нераспознанные строки
+
+    Raises:
+        ValueError: Не удалось определить формат файла
+    """
+    import_format = detect_format(fileobj.read(SAMPLE_SIZE))
+    fileobj.seek(0)
+
+    summary = {'format': import_format, 'rows': 0, 'imported': 0, 'duplicates': 0,
+               'skipped': 0, 'errors': 0}
+    rate = trip['exchange_rate']
+    batch: List[Tuple[str, Decimal, Decimal, str, str]] = []
+    # Номера повторов одинаковых строк — только для текущей даты
+    current_day = None
+    occurrences: Dict[Tuple[str, Decimal, str], int] = {}
+
+    def flush():
+        imported = db.add_imported_expenses(trip['id'], batch)
+        summary['imported'] += imported
+        summary['duplicates'] += len(batch) - imported
+        batch.clear()
+
+    stream = io.TextIOWrapper(fileobj, encoding=import_format.encoding, errors="replace", newline="")
+    try:
+        reader = csv.reader(stream, import_format.dialect)
+        if import_format.has_header:
+            next(reader, None)
+        for row in reader:
+            if not any(cell.strip() for cell in row):
+                continue
+            summary['rows'] += 1
+            parsed = import_format.parse(row)
+            if parsed is None:
+                summary['errors'] += 1
+                continue
+            created_at, amount, description = parsed
+            amount = import_format.expense_amount(amount)
+            if amount is None:
+                summary['skipped'] += 1
+                continue
+
+            amount_to = quantize(amount, trip['to_currency'])
+            amount_from = quantize(amount_to / rate, trip['from_currency'])
+
+            if created_at[:10] != current_day:
+                current_day = created_at[:10]
+                occurrences.clear()
+            key = (created_at, amount_to, description)
+            occurrence = occurrences.get(key, 0)
+            occurrences[key] = occurrence + 1
+
+            batch.append((created_at, amount_to, amount_from, description,
+                          import_hash(created_at, amount_to, description, occurrence)))
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+    finally:
+        # Файл закрывает вызывающий код
+        stream.detach()
+
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Импорт расходов из CSV-выписки в путешествие")
+    parser.add_argument("file", help="CSV-файл выписки")
+    parser.add_argument("--db", default=DB_PATH, help="Путь к файлу базы данных")
+    parser.add_argument("--user", type=int, required=True, help="ID пользователя Telegram")
+    parser.add_argument("--trip", type=int, required=True, help="ID путешествия")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE,
+                        help="Число строк в одной транзакции")
+    args = parser.parse_args()
+
+    db = Database(args.db)
+    try:
+        trip = next((trip for trip in db.get_user_trips(args.user) if trip['id'] == args.trip), None)
+        if trip is None:
+            parser.error(f"У пользователя {args.user} нет путешествия {args.trip}")
+        with open(args.file, "rb") as f:
+            summary = import_expenses(db, trip, f, args.batch_size)
+    finally:
+        db.close()
+
+    print(f"Формат: {summary['format'].describe()}")
+    print(f"Строк: {summary['rows']}, добавлено: {summary['imported']}, "
+          f"повторов: {summary['duplicates']}, пропущено: {summary['skipped']}, "
+          f"не распознано: {summary['errors']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+"""
+Гистограммы времени выполнения: обработчики, запросы к базе, API курсов, Telegram
+
+Каждая гистограмма хранит счётчики по корзинам отдельно для каждого потока
+(threading.local): запись — увеличение элемента списка своего потока, без
+блокировок и без гонок между потоками. Счётчики потоков суммируются только
+при чтении (render, summary); счётчики завершившихся потоков переносятся
+в общий базовый набор, чтобы их число не росло вместе с числом потоков.
+Накладные расходы timed — около микросекунды на вызов
+(см. benchmarks/bench_metrics.py); METRICS_ENABLED=0 отключает замеры
+полностью (декораторы возвращают исходную функцию).
+
+Результаты доступны в текстовом формате Prometheus (HTTP-сервер на
+METRICS_PORT) и командой /metrics для администраторов бота (ADMIN_IDS).
+Метрики у каждого процесса свои.
+"""
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+# Префикс имён метрик Prometheus
+NAMESPACE = "travel_wallet"
+
+# Верхние границы корзин (сек): от 50 мкс до минуты
+DEFAULT_BOUNDS: Tuple[float, ...] = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    def __init__(self, bounds: Sequence[float] = DEFAULT_BOUNDS):
+        self.bounds = tuple(bounds)
+        self._local = threading.local()
+        # Счётчики потоков: (поток, [корзины..., +Inf, сумма])
+        self._shards: List[Tuple[threading.Thread, list]] = []
+        # Счётчики завершившихся потоков
+        self._base = self._empty_shard()
+        self._shards_lock = threading.Lock()
+
+    def _empty_shard(self) -> list:
+        return [0] * (len(self.bounds) + 1) + [0.0]
+
+    def _new_shard(self) -> list:
+        shard = self._empty_shard()
+        # Блокировка нужна только при первой записи из нового потока
+        with self._shards_lock:
+            self._fold_dead_shards()
+            self._shards.append((threading.current_thread(), shard))
+        self._local.shard = shard
+        return shard
+
+    def _fold_dead_shards(self):
+        """Перенос счётчиков завершившихся потоков в базовый набор (под _shards_lock)"""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                # Поток завершился и больше не пишет в свой набор
+                for i, value in enumerate(shard):
+                    self._base[i] += value
+        self._shards = alive
+
+    def observe(self, seconds: float):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        shard[bisect_left(self.bounds, seconds)] += 1
+        shard[-1] += seconds
+
+    def time(self) -> "_Timer":
+        """Замер блока кода: with histogram.time(): ..."""
+        return _Timer(self)
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        """(счётчики по корзинам, включая +Inf; сумма) по всем потокам"""
+        with self._shards_lock:
+            self._fold_dead_shards()
+            shards = [list(self._base)] + [shard for _, shard in self._shards]
+        counts = [0] * (len(self.bounds) + 1)
+        total = 0.0
+        for shard in shards:
+            for i in range(len(counts)):
+                counts[i] += shard[i]
+            total += shard[-1]
+        return counts, total
+
+    def quantile(self, q: float, counts: Optional[List[int]] = None) -> Optional[float]:
+        """Оценка квантиля по корзинам (линейная интерполяция внутри корзины)"""
+        if counts is None:
+            counts = self.snapshot()[0]
+        count = sum(counts)
+        if not count:
+            return None
+        rank = q * count
+        cumulative = 0
+        for i, bucket in enumerate(counts):
+            if bucket and cumulative + bucket >= rank:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[i - 1] if i else 0.0
+                return lower + (self.bounds[i] - lower) * (rank - cumulative) / bucket
+            cumulative += bucket
+        return self.bounds[-1]
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_started")
+
+    def __init__(self, histogram: Histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._started)
+        return False
+
+
+class Family:
+    """Гистограммы одной метрики с разными значениями меток"""
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str],
+                 bounds: Sequence[float] = DEFAULT_BOUNDS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.bounds = tuple(bounds)
+        self._children: Dict[Tuple[str, ...], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str) -> Histogram:
+        histogram = self._children.get(values)
+        if histogram is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name}: ожидаются метки {self.label_names}")
+            with self._lock:
+                histogram = self._children.setdefault(values, Histogram(self.bounds))
+        return histogram
+
+    def children(self) -> List[Tuple[Tuple[str, ...], Histogram]]:
+        with self._lock:
+            return sorted(self._children.items())
+
+
+REGISTRY: Dict[str, Family] = {}
+
+
+def histogram(name: str, help_text: str, label_names: Sequence[str]) -> Family:
+    """Регистрация семейства гистограмм (повторный вызов возвращает существующее)"""
+    family = REGISTRY.get(name)
+    if family is None:
+        family = REGISTRY[name] = Family(f"{NAMESPACE}_{name}", help_text, label_names)
+    return family
+
+
+HANDLER_SECONDS = histogram("handler_seconds", "Время обработчиков Telegram", ("handler",))
+FSM_SECONDS = histogram("fsm_seconds", "Время обработчиков по состоянию FSM и callback_data",
+                        ("kind", "key"))
+DB_SECONDS = histogram("db_seconds", "Время методов Database", ("method",))
+CURRENCY_SECONDS = histogram("currency_api_seconds", "Время функций currency_api", ("function",))
+RATE_HTTP_SECONDS = histogram("rate_api_http_seconds", "Время HTTP-запросов к API курсов",
+                              ("endpoint",))
+TELEGRAM_SECONDS = histogram("telegram_api_seconds", "Время запросов к Telegram Bot API",
+                             ("method",))
+
+
+def timed(family: Family, name: Optional[str] = None):
+    """
+    Декоратор: длительность вызовов функции в гистограмму family
+
+    Args:
+        family: Семейство с одной меткой
+        name: Значение метки; по умолчанию имя функции
+
+    Поддерживаются и обычные функции, и корутины.
+    """
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+        observe = family.labels(name or func.__name__).observe
+        perf_counter = time.perf_counter
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    observe(perf_counter() - started)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def fsm_timing_hook(kind: str, key: str, seconds: float):
+    """Хук для fsm.Router.set_timing_hook"""
+    FSM_SECONDS.labels(kind, key).observe(seconds)
+
+
+def instrument_telegram():
+    """Замер запросов к Telegram Bot API (синхронный и асинхронный клиенты telebot)"""
+    if not METRICS_ENABLED:
+        return
+    from telebot import apihelper
+
+    if not getattr(apihelper._make_request, "_timed", False):
+        make_request = apihelper._make_request
+
+        @functools.wraps(make_request)
+        def timed_make_request(token, method_name, *args, **kwargs):
+            with TELEGRAM_SECONDS.labels(method_name).time():
+                return make_request(token, method_name, *args, **kwargs)
+
+        timed_make_request._timed = True
+        apihelper._make_request = timed_make_request
+
+    try:
+        from telebot import asyncio_helper
+    except ImportError:
+        # Асинхронный клиент требует aiohttp
+        return
+    if not getattr(asyncio_helper._process_request, "_timed", False):
+        process_request = asyncio_helper._process_request
+
+        @functools.wraps(process_request)
+        async def timed_process_request(token, url, *args, **kwargs):
+            with TELEGRAM_SECONDS.labels(url).time():
+                return await process_request(token, url, *args, **kwargs)
+
+        timed_process_request._timed = True
+        asyncio_helper._process_request = timed_process_request
+
+
+def _format_labels(label_names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus (histogram)"""
+    lines = []
+    for family in REGISTRY.values():
+        lines.append(f"# HELP {family.name} {family.help}")
+        lines.append(f"# TYPE {family.name} histogram")
+        for values, hist in family.children():
+            counts, total = hist.snapshot()
+            cumulative = 0
+            for bound, count in zip(list(hist.bounds) + ["+Inf"], counts):
+                cumulative += count
+                le = bound if isinstance(bound, str) else repr(bound)
+                labels = _format_labels(family.label_names, values, f'le="{le}"')
+                lines.append(f"{family.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(family.label_names, values)
+            lines.append(f"{family.name}_sum{labels} {total!r}")
+            lines.append(f"{family.name}_count{labels} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def summary() -> List[Dict]:
+    """Число вызовов и квантили p50/p95/p99 (сек) по каждой гистограмме"""
+    rows = []
+    for family in REGISTRY.values():
+        for values, hist in family.children():
+            counts, total = hist.snapshot()
+            count = sum(counts)
+            if not count:
+                continue
+            row = {
+                "metric": family.name[len(NAMESPACE) + 1:],
+                "labels": dict(zip(family.label_names, values)),
+                "count": count,
+                "sum": total,
+            }
+            for q in QUANTILES:
+                row[f"p{round(q * 100)}"] = hist.quantile(q, counts)
+            rows.append(row)
+    return rows
+
+
+def summary_text() -> str:
+    """Сводка для команды /metrics"""
+    rows = summary()
+    if not rows:
+        return "📈 Замеров пока нет."
+    lines = ["📈 Время выполнения (мс): p50 / p95 / p99, число вызовов"]
+    metric = None
+    for row in rows:
+        if row["metric"] != metric:
+            metric = row["metric"]
+            lines.append(f"\n{metric}:")
+        label = ", ".join(row["labels"].values())
+        lines.append(
+            f"  {label}: {row['p50'] * 1000:.2f} / {row['p95'] * 1000:.2f} / "
+            f"{row['p99'] * 1000:.2f}, n={row['count']}"
+        )
+    return "\n".join(lines)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("metrics: " + format, *args)
+
+
+def start_http_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """HTTP-сервер с GET /metrics для Prometheus (в фоновом потоке)"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def start_from_env() -> Optional[ThreadingHTTPServer]:
+    """Запуск HTTP-сервера метрик, если задан METRICS_PORT"""
+    port = os.getenv("METRICS_PORT")
+    if not port or not METRICS_ENABLED:
+        return None
+    return start_http_server(int(port), os.getenv("METRICS_HOST", "0.0.0.0"))
+
+
+def admin_ids() -> frozenset:
+    """ID пользователей Telegram, которым доступна команда /metrics (ADMIN_IDS)"""
+    return frozenset(int(value) for value in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",")
+                     if value)
+
+
+def split_message(text: str, limit: int = 4000) -> List[str]:
+    """Разбиение длинного текста на сообщения по границам строк"""
+    parts, current = [], ""
+    for line in text.split("\n"):
+        if current and len(current) + len(line) + 1 > limit:
+            parts.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        parts.append(current)
+    return parts
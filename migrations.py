@@ -0,0 +1,425 @@
+"""
+Версионные миграции схемы базы данных
+
+Текущая версия схемы хранится в PRAGMA user_version. Миграции применяются
+по порядку, каждая — в своей транзакции вместе с увеличением версии.
+Пакетные обновления данных (Backfill) выполняются короткими транзакциями,
+чтобы не блокировать большие таблицы надолго.
+
+Запуск вручную:
+    python migrations.py [--db travel_wallet.db] [--dry-run]
+"""
+import argparse
+import sqlite3
+from typing import Callable, List, Sequence, Union
+
+from money import RATE_SCALE, exponent_case_sql
+
+
+class Backfill:
+    """
+    Пакетное обновление данных
+
+    sql выполняется с параметром batch_size (один плейсхолдер ``?``)
+    до тех пор, пока затрагивает строки; каждый пакет — отдельная транзакция.
+    Запрос должен сам исключать уже обработанные строки.
+    """
+
+    def __init__(self, sql: str, batch_size: int = 1000):
+        self.sql = sql
+        self.batch_size = batch_size
+
+
+Step = Union[str, Backfill]
+
+
+class Migration:
+    """
+    Шаг эволюции схемы
+
+    Инструкции до первого Backfill выполняются в отдельной транзакции
+    и должны быть идемпотентными (IF NOT EXISTS и т.п.): при сбое во время
+    пакетного обновления миграция будет запущена повторно. Инструкции после
+    последнего Backfill выполняются в одной транзакции с увеличением версии.
+    """
+
+    def __init__(self, version: int, description: str, steps: Sequence[Step]):
+        self.version = version
+        self.description = description
+        self.steps = list(steps)
+
+
+# Копирование строк в таблицы с целочисленными суммами (миграция 3).
+# Строки копируются по возрастанию id, уже скопированные пропускаются.
+_INSERT_TRIPS_V3 = f"""
+    INSERT INTO trips_v3 (id, user_id, name, from_country, to_country,
+                          from_currency, to_currency, exchange_rate_scaled,
+                          balance_from_minor, balance_to_minor, is_active, created_at)
+    SELECT id, user_id, name, from_country, to_country, from_currency, to_currency,
+           CAST(ROUND(exchange_rate * {RATE_SCALE}) AS INTEGER),
+           CAST(ROUND(balance_from * {exponent_case_sql('from_currency')}) AS INTEGER),
+           CAST(ROUND(balance_to * {exponent_case_sql('to_currency')}) AS INTEGER),
+           is_active, created_at
+    FROM trips
+"""
+
+_INSERT_EXPENSES_V3 = f"""
+    INSERT INTO expenses_v3 (id, trip_id, amount_to_minor, amount_from_minor,
+                             description, created_at)
+    SELECT e.id, e.trip_id,
+           CAST(ROUND(e.amount_to * {exponent_case_sql('t.to_currency')}) AS INTEGER),
+           CAST(ROUND(e.amount_from * {exponent_case_sql('t.from_currency')}) AS INTEGER),
+           e.description, e.created_at
+    FROM expenses e
+    LEFT JOIN trips t ON t.id = e.trip_id
+"""
+
+_COPY_TRIPS_V3 = _INSERT_TRIPS_V3 + """
+    WHERE id > (SELECT COALESCE(MAX(id), 0) FROM trips_v3)
+    ORDER BY id
+"""
+
+_COPY_EXPENSES_V3 = _INSERT_EXPENSES_V3 + """
+    WHERE e.id > (SELECT COALESCE(MAX(id), 0) FROM expenses_v3)
+    ORDER BY e.id
+"""
+
+# Изменения строк, уже скопированных пакетами: триггеры записывают id
+# изменённых и удалённых строк, и при замене таблиц эти строки копируются
+# заново (удалённые — просто удаляются из копии)
+_V3_CHANGES = "migration_v3_changes"
+
+
+def _v3_change_triggers(table: str) -> List[str]:
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS migration_v3_{table}_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                INSERT OR IGNORE INTO {_V3_CHANGES} (tbl, id) VALUES ('{table}', OLD.id);
+            END"""
+        for event in ("UPDATE", "DELETE")
+    ]
+
+
+def _v3_recopy(table: str, insert_sql: str, id_column: str) -> List[str]:
+    changed = f"SELECT id FROM {_V3_CHANGES} WHERE tbl = '{table}'"
+    return [
+        f"DELETE FROM {table}_v3 WHERE id IN ({changed})",
+        insert_sql + f"WHERE {id_column} IN ({changed})",
+    ]
+
+
+# Сводка расходов (миграция 5): ключ строки — день и категория расхода.
+# Категория — описание без пробелов по краям ('' — без описания); те же
+# выражения использует Database при учёте каждого расхода
+ROLLUP_DAY = "date(created_at)"
+ROLLUP_CATEGORY = "COALESCE(TRIM(description), '')"
+
+ROLLUP_EXPENSES = f"""
+    INSERT INTO expense_rollups (trip_id, day, category, amount_to_minor,
+                                 amount_from_minor, expense_count)
+    SELECT trip_id, {ROLLUP_DAY}, {ROLLUP_CATEGORY},
+           SUM(amount_to_minor), SUM(amount_from_minor), COUNT(*)
+    FROM expenses
+"""
+
+# Заполнение сводки по путешествиям в порядке id; путешествия, для которых
+# сводка уже есть, пропускаются
+_BACKFILL_ROLLUPS = ROLLUP_EXPENSES + """
+    WHERE trip_id IN (
+        SELECT DISTINCT trip_id FROM expenses
+        WHERE trip_id > (SELECT COALESCE(MAX(trip_id), 0) FROM expense_rollups)
+        ORDER BY trip_id
+        LIMIT ?
+    )
+    GROUP BY 1, 2, 3
+"""
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "Базовая схема: пользователи, путешествия, расходы", [
+        """CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        """CREATE TABLE IF NOT EXISTS trips (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            from_country TEXT NOT NULL,
+            to_country TEXT NOT NULL,
+            from_currency TEXT NOT NULL,
+            to_currency TEXT NOT NULL,
+            exchange_rate REAL NOT NULL,
+            balance_from REAL NOT NULL DEFAULT 0,
+            balance_to REAL NOT NULL DEFAULT 0,
+            is_active INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS expenses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            trip_id INTEGER NOT NULL,
+            amount_to REAL NOT NULL,
+            amount_from REAL NOT NULL,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (trip_id) REFERENCES trips(id)
+        )""",
+    ]),
+    Migration(2, "Индексы частых запросов", [
+        # Оставляем активным только последнее путешествие пользователя,
+        # иначе уникальный индекс не создастся
+        """UPDATE trips SET is_active = 0
+           WHERE is_active = 1 AND id NOT IN (
+               SELECT MAX(id) FROM trips WHERE is_active = 1 GROUP BY user_id
+           )""",
+        # Не более одного активного путешествия на пользователя;
+        # обслуживает get_active_trip
+        """CREATE UNIQUE INDEX IF NOT EXISTS idx_trips_active_user
+           ON trips(user_id) WHERE is_active = 1""",
+        # get_user_trips: фильтр по пользователю с сортировкой по дате
+        """CREATE INDEX IF NOT EXISTS idx_trips_user_created
+           ON trips(user_id, created_at)""",
+        # get_expenses: фильтр по путешествию с сортировкой по дате
+        """CREATE INDEX IF NOT EXISTS idx_expenses_trip_created
+           ON expenses(trip_id, created_at)""",
+    ]),
+    Migration(3, "Суммы в минимальных единицах валюты, курс — целое число", [
+        """CREATE TABLE IF NOT EXISTS trips_v3 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            from_country TEXT NOT NULL,
+            to_country TEXT NOT NULL,
+            from_currency TEXT NOT NULL,
+            to_currency TEXT NOT NULL,
+            exchange_rate_scaled INTEGER NOT NULL,
+            balance_from_minor INTEGER NOT NULL DEFAULT 0,
+            balance_to_minor INTEGER NOT NULL DEFAULT 0,
+            is_active INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS expenses_v3 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            trip_id INTEGER NOT NULL,
+            amount_to_minor INTEGER NOT NULL,
+            amount_from_minor INTEGER NOT NULL,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (trip_id) REFERENCES trips(id)
+        )""",
+        f"""CREATE TABLE IF NOT EXISTS {_V3_CHANGES} (
+            tbl TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            PRIMARY KEY (tbl, id)
+        ) WITHOUT ROWID""",
+        *_v3_change_triggers("trips"),
+        *_v3_change_triggers("expenses"),
+        Backfill(_COPY_TRIPS_V3 + "LIMIT ?"),
+        Backfill(_COPY_EXPENSES_V3 + "LIMIT ?"),
+        # Строки, добавленные и изменённые во время пакетного копирования,
+        # и замена таблиц — в одной транзакции
+        _COPY_TRIPS_V3,
+        _COPY_EXPENSES_V3,
+        *_v3_recopy("trips", _INSERT_TRIPS_V3, "id"),
+        *_v3_recopy("expenses", _INSERT_EXPENSES_V3, "e.id"),
+        f"DROP TABLE {_V3_CHANGES}",
+        # Триггеры удаляются вместе с таблицами
+        "DROP TABLE expenses",
+        "DROP TABLE trips",
+        "ALTER TABLE trips_v3 RENAME TO trips",
+        "ALTER TABLE expenses_v3 RENAME TO expenses",
+        """CREATE UNIQUE INDEX IF NOT EXISTS idx_trips_active_user
+           ON trips(user_id) WHERE is_active = 1""",
+        """CREATE INDEX IF NOT EXISTS idx_trips_user_created
+           ON trips(user_id, created_at)""",
+        """CREATE INDEX IF NOT EXISTS idx_expenses_trip_created
+           ON expenses(trip_id, created_at)""",
+    ]),
+    Migration(4, "Состояния пользователей (FSM)", [
+        # data — JSON; expires_at — момент истечения (Unix time)
+        """CREATE TABLE IF NOT EXISTS user_states (
+            user_id INTEGER PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            expires_at REAL NOT NULL
+        )""",
+        # Удаление истёкших состояний
+        """CREATE INDEX IF NOT EXISTS idx_user_states_expires
+           ON user_states(expires_at)""",
+    ]),
+    Migration(5, "Сводка расходов по дням и категориям", [
+        # Суммы — в минимальных единицах валют путешествия
+        """CREATE TABLE IF NOT EXISTS expense_rollups (
+            trip_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            category TEXT NOT NULL,
+            amount_to_minor INTEGER NOT NULL DEFAULT 0,
+            amount_from_minor INTEGER NOT NULL DEFAULT 0,
+            expense_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (trip_id, day, category)
+        ) WITHOUT ROWID""",
+        Backfill(_BACKFILL_ROLLUPS, batch_size=100),
+    ]),
+    Migration(6, "Хэш импортированных расходов", [
+        # Хэш строки файла выписки (importer.py); у расходов, введённых в чате, — NULL
+        "ALTER TABLE expenses ADD COLUMN import_hash TEXT",
+        # Повторный импорт той же строки в путешествие пропускается
+        """CREATE UNIQUE INDEX IF NOT EXISTS idx_expenses_trip_import
+           ON expenses(trip_id, import_hash) WHERE import_hash IS NOT NULL""",
+    ]),
+]
+
+
+def get_version(conn: sqlite3.Connection) -> int:
+    """Текущая версия схемы"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def pending_migrations(conn: sqlite3.Connection,
+                       migrations: Sequence[Migration] = MIGRATIONS) -> List[Migration]:
+    """Миграции, которые ещё не применены, по возрастанию версии"""
+    current = get_version(conn)
+    return sorted((m for m in migrations if m.version > current), key=lambda m: m.version)
+
+
+class _AlreadyApplied(Exception):
+    """Миграцию применил другой процесс"""
+
+
+def _begin(conn: sqlite3.Connection, version: int):
+    """
+    BEGIN IMMEDIATE с повторной проверкой версии под блокировкой записи
+
+    Raises:
+        _AlreadyApplied: Версия схемы уже не ниже version
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    if get_version(conn) >= version:
+        conn.execute("ROLLBACK")
+        raise _AlreadyApplied()
+
+
+def _execute_in_transaction(conn: sqlite3.Connection, statements: Sequence[str], version: int):
+    _begin(conn, version)
+    try:
+        for statement in statements:
+            conn.execute(statement)
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def _run_backfill(conn: sqlite3.Connection, backfill: Backfill, version: int) -> int:
+    """Пакетное выполнение Backfill; возвращает число затронутых строк"""
+    total = 0
+    while True:
+        _begin(conn, version)
+        try:
+            changed = conn.execute(backfill.sql, (backfill.batch_size,)).rowcount
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        if changed <= 0:
+            return total
+        total += changed
+
+
+def _apply(conn: sqlite3.Connection, migration: Migration) -> bool:
+    """
+    Применение миграции
+
+    Каждая транзакция миграции начинается с проверки версии под
+    блокировкой записи, поэтому при одновременном запуске нескольких
+    процессов миграцию выполняет только один из них.
+
+    Returns:
+        False, если миграцию уже применил другой процесс
+    """
+    version = int(migration.version)
+    pending: List[str] = []
+    try:
+        for step in migration.steps:
+            if isinstance(step, Backfill):
+                if pending:
+                    _execute_in_transaction(conn, pending, version)
+                    pending = []
+                _run_backfill(conn, step, version)
+            else:
+                pending.append(step)
+        pending.append(f"PRAGMA user_version = {version}")
+        _execute_in_transaction(conn, pending, version)
+    except _AlreadyApplied:
+        return False
+    return True
+
+
+def describe(migration: Migration) -> List[str]:
+    """Текстовый план миграции (DDL и пакетные обновления)"""
+    lines = [f"-- v{migration.version}: {migration.description}"]
+    for step in migration.steps:
+        if isinstance(step, Backfill):
+            lines.append(f"-- пакетами по {step.batch_size} строк, пока есть изменения:")
+            lines.append(step.sql.strip() + ";")
+        else:
+            lines.append(step.strip() + ";")
+    lines.append(f"PRAGMA user_version = {migration.version};")
+    return lines
+
+
+def migrate(conn: sqlite3.Connection, migrations: Sequence[Migration] = MIGRATIONS,
+            dry_run: bool = False, output: Callable[[str], None] = print) -> int:
+    """
+    Применение всех непримененных миграций
+
+    Args:
+        conn: Соединение в режиме автокоммита (isolation_level=None)
+        migrations: Список миграций
+        dry_run: Только вывести план, ничего не меняя
+        output: Функция вывода плана при dry_run
+
+    Returns:
+        Версия схемы после применения (при dry_run — версия, которая была бы)
+    """
+    version = get_version(conn)
+    for migration in pending_migrations(conn, migrations):
+        if dry_run:
+            for line in describe(migration):
+                output(line)
+        else:
+            # Миграцию мог уже применить другой процесс: _apply проверяет
+            # версию в каждой своей транзакции
+            _apply(conn, migration)
+        version = migration.version
+    return version
+
+
+def main():
+    from database import DB_PATH
+
+    parser = argparse.ArgumentParser(description="Применение миграций схемы базы данных")
+    parser.add_argument("--db", default=DB_PATH, help="Путь к файлу базы данных")
+    parser.add_argument("--dry-run", action="store_true", help="Показать план без изменений")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    try:
+        before = get_version(conn)
+        after = migrate(conn, dry_run=args.dry_run)
+    finally:
+        conn.close()
+
+    if before == after:
+        print(f"Схема актуальна (версия {after})")
+    elif args.dry_run:
+        print(f"-- Будет выполнено обновление схемы: {before} → {after}")
+    else:
+        print(f"Схема обновлена: {before} → {after}")
+
+
+if __name__ == "__main__":
+    main()
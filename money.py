@@ -0,0 +1,137 @@
+"""
+Точная денежная арифметика
+
+Суммы хранятся в базе целыми числами в минимальных единицах валюты
+(копейки, центы; для JPY — иены, для KWD — тысячные доли динара;
+число знаков после запятой — из справочника currencies),
+курсы — целыми числами, умноженными на RATE_SCALE. В коде суммы и курсы
+представлены Decimal.
+"""
+import re
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import List, Optional, Tuple, Union
+
+from currencies import DEFAULT_EXPONENT, get_exponent, load_currencies
+
+Number = Union[Decimal, int, float, str]
+
+# Курс хранится с точностью до 9 знаков после запятой
+RATE_DECIMALS = 9
+RATE_SCALE = 10 ** RATE_DECIMALS
+_RATE_QUANTUM = Decimal(1).scaleb(-RATE_DECIMALS)
+
+_AMOUNT_RE = re.compile(r"^[+-]?\d+(?:[.,]\d+)?$")
+
+# Строка списка расходов: сумма (с пробелами между разрядами и запятой),
+# затем необязательное описание. Строка другого вида попадает в группу bad,
+# поэтому весь текст разбирается одним проходом finditer
+_EXPENSE_LINE_RE = re.compile(
+    r"^[ \t]*(?:"
+    r"(?P<amount>\d{1,3}(?:[ \u00a0]\d{3})+(?:[.,]\d+)?|\d+(?:[.,]\d+)?)"
+    r"(?:[ \t]+(?P<description>[^\n]*?))?"
+    r"|(?P<bad>[^\n]*?))[ \t\r]*$",
+    re.MULTILINE,
+)
+
+# Наибольшее число расходов в одном сообщении
+MAX_BULK_EXPENSES = 50
+
+
+def to_decimal(value: Number) -> Decimal:
+    """Преобразование числа в Decimal (float — через строку, без двоичного хвоста)"""
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, float):
+        return Decimal(repr(value))
+    return Decimal(value)
+
+
+def quantize(amount: Number, currency: str) -> Decimal:
+    """Округление суммы до минимальной единицы валюты"""
+    return to_decimal(amount).quantize(Decimal(1).scaleb(-get_exponent(currency)),
+                                       rounding=ROUND_HALF_UP)
+
+
+def to_minor(amount: Number, currency: str) -> int:
+    """Сумма в минимальных единицах валюты (для хранения)"""
+    return int(quantize(amount, currency).scaleb(get_exponent(currency)))
+
+
+def from_minor(minor: int, currency: str) -> Decimal:
+    """Сумма из минимальных единиц валюты"""
+    return Decimal(minor).scaleb(-get_exponent(currency))
+
+
+def normalize_rate(rate: Number) -> Decimal:
+    """Курс, округлённый до точности хранения"""
+    return to_decimal(rate).quantize(_RATE_QUANTUM, rounding=ROUND_HALF_UP)
+
+
+def rate_to_scaled(rate: Number) -> int:
+    """Курс в виде целого числа (для хранения)"""
+    return int(normalize_rate(rate).scaleb(RATE_DECIMALS))
+
+
+def rate_from_scaled(scaled: int) -> Decimal:
+    """Курс из целочисленного представления"""
+    return Decimal(scaled).scaleb(-RATE_DECIMALS)
+
+
+def parse_amount(text: str) -> Optional[Decimal]:
+    """
+    Разбор суммы, введённой пользователем
+
+    Допускаются запятая как десятичный разделитель и пробелы между
+    разрядами ("1 000,50").
+
+    Returns:
+        Decimal или None, если текст не является числом
+    """
+    text = text.strip().replace(" ", "").replace("\u00a0", "")
+    if not _AMOUNT_RE.match(text):
+        return None
+    try:
+        return Decimal(text.replace(",", "."))
+    except InvalidOperation:
+        return None
+
+
+def parse_expense_lines(text: str) -> Optional[List[Tuple[Decimal, str]]]:
+    """
+    Разбор списка расходов, по одному в строке: "350 такси\n1200 ужин\n89,5 кофе"
+
+    Пустые строки пропускаются.
+
+    Returns:
+        [(сумма, описание), ...] или None, если хотя бы одна строка не
+        является расходом, сумма не положительна или строк больше MAX_BULK_EXPENSES
+    """
+    expenses = []
+    for match in _EXPENSE_LINE_RE.finditer(text):
+        amount_text = match.group("amount")
+        if amount_text is None:
+            if match.group("bad"):
+                return None
+            continue
+        amount = Decimal(amount_text.replace(" ", "").replace("\u00a0", "").replace(",", "."))
+        if amount <= 0 or len(expenses) == MAX_BULK_EXPENSES:
+            return None
+        expenses.append((amount, match.group("description") or ""))
+    return expenses or None
+
+
+def exponent_case_sql(column: str) -> str:
+    """
+    SQL-выражение множителя минимальных единиц для валюты в column
+
+    Используется в миграциях для пересчёта сумм на стороне SQLite.
+    """
+    groups = {}
+    for currency in load_currencies().values():
+        if currency.exponent != DEFAULT_EXPONENT:
+            groups.setdefault(currency.exponent, []).append(f"'{currency.code}'")
+    branches = " ".join(
+        f"WHEN {column} IN ({', '.join(sorted(codes))}) THEN {10 ** exponent}"
+        for exponent, codes in sorted(groups.items())
+    )
+    return f"(CASE {branches} ELSE {10 ** DEFAULT_EXPONENT} END)"
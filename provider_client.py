@@ -0,0 +1,278 @@
+"""
+Клиент API exchangerate.host
+
+Один постоянный requests.Session с пулом keep-alive соединений, ограниченное
+число повторов с экспоненциальной задержкой и джиттером при ответах 5xx/429
+и сетевых ошибках, общий дедлайн на вызов (включая все повторы).
+
+AsyncRateProviderClient — то же поведение поверх aiohttp для асинхронной
+версии бота (async_bot.py).
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+from metrics import RATE_HTTP_SECONDS
+
+load_dotenv()
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """Время на вызов (с учётом повторов) истекло"""
+
+
+def backoff_delay(attempt: int, retry_after: Optional[str],
+                  backoff_base: float, backoff_max: float) -> float:
+    """Задержка перед повтором: Retry-After или экспонента с полным джиттером"""
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return random.uniform(0, min(backoff_max, backoff_base * 2 ** attempt))
+
+
+class RateProviderClient:
+    def __init__(self, api_key: Optional[str], base_url: str = "https://api.exchangerate.host",
+                 timeout: float = 5.0, deadline: float = 10.0, max_retries: int = 3,
+                 backoff_base: float = 0.2, backoff_max: float = 2.0, pool_size: int = 10):
+        """
+        Args:
+            api_key: Ключ доступа exchangerate.host
+            base_url: Адрес API
+            timeout: Таймаут одной попытки (сек)
+            deadline: Общее время на вызов с учётом повторов (сек)
+            max_retries: Максимальное число повторов после первой попытки
+            backoff_base: Базовая задержка перед повтором (сек)
+            backoff_max: Максимальная задержка перед повтором (сек)
+            pool_size: Размер пула соединений
+        """
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _backoff(self, attempt: int, response: Optional[requests.Response]) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        return backoff_delay(attempt, retry_after, self.backoff_base, self.backoff_max)
+
+    def request(self, endpoint: str, params: Optional[Dict] = None,
+                deadline: Optional[float] = None) -> Dict:
+        """
+        GET-запрос к API с повторами
+
+        Args:
+            endpoint: Путь эндпоинта (например, "live")
+            params: Параметры запроса (ключ доступа добавляется автоматически)
+            deadline: Общее время на вызов (сек); по умолчанию self.deadline
+
+        Returns:
+            Разобранный JSON-ответ
+
+        Raises:
+            requests.exceptions.RequestException: при сетевой ошибке, ответе
+                с ошибкой после всех повторов или истечении дедлайна
+        """
+        with RATE_HTTP_SECONDS.labels(endpoint).time():
+            return self._request(endpoint, params, deadline)
+
+    def _request(self, endpoint: str, params: Optional[Dict], deadline: Optional[float]) -> Dict:
+        url = f"{self.base_url}/{endpoint}"
+        params = {"access_key": self.api_key, **(params or {})}
+        expires_at = time.monotonic() + (deadline if deadline is not None else self.deadline)
+        attempt = 0
+
+        while True:
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"Deadline exceeded for {url}")
+
+            response = None
+            try:
+                response = self.session.get(url, params=params, timeout=min(self.timeout, remaining))
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response.json()
+                error: requests.exceptions.RequestException = requests.exceptions.HTTPError(
+                    f"{response.status_code} Error for url: {url}", response=response
+                )
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+
+            if attempt >= self.max_retries:
+                raise error
+            delay = self._backoff(attempt, response)
+            if delay >= expires_at - time.monotonic():
+                raise error
+            time.sleep(delay)
+            attempt += 1
+
+    def live(self, source: str, currencies: list, deadline: Optional[float] = None) -> Dict:
+        """Котировки валют currencies относительно source (эндпоинт /live)"""
+        return self.request("live", {
+            "source": source,
+            "currencies": ",".join(currencies)
+        }, deadline=deadline)
+
+    def list_currencies(self, deadline: Optional[float] = None) -> Dict:
+        """Список поддерживаемых валют (эндпоинт /list)"""
+        return self.request("list", deadline=deadline)
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncRateProviderClient:
+    """
+    Асинхронный клиент с теми же повторами и дедлайном, что у RateProviderClient
+
+    Сессия aiohttp создаётся при первом запросе внутри работающего цикла
+    событий; aiohttp импортируется только здесь, синхронному боту он не нужен.
+    """
+
+    def __init__(self, api_key: Optional[str], base_url: str = "https://api.exchangerate.host",
+                 timeout: float = 5.0, deadline: float = 10.0, max_retries: int = 3,
+                 backoff_base: float = 0.2, backoff_max: float = 2.0, pool_size: int = 100):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool_size = pool_size
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            import aiohttp
+
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size)
+            )
+        return self._session
+
+    async def request(self, endpoint: str, params: Optional[Dict] = None,
+                      deadline: Optional[float] = None) -> Dict:
+        """
+        GET-запрос к API с повторами
+
+        Raises:
+            aiohttp.ClientError, asyncio.TimeoutError: при сетевой ошибке
+                или ответе с ошибкой после всех повторов
+            DeadlineExceeded: при истечении дедлайна
+        """
+        with RATE_HTTP_SECONDS.labels(endpoint).time():
+            return await self._request(endpoint, params, deadline)
+
+    async def _request(self, endpoint: str, params: Optional[Dict],
+                       deadline: Optional[float]) -> Dict:
+        import aiohttp
+
+        session = self._get_session()
+        url = f"{self.base_url}/{endpoint}"
+        # aiohttp не принимает None в параметрах (requests такие параметры пропускает)
+        params = {key: value for key, value in {"access_key": self.api_key, **(params or {})}.items()
+                  if value is not None}
+        expires_at = time.monotonic() + (deadline if deadline is not None else self.deadline)
+        attempt = 0
+
+        while True:
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"Deadline exceeded for {url}")
+
+            retry_after = None
+            try:
+                timeout = aiohttp.ClientTimeout(total=min(self.timeout, remaining))
+                async with session.get(url, params=params, timeout=timeout) as response:
+                    if response.status not in RETRY_STATUSES:
+                        response.raise_for_status()
+                        return await response.json(content_type=None)
+                    retry_after = response.headers.get("Retry-After")
+                    error: Exception = aiohttp.ClientResponseError(
+                        response.request_info, response.history,
+                        status=response.status, message=f"{response.status} Error for url: {url}"
+                    )
+            except aiohttp.ClientResponseError:
+                raise
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = e
+
+            if attempt >= self.max_retries:
+                raise error
+            delay = backoff_delay(attempt, retry_after, self.backoff_base, self.backoff_max)
+            if delay >= expires_at - time.monotonic():
+                raise error
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def live(self, source: str, currencies: list, deadline: Optional[float] = None) -> Dict:
+        """Котировки валют currencies относительно source (эндпоинт /live)"""
+        return await self.request("live", {
+            "source": source,
+            "currencies": ",".join(currencies)
+        }, deadline=deadline)
+
+    async def list_currencies(self, deadline: Optional[float] = None) -> Dict:
+        """Список поддерживаемых валют (эндпоинт /list)"""
+        return await self.request("list", deadline=deadline)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def _client_settings() -> Dict:
+    """Параметры клиента из переменных окружения"""
+    return {
+        "api_key": os.getenv("CURRENCY_API_KEY"),
+        "base_url": os.getenv("CURRENCY_API_URL", "https://api.exchangerate.host"),
+        "timeout": float(os.getenv("RATE_API_TIMEOUT", "5")),
+        "deadline": float(os.getenv("RATE_API_DEADLINE", "10")),
+        "max_retries": int(os.getenv("RATE_API_RETRIES", "3")),
+    }
+
+
+_client: Optional[RateProviderClient] = None
+_client_lock = threading.Lock()
+_async_client: Optional[AsyncRateProviderClient] = None
+
+
+def get_client() -> RateProviderClient:
+    """Общий для процесса клиент, настроенный через переменные окружения"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = RateProviderClient(
+                    pool_size=int(os.getenv("RATE_API_POOL_SIZE", "10")),
+                    **_client_settings()
+                )
+    return _client
+
+
+def get_async_client() -> AsyncRateProviderClient:
+    """Общий асинхронный клиент (используется из одного цикла событий)"""
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncRateProviderClient(
+            pool_size=int(os.getenv("RATE_API_ASYNC_POOL_SIZE", "100")),
+            **_client_settings()
+        )
+    return _async_client
@@ -0,0 +1,232 @@
+"""
+Кэш курсов обмена в памяти процесса
+
+Ключ кэша — пара валют (source, target). Записи живут TTL секунд,
+размер кэша ограничен (вытеснение по LRU). Просроченные записи отдаются
+сразу (stale-while-revalidate), а обновление выполняется в фоне
+небольшим общим пулом потоков — не более одного обновления на ключ
+одновременно.
+
+Пока ключ загружается, остальные запросы этого ключа ждут результат
+загрузки (в том числе ошибку), а не обращаются к провайдеру сами.
+
+Асинхронный код (async_bot.py) использует async_get_or_load с теми же
+правилами: устаревшая запись отдаётся сразу, а обновляется задачей
+в цикле событий.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Set, Tuple
+
+
+class _Load:
+    """Загрузка ключа, которую ждут остальные запросы: результат или ошибка"""
+
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Optional[Dict] = None
+        self.error: Optional[BaseException] = None
+
+
+class RateCache:
+    def __init__(self, ttl: float = 300.0, max_size: int = 1024, refresh_workers: int = 2):
+        self.ttl = ttl
+        self.max_size = max_size
+        # key -> (значение, время сохранения)
+        self._entries: "OrderedDict[Hashable, Tuple[Dict, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Ключи, для которых уже идёт загрузка (фоновая или синхронная)
+        self._loading: Dict[Hashable, _Load] = {}
+        # Фоновые обновления устаревших записей
+        self._refresh_executor = ThreadPoolExecutor(max_workers=refresh_workers,
+                                                    thread_name_prefix="rate-refresh")
+        # То же для асинхронного кода (один цикл событий): загрузки ключей
+        # и фоновые задачи обновления (ссылки держатся до их завершения)
+        self._async_loading: Dict[Hashable, asyncio.Future] = {}
+        self._refresh_tasks: Set[asyncio.Task] = set()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Optional[Dict]]) -> Optional[Dict]:
+        """
+        Получение значения из кэша или загрузка через loader
+
+        Args:
+            key: Ключ кэша
+            loader: Функция загрузки значения; результат кэшируется,
+                только если он успешный (``success`` истинно)
+
+        Returns:
+            Значение из кэша или результат loader
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                self._entries.move_to_end(key)
+                if now - stored_at < self.ttl:
+                    self.hits += 1
+                    return value
+                # Запись устарела: отдаём её и обновляем в фоне
+                self.stale += 1
+                if key not in self._loading:
+                    self._loading[key] = _Load()
+                    self._refresh_executor.submit(self._refresh, key, loader)
+                return value
+
+            self.misses += 1
+            pending = self._loading.get(key)
+            if pending is None:
+                pending = self._loading[key] = _Load()
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            # Кто-то уже загружает этот ключ — ждём его результат. При ошибке
+            # загрузки она передаётся всем ожидающим: провайдер, который и так
+            # не отвечает, не получает повторный запрос от каждого из них
+            pending.done.wait()
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None:
+                return entry[0]
+            if pending.error is not None:
+                raise pending.error
+            return pending.value
+
+        try:
+            pending.value = loader()
+            self._store(key, pending.value)
+            return pending.value
+        except BaseException as e:
+            pending.error = e
+            raise
+        finally:
+            self._finish_loading(key)
+
+    async def async_get_or_load(self, key: Hashable,
+                                loader: Callable[[], Awaitable[Optional[Dict]]]) -> Optional[Dict]:
+        """
+        Асинхронная версия get_or_load (вызывается из одного цикла событий)
+
+        Устаревшая запись отдаётся сразу, обновление выполняется фоновой
+        задачей; при промахе одновременные запросы ключа ждут одну загрузку.
+
+        Args:
+            key: Ключ кэша
+            loader: Корутина-функция загрузки значения
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                self._entries.move_to_end(key)
+                if now - stored_at < self.ttl:
+                    self.hits += 1
+                    return value
+                self.stale += 1
+            else:
+                self.misses += 1
+
+        pending = self._async_loading.get(key)
+        if pending is not None:
+            return entry[0] if entry is not None else await asyncio.shield(pending)
+
+        # Загрузка регистрируется до первого await: следующий запрос ключа
+        # уже увидит её и не начнёт вторую
+        pending = self._async_loading[key] = asyncio.get_running_loop().create_future()
+        if entry is None:
+            return await self._async_load(key, loader, pending)
+        task = asyncio.ensure_future(self._async_load(key, loader, pending))
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_task_done)
+        return entry[0]
+
+    async def _async_load(self, key: Hashable, loader: Callable[[], Awaitable[Optional[Dict]]],
+                          pending: asyncio.Future) -> Optional[Dict]:
+        """Загрузка ключа; остальные запросы ключа ждут её результат (pending)"""
+        try:
+            value = await loader()
+            self._store(key, value)
+            pending.set_result(value)
+            return value
+        except BaseException as e:
+            pending.set_exception(e)
+            # Ожидающих может не быть (фоновое обновление): без предупреждения
+            # "exception was never retrieved"
+            pending.exception()
+            raise
+        finally:
+            del self._async_loading[key]
+
+    def _refresh_task_done(self, task: asyncio.Task):
+        self._refresh_tasks.discard(task)
+        if not task.cancelled():
+            # Ошибка фонового обновления не выводится: остаётся старое значение
+            task.exception()
+
+    def put(self, key: Hashable, value: Optional[Dict]):
+        """Сохранение значения, загруженного вне get_or_load"""
+        self._store(key, value)
+
+    def _refresh(self, key: Hashable, loader: Callable[[], Optional[Dict]]):
+        """Фоновое обновление устаревшей записи"""
+        try:
+            self._store(key, loader())
+        except Exception:
+            # Ошибка обновления не должна ронять поток: остаётся старое значение
+            pass
+        finally:
+            self._finish_loading(key)
+
+    def _store(self, key: Hashable, value: Optional[Dict]):
+        """Сохранение успешного значения с вытеснением по LRU"""
+        # Котировка по устаревшим данным (stale) не должна выглядеть свежей
+        if not value or not value.get("success") or value.get("stale"):
+            return
+        stored_at = time.monotonic()
+        # Возраст записи считается от получения данных: котировка по матрице,
+        # загруженной несколько минут назад, не должна жить в кэше полный TTL
+        timestamp = value.get("timestamp")
+        if timestamp is not None:
+            stored_at -= max(0.0, time.time() - timestamp)
+        with self._lock:
+            self._entries[key] = (value, stored_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _finish_loading(self, key: Hashable):
+        with self._lock:
+            load = self._loading.pop(key, None)
+        if load is not None:
+            load.done.set()
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        """Удаление одной записи или очистка всего кэша"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self) -> Dict:
+        """Счётчики попаданий, промахов и устаревших ответов"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+            }
@@ -0,0 +1,171 @@
+"""
+Матрица курсов относительно одной базовой валюты
+
+Валюты всех стран справочника country_resolver запрашиваются одним вызовом /live
+относительно базовой валюты и хранятся компактным вектором. Любой кросс-курс
+A→B вычисляется делением без дополнительных сетевых запросов.
+"""
+import math
+import threading
+import time
+from array import array
+from typing import Callable, Dict, Iterable, List, Optional
+
+from country_resolver import all_currencies
+
+# fetch_quotes(base, codes) -> {code: сколько code за 1 base}
+QuotesFetcher = Callable[[str, list], Dict[str, float]]
+
+
+def matrix_codes(base: str = "USD", currencies: Optional[Iterable[str]] = None) -> List[str]:
+    """Упорядоченный список валют матрицы (одинаковый во всех процессах)"""
+    codes = set(currencies if currencies is not None else all_currencies())
+    codes.add(base)
+    return sorted(codes)
+
+
+class RateMatrix:
+    def __init__(self, fetch_quotes: QuotesFetcher, base: str = "USD",
+                 currencies: Optional[Iterable[str]] = None, ttl: float = 300.0,
+                 retry_after: float = 30.0):
+        """
+        Args:
+            ttl: Сколько секунд котировки считаются актуальными
+            retry_after: Пауза после неудачного обновления (сек): пока она
+                не истекла, ensure_fresh не обращается к провайдеру повторно
+        """
+        self.base = base
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self._fetch_quotes = fetch_quotes
+        self.codes = matrix_codes(base, currencies)
+        self._index = {code: i for i, code in enumerate(self.codes)}
+        # rates[i] — сколько codes[i] за 1 base; NaN, если котировки нет
+        self._rates = array("d", [math.nan] * len(self.codes))
+        self._rates[self._index[base]] = 1.0
+        self._loaded_at: Optional[float] = None
+        # Время последнего неудачного обновления (time.monotonic)
+        self._failed_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def __contains__(self, currency: str) -> bool:
+        i = self._index.get(currency)
+        return i is not None and not math.isnan(self._read_rates()[i])
+
+    def covers(self, currency: str) -> bool:
+        """Входит ли валюта в набор, запрашиваемый матрицей"""
+        return currency in self._index
+
+    @property
+    def loaded_at(self) -> Optional[float]:
+        return self._loaded_at
+
+    def loaded_at_wall(self) -> Optional[float]:
+        """Время загрузки котировок по системным часам (Unix time); None — не загружались"""
+        loaded_at = self.loaded_at
+        if loaded_at is None:
+            return None
+        return time.time() - (time.monotonic() - loaded_at)
+
+    def is_fresh(self) -> bool:
+        loaded_at = self.loaded_at
+        return loaded_at is not None and time.monotonic() - loaded_at < self.ttl
+
+    def recently_failed(self) -> bool:
+        """Не истекла ли пауза после неудачного обновления"""
+        failed_at = self._failed_at
+        return failed_at is not None and time.monotonic() - failed_at < self.retry_after
+
+    def mark_failed(self):
+        """Учёт неудачного обновления (например, асинхронным клиентом)"""
+        self._failed_at = time.monotonic()
+
+    def _read_rates(self) -> array:
+        return self._rates
+
+    def _write_rates(self, rates: array, loaded_at: float):
+        # Замена вектора целиком — читатели видят либо старые, либо новые курсы
+        self._rates = rates
+        self._loaded_at = loaded_at
+
+    def refresh(self) -> bool:
+        """
+        Загрузка всех котировок одним запросом
+
+        Returns:
+            True, если котировки обновлены; при ошибке остаются прежние значения
+        """
+        try:
+            quotes = self._fetch_quotes(self.base, self.quote_codes())
+        except Exception:
+            quotes = None
+        if not self.load_quotes(quotes):
+            self.mark_failed()
+            return False
+        return True
+
+    def quote_codes(self) -> list:
+        """Валюты, котировки которых запрашиваются относительно базовой"""
+        return [c for c in self.codes if c != self.base]
+
+    def load_quotes(self, quotes: Optional[Dict[str, float]]) -> bool:
+        """
+        Замена котировок полученными извне (например, асинхронным клиентом)
+
+        Returns:
+            True, если котировки обновлены; пустой ответ ничего не меняет
+        """
+        if not quotes:
+            return False
+
+        rates = array("d", [math.nan] * len(self.codes))
+        rates[self._index[self.base]] = 1.0
+        for code, rate in quotes.items():
+            i = self._index.get(code)
+            if i is not None and rate and rate > 0:
+                rates[i] = float(rate)
+        self._write_rates(rates, time.monotonic())
+        self._failed_at = None
+        return True
+
+    def ensure_fresh(self) -> bool:
+        """
+        Обновление котировок, если они устарели (один запрос на все потоки)
+
+        Пока не истекла пауза retry_after после неудачного обновления,
+        провайдер не запрашивается: иначе при его недоступности потоки
+        ждали бы друг друга под блокировкой, и каждый — полный таймаут запроса.
+
+        Returns:
+            True, если котировки актуальны; False, если обновить их не удалось —
+            прежние значения остаются доступны, но считать по ним без пометки нельзя
+        """
+        if self.is_fresh():
+            return True
+        if self.recently_failed():
+            return False
+        with self._lock:
+            if self.is_fresh():
+                return True
+            if self.recently_failed():
+                return False
+            self.refresh()
+        return self.is_fresh()
+
+    def cross_rate(self, source_currency: str, target_currency: str) -> Optional[float]:
+        """
+        Кросс-курс: сколько target_currency за 1 source_currency
+
+        Returns:
+            Курс или None, если одной из валют нет в матрице
+        """
+        rates = self._read_rates()
+        i = self._index.get(source_currency)
+        j = self._index.get(target_currency)
+        if i is None or j is None:
+            return None
+        source_rate = rates[i]
+        target_rate = rates[j]
+        if math.isnan(source_rate) or math.isnan(target_rate):
+            return None
+        return target_rate / source_rate
@@ -0,0 +1,81 @@
+"""
+Матрица курсов в общей памяти процессов
+
+Используется supervisor.py: вектор котировок лежит в multiprocessing.RawArray,
+который создаётся до запуска рабочих процессов. Котировки обновляет
+supervisor (один запрос к API на все процессы), рабочие процессы только
+читают их; если вектор устарел, любой процесс может обновить его сам —
+под общей блокировкой, поэтому запрос выполняется один раз.
+
+Раскладка буфера: [seq, loaded_at, rates...]. seq нечётный, пока идёт
+запись (seqlock): читатель повторяет чтение, если seq изменился.
+"""
+import math
+import multiprocessing
+from array import array
+from typing import Iterable, Optional, Tuple
+
+from rate_matrix import QuotesFetcher, RateMatrix, matrix_codes
+
+_HEADER = 2
+
+
+def allocate(base: str = "USD", currencies: Optional[Iterable[str]] = None,
+             ctx=multiprocessing) -> Tuple[object, object]:
+    """
+    Создание общего буфера и блокировки для SharedRateMatrix
+
+    Вызывается в родительском процессе до запуска рабочих; результат
+    передаётся им аргументами Process.
+
+    Returns:
+        (буфер, блокировка)
+    """
+    size = _HEADER + len(matrix_codes(base, currencies))
+    buffer = ctx.RawArray("d", size)
+    buffer[1] = math.nan
+    for i in range(_HEADER, size):
+        buffer[i] = math.nan
+    return buffer, ctx.RLock()
+
+
+class SharedRateMatrix(RateMatrix):
+    def __init__(self, fetch_quotes: QuotesFetcher, buffer, lock, base: str = "USD",
+                 currencies: Optional[Iterable[str]] = None, ttl: float = 300.0,
+                 retry_after: float = 30.0):
+        """
+        Args:
+            fetch_quotes: Загрузка котировок (как у RateMatrix)
+            buffer, lock: Результат allocate() с теми же base и currencies
+        """
+        super().__init__(fetch_quotes, base=base, currencies=currencies, ttl=ttl,
+                         retry_after=retry_after)
+        if len(buffer) != _HEADER + len(self.codes):
+            raise ValueError("Размер общего буфера не совпадает с набором валют матрицы")
+        self._buffer = buffer
+        # Межпроцессная блокировка: одно обновление на все процессы
+        self._lock = lock
+
+    @property
+    def loaded_at(self) -> Optional[float]:
+        # time.monotonic() — общие для всех процессов системные часы
+        loaded_at = self._buffer[1]
+        return None if math.isnan(loaded_at) else loaded_at
+
+    def _read_rates(self) -> array:
+        buffer = self._buffer
+        while True:
+            seq = buffer[0]
+            if seq % 2 == 0:
+                rates = array("d", buffer[_HEADER:])
+                if buffer[0] == seq:
+                    rates[self._index[self.base]] = 1.0
+                    return rates
+
+    def _write_rates(self, rates: array, loaded_at: float):
+        buffer = self._buffer
+        with self._lock:
+            buffer[0] += 1
+            buffer[_HEADER:] = rates
+            buffer[1] = loaded_at
+            buffer[0] += 1
@@ -0,0 +1,311 @@
+"""
+Хранилища состояний пользователей (FSM)
+
+MemoryStateStore — в памяти процесса: записи живут до истечения своего
+TTL, размер ограничен (вытеснение по LRU).
+
+SQLiteStateStore — то же в памяти плюс таблица user_states: изменения
+накапливаются и записываются в базу пакетами в фоновом потоке
+(write-behind), поэтому обработчики не ждут записи на диск, а состояния
+переживают перезапуск бота.
+
+Асинхронный бот не должен читать базу в цикле событий: перед обработкой
+обновления он проверяет needs_load и при необходимости вызывает load
+в потоке базы (user_state.preload_user_state); после этого get отвечает
+из памяти.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Запись хранилища: {"state": ..., "data": {...}}
+StateEntry = Dict
+
+
+def _encode(value):
+    if isinstance(value, Decimal):
+        return {"__decimal__": str(value)}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode(obj: Dict):
+    if "__decimal__" in obj and len(obj) == 1:
+        return Decimal(obj["__decimal__"])
+    return obj
+
+
+def dump_data(data: Dict) -> str:
+    """Сериализация данных состояния (Decimal сохраняется без потери точности)"""
+    return json.dumps(data, default=_encode, ensure_ascii=False)
+
+
+def load_data(text: str) -> Dict:
+    return json.loads(text, object_hook=_decode)
+
+
+class MemoryStateStore:
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        # user_id -> (запись, момент истечения по time.time())
+        self._entries: "OrderedDict[int, Tuple[StateEntry, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.expired = 0
+        self.evicted = 0
+
+    def get(self, user_id: int) -> Optional[StateEntry]:
+        """Запись пользователя или None, если её нет или она истекла"""
+        with self._lock:
+            item = self._entries.get(user_id)
+            if item is None:
+                return None
+            entry, expires_at = item
+            if expires_at <= time.time():
+                del self._entries[user_id]
+                self.expired += 1
+                return None
+            self._entries.move_to_end(user_id)
+            return entry
+
+    def set(self, user_id: int, entry: StateEntry, ttl: float):
+        with self._lock:
+            self._put(user_id, entry, time.time() + ttl)
+
+    def _put(self, user_id: int, entry: StateEntry, expires_at: float):
+        self._entries[user_id] = (entry, expires_at)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evicted += 1
+
+    def delete(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def purge_expired(self) -> int:
+        """Удаление всех истёкших записей; возвращает их число"""
+        now = time.time()
+        with self._lock:
+            expired = [user_id for user_id, (_, expires_at) in self._entries.items()
+                       if expires_at <= now]
+            for user_id in expired:
+                del self._entries[user_id]
+            self.expired += len(expired)
+        return len(expired)
+
+    def needs_load(self, user_id: int) -> bool:
+        """Потребует ли get чтения из базы (у хранилища в памяти — никогда)"""
+        return False
+
+    def close(self):
+        pass
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
+
+
+class SQLiteStateStore(MemoryStateStore):
+    # Отметка удаления в очереди записи
+    _DELETED = None
+
+    def __init__(self, db, max_size: int = 100000, flush_interval: float = 1.0,
+                 batch_size: int = 500, purge_interval: float = 600.0):
+        """
+        Args:
+            db: Database с таблицей user_states (миграция 4)
+            max_size: Размер кэша в памяти
+            flush_interval: Период записи накопленных изменений (сек)
+            batch_size: Число изменений, при котором запись начинается сразу
+            purge_interval: Период удаления истёкших строк из таблицы (сек)
+        """
+        super().__init__(max_size)
+        self.db = db
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.purge_interval = purge_interval
+        # user_id -> (запись или _DELETED, момент истечения): ещё не записано в базу
+        self._pending: Dict[int, Tuple[Optional[StateEntry], float]] = {}
+        # Изменения, которые записываются в базу прямо сейчас
+        self._flushing: Dict[int, Tuple[Optional[StateEntry], float]] = {}
+        self._wakeup = threading.Event()
+        self._closed = threading.Event()
+        self._flush_lock = threading.Lock()
+        # Пользователи, которых нет в базе (проверено load): повторный промах
+        # кэша не читает базу. Ограничено max_size, вытеснение по LRU
+        self._absent: "OrderedDict[int, None]" = OrderedDict()
+        self.flushed = 0
+        self._warm()
+        self._thread = threading.Thread(target=self._run, name="state-flush", daemon=True)
+        self._thread.start()
+
+    def _warm(self):
+        """Загрузка непросроченных состояний при запуске"""
+        rows = self.db.get_connection().execute(
+            "SELECT user_id, state, data, expires_at FROM user_states WHERE expires_at > ? "
+            "ORDER BY expires_at DESC LIMIT ?",
+            (time.time(), self.max_size)
+        ).fetchall()
+        with self._lock:
+            for user_id, state, data, expires_at in reversed(rows):
+                self._put(user_id, {"state": state, "data": load_data(data)}, expires_at)
+            # Если в базе есть строки сверх загруженных, промах кэша придётся
+            # проверять по базе
+            self._partial = len(rows) >= self.max_size
+
+    def get(self, user_id: int) -> Optional[StateEntry]:
+        entry = super().get(user_id)
+        if entry is not None:
+            return entry
+        with self._lock:
+            item = self._pending.get(user_id) or self._flushing.get(user_id)
+            if item is not None:
+                entry, expires_at = item
+                if entry is self._DELETED or expires_at <= time.time():
+                    return None
+                self._put(user_id, entry, expires_at)
+                return entry
+            if not self._may_be_stored(user_id):
+                return None
+        return self.load(user_id)
+
+    def _may_be_stored(self, user_id: int) -> bool:
+        """Может ли в базе быть запись, которой нет в памяти (под _lock)"""
+        # Пока из кэша ничего не вытеснялось, в базе нет записей, которых
+        # нет в памяти, — обращение к базе не нужно
+        if not self._partial and self.evicted == 0:
+            return False
+        return user_id not in self._absent
+
+    def needs_load(self, user_id: int) -> bool:
+        with self._lock:
+            item = self._entries.get(user_id)
+            if item is not None and item[1] > time.time():
+                return False
+            if user_id in self._pending or user_id in self._flushing:
+                return False
+            return self._may_be_stored(user_id)
+
+    def load(self, user_id: int) -> Optional[StateEntry]:
+        """Чтение записи из базы при промахе кэша (после перезапуска или вытеснения)"""
+        row = self.db.get_connection().execute(
+            "SELECT state, data, expires_at FROM user_states WHERE user_id = ? AND expires_at > ?",
+            (user_id, time.time())
+        ).fetchone()
+        if row is None:
+            with self._lock:
+                if user_id not in self._pending and user_id not in self._entries:
+                    self._absent[user_id] = None
+                    self._absent.move_to_end(user_id)
+                    while len(self._absent) > self.max_size:
+                        self._absent.popitem(last=False)
+            return None
+        entry = {"state": row[0], "data": load_data(row[1])}
+        with self._lock:
+            # Пока шло чтение, состояние могло измениться — приоритет у нового
+            changed = user_id in self._pending or user_id in self._entries
+            if not changed:
+                self._put(user_id, entry, row[2])
+        return self.get(user_id) if changed else entry
+
+    def set(self, user_id: int, entry: StateEntry, ttl: float):
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._absent.pop(user_id, None)
+            self._put(user_id, entry, expires_at)
+            self._pending[user_id] = (entry, expires_at)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def delete(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._pending[user_id] = (self._DELETED, 0.0)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """Запись накопленных изменений одной транзакцией; возвращает их число"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._flushing = pending
+            if not pending:
+                return 0
+            upserts = []
+            deletes = []
+            for user_id, (entry, expires_at) in pending.items():
+                if entry is self._DELETED:
+                    deletes.append((user_id,))
+                else:
+                    # Данные сериализуются здесь: обработчик мог изменить
+                    # словарь после set, в базу попадает последняя версия
+                    upserts.append((user_id, entry.get("state"),
+                                    dump_data(entry.get("data") or {}), expires_at))
+            try:
+                with self.db.transaction() as cursor:
+                    cursor.executemany("DELETE FROM user_states WHERE user_id = ?", deletes)
+                    cursor.executemany("""
+                        INSERT INTO user_states (user_id, state, data, expires_at)
+                        VALUES (?, ?, ?, ?)
+                        ON CONFLICT(user_id) DO UPDATE SET
+                            state = excluded.state,
+                            data = excluded.data,
+                            expires_at = excluded.expires_at
+                    """, upserts)
+            except Exception:
+                # Возвращаем изменения в очередь, не затирая более новые
+                with self._lock:
+                    for user_id, item in pending.items():
+                        self._pending.setdefault(user_id, item)
+                    self._flushing = {}
+                raise
+            with self._lock:
+                self._flushing = {}
+            self.flushed += len(pending)
+            return len(pending)
+
+    def purge_expired(self) -> int:
+        removed = super().purge_expired()
+        with self.db.transaction() as cursor:
+            cursor.execute("DELETE FROM user_states WHERE expires_at <= ?", (time.time(),))
+        return removed
+
+    def _run(self):
+        next_purge = time.monotonic() + self.purge_interval
+        while not self._closed.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if time.monotonic() >= next_purge:
+                    self.purge_expired()
+                    next_purge = time.monotonic() + self.purge_interval
+            except Exception:
+                logger.exception("Ошибка записи состояний пользователей")
+
+    def close(self):
+        """Остановка фонового потока и запись оставшихся изменений"""
+        self._closed.set()
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        with self._lock:
+            stats["pending"] = len(self._pending)
+        stats["flushed"] = self.flushed
+        return stats
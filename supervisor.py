@@ -0,0 +1,311 @@
+"""
+Многопроцессный запуск бота с привязкой пользователей к процессам
+
+Supervisor получает обновления (long polling или webhook) и передаёт каждое
+рабочему процессу с номером user_id % N. Все обновления пользователя
+обрабатываются одним процессом, поэтому его состояние FSM остаётся
+локальным для процесса. Внутри процесса обновления, как и в bot.py,
+раздаёт ShardedDispatcher.
+
+Упавший рабочий процесс перезапускается (проверка — раз в секунду и при
+передаче обновлений); обновления, которые не удалось передать за
+WORKER_PUT_TIMEOUT, пропускаются с записью в лог.
+
+Общее для процессов:
+- матрица курсов в общей памяти (shared_rates.py) — supervisor обновляет
+  её одним запросом к API для всех процессов;
+- блокировка записи в SQLite: транзакции записи разных процессов
+  выполняются по очереди (см. database.set_process_write_lock).
+
+Запуск:
+    python supervisor.py [--workers 4]
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+from typing import Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from dispatcher import shard_key
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Число рабочих процессов и длина очереди каждого из них
+WORKERS = int(os.getenv("WORKERS", str(os.cpu_count() or 2)))
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "10000"))
+# Сколько ждать места в очереди процесса и завершения процесса при остановке (сек)
+WORKER_PUT_TIMEOUT = float(os.getenv("WORKER_PUT_TIMEOUT", "5"))
+WORKER_STOP_TIMEOUT = float(os.getenv("WORKER_STOP_TIMEOUT", "30"))
+# Период проверки, живы ли рабочие процессы (сек)
+WORKER_CHECK_INTERVAL = 1.0
+
+_STOP = None
+
+
+def _worker_main(index: int, updates, write_lock, rates_buffer, rates_lock, processed,
+                 initializer: Optional[Callable[[], None]]):
+    """Рабочий процесс: обработка обновлений своих пользователей"""
+    # Остановкой управляет supervisor через очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if initializer is not None:
+        initializer()
+
+    import database
+    database.set_process_write_lock(write_lock)
+
+    import currency_api
+    from shared_rates import SharedRateMatrix
+    currency_api.rate_matrix = SharedRateMatrix(
+        currency_api._fetch_quotes, rates_buffer, rates_lock,
+        base=currency_api.RATE_MATRIX_BASE, ttl=currency_api.RATE_CACHE_TTL,
+        retry_after=currency_api.RATE_MATRIX_RETRY_AFTER
+    )
+    currency_api.init_supported_currencies()
+
+    import bot
+    from user_state import close_state_store
+
+    try:
+        while True:
+            try:
+                batch = updates.get(timeout=0.5)
+            except queue.Empty:
+                batch = []
+            if batch is _STOP:
+                break
+            if batch:
+                bot.bot.process_new_updates(batch)
+            processed.value = bot.update_dispatcher.stats()["processed"]
+    finally:
+        bot.update_dispatcher.shutdown()
+        processed.value = bot.update_dispatcher.stats()["processed"]
+        close_state_store()
+        currency_api.supported_currencies.stop_refresh()
+
+
+class Supervisor:
+    def __init__(self, workers: int = WORKERS, queue_size: int = WORKER_QUEUE_SIZE,
+                 fetch_quotes: Optional[Callable] = None,
+                 initializer: Optional[Callable[[], None]] = None):
+        """
+        Args:
+            workers: Число рабочих процессов
+            queue_size: Максимальное число пакетов в очереди процесса
+            fetch_quotes: Загрузка котировок для общей матрицы; по умолчанию
+                currency_api._fetch_quotes
+            initializer: Функция, вызываемая в рабочем процессе до импорта
+                бота (должна быть доступна по имени модуля — процессы
+                запускаются методом spawn)
+        """
+        import currency_api
+        import shared_rates
+
+        self.workers = workers
+        self._ctx = multiprocessing.get_context("spawn")
+        self._queue_size = queue_size
+        self._queues = [self._ctx.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._processed = [self._ctx.Value("q", 0, lock=False) for _ in range(workers)]
+        self._write_lock = self._ctx.Lock()
+        self._rates_buffer, self._rates_lock = shared_rates.allocate(
+            currency_api.RATE_MATRIX_BASE, ctx=self._ctx
+        )
+        self.rate_matrix = shared_rates.SharedRateMatrix(
+            fetch_quotes or currency_api._fetch_quotes, self._rates_buffer, self._rates_lock,
+            base=currency_api.RATE_MATRIX_BASE, ttl=currency_api.RATE_CACHE_TTL,
+            retry_after=currency_api.RATE_MATRIX_RETRY_AFTER
+        )
+        self._initializer = initializer
+        self._processes: List = [None] * workers
+        # Перезапуск процессов — из потока проверки и из route
+        self._processes_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._stopped = threading.Event()
+        self._refresher = threading.Thread(target=self._refresh_rates, name="rates-refresh",
+                                           daemon=True)
+        self._watcher = threading.Thread(target=self._watch_workers, name="workers-watch",
+                                         daemon=True)
+        self.routed = 0
+        self.dropped = 0
+        self.restarts = 0
+
+    def start(self):
+        from database import Database
+
+        # Миграции применяются один раз, до запуска рабочих процессов
+        Database().close()
+        self.rate_matrix.refresh()
+        self._refresher.start()
+        with self._processes_lock:
+            for index in range(self.workers):
+                self._start_worker(index)
+        self._watcher.start()
+
+    def _start_worker(self, index: int):
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(index, self._queues[index], self._write_lock, self._rates_buffer,
+                  self._rates_lock, self._processed[index], self._initializer),
+            name=f"worker-{index}"
+        )
+        process.start()
+        self._processes[index] = process
+
+    def _ensure_alive(self, index: int) -> bool:
+        """
+        Перезапуск упавшего рабочего процесса
+
+        Процесс получает новую очередь: если он упал внутри Queue.get,
+        блокировка чтения старой очереди осталась захваченной, и новый
+        процесс не прочитал бы из неё ничего. Пакеты из старой очереди
+        теряются и учитываются в dropped.
+
+        Returns:
+            True, если процесс пришлось перезапустить
+        """
+        with self._processes_lock:
+            process = self._processes[index]
+            if process.is_alive() or self._stopping.is_set():
+                return False
+            old_queue = self._queues[index]
+            try:
+                lost = old_queue.qsize()
+            except NotImplementedError:
+                # macOS: размер очереди недоступен
+                lost = 0
+            logger.error("Рабочий процесс %s завершился (код %s), перезапуск; "
+                         "пакетов в очереди потеряно: %d", process.name, process.exitcode, lost)
+            old_queue.cancel_join_thread()
+            self._queues[index] = self._ctx.Queue(maxsize=self._queue_size)
+            self.dropped += lost
+            self._start_worker(index)
+            self.restarts += 1
+            return True
+
+    def _watch_workers(self):
+        while not self._stopping.wait(WORKER_CHECK_INTERVAL):
+            for index in range(self.workers):
+                self._ensure_alive(index)
+
+    def _refresh_rates(self):
+        """Обновление общей матрицы курсов до того, как она устареет у процессов"""
+        interval = self.rate_matrix.ttl / 2
+        while not self._stopped.wait(interval):
+            self.rate_matrix.refresh()
+
+    def route(self, updates: list):
+        """Замена TeleBot.process_new_updates: передача обновлений процессам-владельцам"""
+        batches: Dict[int, list] = {}
+        for update in updates:
+            batches.setdefault(shard_key(update) % self.workers, []).append(update)
+        for index, batch in batches.items():
+            # При заполненной очереди приём обновлений ждёт не дольше
+            # WORKER_PUT_TIMEOUT; очередь могла заполниться из-за упавшего процесса
+            try:
+                self._queues[index].put(batch, timeout=WORKER_PUT_TIMEOUT)
+            except queue.Full:
+                self._ensure_alive(index)
+                self.dropped += len(batch)
+                logger.error("Очередь процесса worker-%d переполнена, пропущено обновлений: %d",
+                             index, len(batch))
+                continue
+            self.routed += len(batch)
+
+    def stop(self):
+        """
+        Остановка процессов после обработки уже переданных обновлений
+
+        Не зависает на упавшем процессе: сигнал остановки ставится в очередь
+        с таймаутом, а процесс, не завершившийся за WORKER_STOP_TIMEOUT,
+        принудительно останавливается.
+        """
+        self._stopping.set()
+        for index, q in enumerate(self._queues):
+            process = self._processes[index]
+            if process is None or not process.is_alive():
+                continue
+            try:
+                q.put(_STOP, timeout=WORKER_PUT_TIMEOUT)
+            except queue.Full:
+                logger.error("Не удалось передать сигнал остановки процессу %s", process.name)
+        for process in self._processes:
+            if process is None:
+                continue
+            process.join(WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                logger.error("Процесс %s не завершился за %.0f с, остановка принудительно",
+                             process.name, WORKER_STOP_TIMEOUT)
+                process.terminate()
+                process.join()
+        for q in self._queues:
+            # Данные, которые некому прочитать, не должны задерживать выход
+            q.cancel_join_thread()
+        self._stopped.set()
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "routed": self.routed,
+            "dropped": self.dropped,
+            "restarts": self.restarts,
+            "processed": [value.value for value in self._processed],
+            "alive": [process is not None and process.is_alive()
+                      for process in self._processes],
+        }
+
+
+def main():
+    import telebot
+
+    parser = argparse.ArgumentParser(description="Запуск бота в нескольких процессах")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Число рабочих процессов")
+    args = parser.parse_args()
+
+    bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not bot_token:
+        raise ValueError("TELEGRAM_BOT_TOKEN не найден в переменных окружения!")
+
+    supervisor = Supervisor(workers=args.workers)
+    supervisor.start()
+    print(f"🚀 Бот запущен: {args.workers} рабочих процессов")
+    try:
+        if os.getenv("UPDATE_MODE", "polling") == "webhook":
+            from webhook import WebhookServer
+
+            secret = os.getenv("WEBHOOK_SECRET")
+            if not secret:
+                raise ValueError("WEBHOOK_SECRET не найден в переменных окружения!")
+            server = WebhookServer(
+                supervisor.route,
+                host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+                port=int(os.getenv("WEBHOOK_PORT", "8443")),
+                path=os.getenv("WEBHOOK_PATH", "/webhook"),
+                secret_token=secret,
+                batch_size=int(os.getenv("WEBHOOK_BATCH_SIZE", "100"))
+            )
+            stop_event = threading.Event()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(sig, lambda signum, frame: stop_event.set())
+            server.start()
+            if os.getenv("WEBHOOK_URL"):
+                telebot.TeleBot(bot_token).set_webhook(url=os.getenv("WEBHOOK_URL"),
+                                                       secret_token=secret)
+            stop_event.wait()
+            server.stop()
+        else:
+            # Этот экземпляр только получает обновления; отвечают рабочие процессы
+            receiver = telebot.TeleBot(bot_token, threaded=False)
+            receiver.process_new_updates = supervisor.route
+            receiver.infinity_polling(none_stop=True)
+    finally:
+        supervisor.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Набор валют, поддерживаемых API exchangerate.host
+
+Список загружается один раз при запуске (эндпоинт /list или, если API
+недоступен, снимок data/supported_currencies.json) и периодически
+обновляется в фоне. Проверка доступности валюты — проверка вхождения
+во frozenset без сетевых запросов.
+"""
+import json
+import os
+import threading
+from typing import Callable, FrozenSet, Iterable, Optional
+
+SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "data", "supported_currencies.json")
+
+# fetch_codes() -> коды валют из API (пустой результат считается ошибкой)
+CodesFetcher = Callable[[], Iterable[str]]
+
+
+def load_snapshot(path: str = SNAPSHOT_PATH) -> FrozenSet[str]:
+    """Загрузка кодов валют из снимка, сохранённого в репозитории"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return frozenset(json.load(f).get("currencies", {}))
+    except (OSError, ValueError):
+        return frozenset()
+
+
+class SupportedCurrencies:
+    def __init__(self, fetch_codes: CodesFetcher, snapshot_path: str = SNAPSHOT_PATH):
+        self._fetch_codes = fetch_codes
+        self._snapshot_path = snapshot_path
+        self._codes: Optional[FrozenSet[str]] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __contains__(self, currency: str) -> bool:
+        return currency in self.codes
+
+    @property
+    def codes(self) -> FrozenSet[str]:
+        codes = self._codes
+        if codes is None:
+            codes = self.load()
+        return codes
+
+    def load(self) -> FrozenSet[str]:
+        """
+        Загрузка списка валют из API, а при ошибке — из снимка
+
+        Уже загруженный список заменяется только успешным ответом API.
+        """
+        with self._lock:
+            try:
+                codes = frozenset(self._fetch_codes())
+            except Exception:
+                codes = frozenset()
+            if not codes:
+                codes = self._codes or load_snapshot(self._snapshot_path)
+            self._codes = codes
+            return codes
+
+    def start_refresh(self, interval: float):
+        """Запуск фонового обновления списка каждые interval секунд"""
+        if self._thread is not None or interval <= 0:
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                self.load()
+
+        self._thread = threading.Thread(target=run, name="supported-currencies", daemon=True)
+        self._thread.start()
+
+    def stop_refresh(self):
+        self._stop.set()
@@ -0,0 +1,41 @@
+"""
+Регрессионная проверка планов частых запросов (HOT_QUERIES)
+
+Схема создаётся миграциями во временной базе; ни один частый запрос
+не должен сканировать таблицу целиком или сортировать во временном B-дереве.
+Запуск: python -m pytest tests или python -m unittest discover tests
+"""
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from database import Database
+from migrations import MIGRATIONS, migrate
+
+
+class QueryPlansTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, "travel_wallet.db")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_hot_queries_use_indexes(self):
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        try:
+            version = migrate(conn, output=lambda line: None)
+        finally:
+            conn.close()
+        self.assertEqual(version, MIGRATIONS[-1].version)
+
+        db = Database(self.db_path)
+        try:
+            self.assertEqual(db.find_table_scans(), {})
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+"""
+Состояния пользователей для FSM
+
+Общие для синхронной и асинхронной версий бота. Состояния хранятся
+в хранилище из state_store (по умолчанию — в памяти; STATE_BACKEND=sqlite —
+с сохранением в базе), у каждого состояния свой срок жизни: пользователь,
+бросивший создание путешествия на полпути, не занимает память вечно.
+"""
+import os
+from typing import Awaitable, Callable, Dict
+
+from dotenv import load_dotenv
+
+from fsm import Transitions
+from state_store import MemoryStateStore, SQLiteStateStore
+
+load_dotenv()
+
+# Хранилище состояний: memory или sqlite
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_MAX_SIZE = int(os.getenv("STATE_MAX_SIZE", "100000"))
+# Срок жизни состояния по умолчанию (сек)
+STATE_TTL = float(os.getenv("STATE_TTL", "86400"))
+
+# Сроки жизни отдельных состояний (сек)
+STATE_TTLS: Dict[str, float] = {
+    # Подтверждение курса и расхода: предложенные суммы быстро устаревают
+    "waiting_rate_confirmation": 600,
+    "waiting_expense_confirmation": 600,
+    "waiting_bulk_expense_confirmation": 600,
+    "waiting_import_file": 600,
+    "waiting_expense_description": 1800,
+}
+
+# Допустимые переходы FSM (None — пользователь без состояния). Сброс
+# состояния (clear_user_state) допустим всегда.
+TRANSITIONS = Transitions({
+    "waiting_from_country": {"waiting_to_country"},
+    "waiting_to_country": {"waiting_rate_confirmation"},
+    "waiting_rate_confirmation": {"waiting_initial_amount", "waiting_manual_rate"},
+    "waiting_manual_rate": {"waiting_initial_amount"},
+    None: {"waiting_expense_confirmation", "waiting_bulk_expense_confirmation"},
+    "waiting_expense_confirmation": {"waiting_expense_description"},
+}, entry_states={
+    # Создание путешествия, смена курса и импорт начинаются из любого состояния
+    "waiting_from_country",
+    "waiting_new_rate",
+    "waiting_import_file",
+})
+
+store = MemoryStateStore(max_size=STATE_MAX_SIZE)
+
+
+def init_state_store(db):
+    """
+    Выбор хранилища по STATE_BACKEND
+
+    Args:
+        db: Database; для sqlite состояния сохраняются в её таблице user_states
+    """
+    global store
+    if STATE_BACKEND == "sqlite":
+        store = SQLiteStateStore(
+            db,
+            max_size=STATE_MAX_SIZE,
+            flush_interval=float(os.getenv("STATE_FLUSH_INTERVAL", "1")),
+            batch_size=int(os.getenv("STATE_FLUSH_BATCH", "500"))
+        )
+    return store
+
+
+def close_state_store():
+    """Запись несохранённых состояний при остановке бота"""
+    store.close()
+
+
+async def preload_user_state(user_id: int, run: Callable[..., Awaitable]):
+    """
+    Асинхронный бот: чтение состояния из базы при промахе кэша выполняется
+    через run (поток базы), а не в цикле событий; после этого
+    get_user_state отвечает из памяти
+
+    Args:
+        run: Запуск функции в потоке базы, например AsyncDatabase._run
+    """
+    if store.needs_load(user_id):
+        await run(store.load, user_id)
+
+
+def get_user_state(user_id: int) -> dict:
+    """Получение состояния пользователя"""
+    return store.get(user_id) or {}
+
+
+def set_user_state(user_id: int, state: str, data: dict = None):
+    """Установка состояния пользователя (fsm.InvalidTransition при недопустимом переходе)"""
+    TRANSITIONS.check(get_user_state(user_id).get("state"), state)
+    store.set(user_id, {"state": state, "data": data or {}}, STATE_TTLS.get(state, STATE_TTL))
+
+
+def clear_user_state(user_id: int):
+    """Очистка состояния пользователя"""
+    store.delete(user_id)
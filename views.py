@@ -0,0 +1,435 @@
+"""
+Тексты и клавиатуры бота
+
+Общие для синхронной (bot.py) и асинхронной (async_bot.py) версий бота:
+функции только формируют сообщения и ничего не отправляют.
+"""
+from datetime import date, datetime, timezone
+from decimal import ROUND_FLOOR, Decimal
+from typing import Dict, List, Optional, Tuple
+
+from telebot import types
+
+from currencies import format_currency_name, get_exponent, plural_form
+from money import quantize
+
+WELCOME_TEXT = (
+    "👋 Добро пожаловать в миникошелёк для путешественника!\n\n"
+    "Я помогу вам отслеживать расходы во время путешествий и конвертировать валюты.\n\n"
+    "Используйте меню ниже или команды:\n"
+    "/newtrip - создать новое путешествие\n"
+    "/switch - переключить путешествие\n"
+    "/balance - показать баланс\n"
+    "/history - история расходов\n"
+    "/stats - статистика расходов\n"
+    "/export - выгрузка расходов (CSV; /export json, /export all)\n"
+    "/import - загрузка расходов из CSV-выписки по карте\n"
+    "/setrate - изменить курс обмена"
+)
+
+NEW_TRIP_TEXT = (
+    "✈️ Создание нового путешествия\n\n"
+    "Введите страну отправления (например: Россия, Russia, RU):"
+)
+
+NO_USER_TEXT = "❌ Ошибка: не удалось определить пользователя."
+
+NO_TRIPS_TEXT = (
+    "📋 У вас пока нет путешествий.\n\n"
+    "Создайте новое путешествие через меню или команду /newtrip"
+)
+
+NO_ACTIVE_TRIP_TEXT = "❌ У вас нет активного путешествия."
+
+NO_ACTIVE_TRIP_HINT_TEXT = (
+    "❌ У вас нет активного путешествия.\n\n"
+    "Создайте новое путешествие или выберите существующее."
+)
+
+UNKNOWN_COMMAND_TEXT = "❓ Не понимаю команду. Используйте меню ниже:"
+
+# Расходов на одной странице истории
+HISTORY_PAGE_SIZE = 20
+
+# Статистика: число последних дней и крупнейших категорий
+STATS_DAYS = 7
+STATS_TOP_CATEGORIES = 10
+
+
+def format_number(num: Decimal, exponent: int = 2) -> str:
+    """Форматирование числа с пробелами для тысяч и exponent знаками после запятой"""
+    return f"{num:,.{exponent}f}".replace(",", " ").replace(".", ",")
+
+
+def format_amount(amount: Decimal, currency: str) -> str:
+    """Сумма с точностью валюты: 1 500,50 RUB, 1 500 JPY, 1,250 KWD"""
+    return f"{format_number(amount, get_exponent(currency))} {currency}"
+
+
+def format_rate(trip: Dict) -> str:
+    """Строка курса путешествия: 1 RUB = 0,08 CNY"""
+    return f"1 {trip['from_currency']} = {format_number(trip['exchange_rate'])} {trip['to_currency']}"
+
+
+def create_main_menu() -> types.InlineKeyboardMarkup:
+    """Создание главного меню"""
+    keyboard = types.InlineKeyboardMarkup(row_width=2)
+    keyboard.add(
+        types.InlineKeyboardButton("✈️ Создать путешествие", callback_data="new_trip"),
+        types.InlineKeyboardButton("📋 Мои путешествия", callback_data="my_trips")
+    )
+    keyboard.add(
+        types.InlineKeyboardButton("💰 Баланс", callback_data="balance"),
+        types.InlineKeyboardButton("📊 История расходов", callback_data="history")
+    )
+    keyboard.add(
+        types.InlineKeyboardButton("📈 Статистика", callback_data="stats"),
+        types.InlineKeyboardButton("💱 Изменить курс", callback_data="change_rate")
+    )
+    return keyboard
+
+
+def create_back_keyboard() -> types.InlineKeyboardMarkup:
+    """Клавиатура с единственной кнопкой возврата в главное меню"""
+    keyboard = types.InlineKeyboardMarkup()
+    keyboard.add(types.InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu"))
+    return keyboard
+
+
+def create_yes_no_keyboard(yes_data: str, no_data: str) -> types.InlineKeyboardMarkup:
+    """Клавиатура подтверждения «Да / Нет»"""
+    keyboard = types.InlineKeyboardMarkup()
+    keyboard.add(
+        types.InlineKeyboardButton("✅ Да", callback_data=yes_data),
+        types.InlineKeyboardButton("❌ Нет", callback_data=no_data)
+    )
+    return keyboard
+
+
+def country_suggestions(query: str, candidates) -> Tuple[str, types.InlineKeyboardMarkup]:
+    """Текст и клавиатура выбора страны, если ввод подходит к нескольким"""
+    keyboard = types.InlineKeyboardMarkup()
+    for country in candidates:
+        keyboard.add(types.InlineKeyboardButton(
+            f"{country.name_ru} ({country.currency})",
+            callback_data=f"country_{country.alpha2}"
+        ))
+    text = (
+        f"🤔 Не удалось однозначно определить страну '{query}'.\n\n"
+        "Выберите страну из списка или введите название ещё раз:"
+    )
+    return text, keyboard
+
+
+def trips_list(trips: List[Dict]) -> Tuple[str, types.InlineKeyboardMarkup]:
+    """Текст и клавиатура списка путешествий"""
+    keyboard = types.InlineKeyboardMarkup()
+    for trip in trips:
+        active_mark = "✅ " if trip['is_active'] else ""
+        button_text = f"{active_mark}{trip['name']} ({trip['from_country']} → {trip['to_country']})"
+        keyboard.add(types.InlineKeyboardButton(
+            button_text,
+            callback_data=f"switch_trip_{trip['id']}"
+        ))
+    keyboard.add(types.InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu"))
+
+    trips_text = "📋 Ваши путешествия:\n\n"
+    for trip in trips:
+        active_mark = "✅ " if trip['is_active'] else ""
+        trips_text += f"{active_mark}{trip['name']}\n"
+        trips_text += f"   {trip['from_country']} ({trip['from_currency']}) → "
+        trips_text += f"{trip['to_country']} ({trip['to_currency']})\n"
+        trips_text += f"   Курс: {format_rate(trip)}\n\n"
+
+    return trips_text, keyboard
+
+
+def balance_text(trip: Dict) -> str:
+    """Текст баланса путешествия"""
+    return (
+        f"💰 Баланс путешествия: {trip['name']}\n\n"
+        f"📍 {trip['from_country']} ({trip['from_currency']}) → "
+        f"{trip['to_country']} ({trip['to_currency']})\n\n"
+        f"💵 Остаток:\n"
+        f"   {format_amount(trip['balance_to'], trip['to_currency'])} = "
+        f"{format_amount(trip['balance_from'], trip['from_currency'])}\n\n"
+        f"💱 Курс: {format_rate(trip)}"
+    )
+
+
+def format_expense_datetime(dt_str: str) -> str:
+    """Дата и время расхода в формате DD.MM.YYYY HH:MM"""
+    if not dt_str:
+        return ""
+    if len(dt_str) >= 16:
+        date_part = dt_str[:10]  # 2026-02-05
+        time_part = dt_str[11:16]  # 16:06
+        # Преобразуем дату из формата YYYY-MM-DD в DD.MM.YYYY
+        date_parts = date_part.split('-')
+        if len(date_parts) == 3:
+            formatted_date = f"{date_parts[2]}.{date_parts[1]}.{date_parts[0]}"
+            return f"{formatted_date} {time_part}"
+        return dt_str[:16]
+    return dt_str[:10] if len(dt_str) >= 10 else dt_str
+
+
+def history_text(trip: Dict, expenses: List[Dict], partial: bool = False) -> str:
+    """Текст истории расходов; partial — показана не вся история, а одна страница"""
+    if not expenses:
+        return (
+            f"📊 История расходов: {trip['name']}\n\n"
+            "Пока нет расходов."
+        )
+
+    text = f"📊 История расходов: {trip['name']}\n\n"
+    total_to = Decimal(0)
+    total_from = Decimal(0)
+
+    for expense in expenses:
+        total_to += expense['amount_to']
+        total_from += expense['amount_from']
+
+        desc = expense['description'] or ""
+        text += (
+            f"📅 {format_expense_datetime(expense['created_at'])}\n"
+            f"   {format_amount(expense['amount_to'], trip['to_currency'])} = "
+            f"{format_amount(expense['amount_from'], trip['from_currency'])}\n"
+        )
+        if desc:
+            text += f"   💬 {desc}\n"
+        text += "\n"
+
+    text += (
+        f"\n📊 {'Итого на странице' if partial else 'Всего потрачено'}:\n"
+        f"   {format_amount(total_to, trip['to_currency'])} = "
+        f"{format_amount(total_from, trip['from_currency'])}"
+    )
+    return text
+
+
+def history_page(trip: Dict, page: Dict) -> Tuple[str, types.InlineKeyboardMarkup]:
+    """
+    Текст и клавиатура страницы истории (см. Database.get_expenses_page)
+
+    Кнопки ◀️ / ▶️ несут в callback_data курсор (created_at, id) крайнего
+    расхода страницы: hist_after_<trip_id>_<id>_<created_at> — более новые
+    расходы, hist_before_... — более старые.
+    """
+    expenses = page['expenses']
+    keyboard = types.InlineKeyboardMarkup()
+    buttons = []
+    if expenses and page['has_newer']:
+        first = expenses[0]
+        buttons.append(types.InlineKeyboardButton(
+            "◀️ Новее",
+            callback_data=f"hist_after_{trip['id']}_{first['id']}_{first['created_at']}"
+        ))
+    if expenses and page['has_older']:
+        last = expenses[-1]
+        buttons.append(types.InlineKeyboardButton(
+            "Старше ▶️",
+            callback_data=f"hist_before_{trip['id']}_{last['id']}_{last['created_at']}"
+        ))
+    if buttons:
+        keyboard.row(*buttons)
+    keyboard.add(types.InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu"))
+
+    text = history_text(trip, expenses, partial=page['has_newer'] or page['has_older'])
+    return text, keyboard
+
+
+def stats_text(trip: Dict, stats: Dict, today: Optional[date] = None) -> str:
+    """
+    Статистика расходов (см. Database.get_trip_stats)
+
+    Средний расход в день — за дни с первого расхода по сегодня (UTC, как
+    created_at); прогноз — на сколько дней хватит остатка при таком темпе.
+    """
+    to_currency = trip['to_currency']
+    from_currency = trip['from_currency']
+    text = f"📈 Статистика: {trip['name']}\n\n"
+    if not stats['count']:
+        return text + "Пока нет расходов."
+
+    today = today or datetime.now(timezone.utc).date()
+    first_day = date.fromisoformat(stats['days'][0]['day'])
+    days = max((today - first_day).days + 1, 1)
+    burn_to = stats['total_to'] / days
+
+    text += (
+        f"💸 Всего потрачено:\n"
+        f"   {format_amount(stats['total_to'], to_currency)} = "
+        f"{format_amount(stats['total_from'], from_currency)}\n"
+        f"   {stats['count']} {plural_form(stats['count'], ('расход', 'расхода', 'расходов'))} "
+        f"за {days} {plural_form(days, ('день', 'дня', 'дней'))}\n\n"
+        f"🔥 В среднем в день:\n"
+        f"   {format_amount(quantize(burn_to, to_currency), to_currency)} = "
+        f"{format_amount(quantize(stats['total_from'] / days, from_currency), from_currency)}\n"
+    )
+    if trip['balance_to'] <= 0:
+        text += "⚠️ Бюджет исчерпан\n"
+    elif burn_to > 0:
+        days_left = int((trip['balance_to'] / burn_to).to_integral_value(rounding=ROUND_FLOOR))
+        text += (
+            f"⏳ Остатка хватит примерно на {days_left} "
+            f"{plural_form(days_left, ('день', 'дня', 'дней'))}\n"
+        )
+
+    recent = f" (последние {STATS_DAYS})" if len(stats['days']) > STATS_DAYS else ""
+    text += f"\n📅 По дням{recent}:\n"
+    for day in stats['days'][-STATS_DAYS:]:
+        text += f"   {day['day'][8:10]}.{day['day'][5:7]}: {format_amount(day['amount_to'], to_currency)}\n"
+
+    text += "\n🏷 По категориям:\n"
+    categories = stats['categories']
+    for category in categories[:STATS_TOP_CATEGORIES]:
+        text += (
+            f"   {category['category'] or 'Без описания'}: "
+            f"{format_amount(category['amount_to'], to_currency)} ({category['count']})\n"
+        )
+    rest = categories[STATS_TOP_CATEGORIES:]
+    if rest:
+        text += (
+            f"   Прочее: {format_amount(sum(c['amount_to'] for c in rest), to_currency)} "
+            f"({sum(c['count'] for c in rest)})\n"
+        )
+    return text.rstrip("\n")
+
+
+def export_caption(count: int, trip: Optional[Dict] = None) -> str:
+    """Подпись к файлу выгрузки расходов"""
+    title = trip['name'] if trip else "все путешествия"
+    return (
+        f"📤 Выгрузка расходов: {title}\n"
+        f"{count} {plural_form(count, ('расход', 'расхода', 'расходов'))}"
+    )
+
+
+def import_prompt_text(trip: Dict) -> str:
+    """Запрос файла выписки для импорта"""
+    return (
+        f"📥 Импорт расходов: {trip['name']}\n\n"
+        f"Отправьте выписку по карте CSV-файлом (до 20 МБ). Разделитель, формат дат и "
+        f"сумм определяются автоматически; нужны столбцы с датой и суммой, описание — "
+        f"по возможности.\n\n"
+        f"Суммы считаются в валюте страны пребывания ({trip['to_currency']}) и "
+        f"пересчитываются по курсу путешествия. Повторная загрузка того же файла ничего не добавит."
+    )
+
+
+def import_summary_text(trip: Dict, summary: Dict) -> str:
+    """Итог импорта (см. importer.import_expenses) с остатком"""
+    text = (
+        f"📥 Импорт завершён: {trip['name']}\n"
+        f"Формат: {summary['format'].describe()}\n\n"
+        f"✅ Добавлено расходов: {summary['imported']}\n"
+    )
+    if summary['duplicates']:
+        text += f"🔁 Уже были загружены: {summary['duplicates']}\n"
+    if summary['skipped']:
+        text += f"⏭ Пропущено поступлений и нулевых сумм: {summary['skipped']}\n"
+    if summary['errors']:
+        text += f"⚠️ Не распознано строк: {summary['errors']}\n"
+    text += (
+        f"\n💰 Остаток:\n"
+        f"   {format_amount(trip['balance_to'], trip['to_currency'])} = "
+        f"{format_amount(trip['balance_from'], trip['from_currency'])}"
+    )
+    return text
+
+
+def change_rate_text(trip: Dict) -> str:
+    """Запрос нового курса для путешествия"""
+    return (
+        f"💱 Изменение курса для путешествия: {trip['name']}\n\n"
+        f"Текущий курс: {format_rate(trip)}\n\n"
+        f"Введите новый курс обмена (сколько {trip['to_currency']} за 1 {trip['from_currency']}):"
+    )
+
+
+def rate_offer_text(from_currency: str, to_currency: str, rate: Decimal) -> str:
+    """Предложение курса обмена для подтверждения"""
+    return (
+        f"💱 Курс обмена:\n\n"
+        f"1 {from_currency} = {format_number(rate)} {to_currency}\n\n"
+        f"Подходит ли этот курс?"
+    )
+
+
+def initial_amount_prompt(currency: str) -> str:
+    """Запрос начальной суммы путешествия"""
+    return f"Введите начальную сумму в {format_currency_name(currency)}:"
+
+
+def trip_created_text(trip_name: str, data: Dict, rate: Decimal,
+                      amount_from: Decimal, amount_to: Decimal) -> str:
+    """Сообщение о созданном путешествии"""
+    return (
+        f"✅ Путешествие создано!\n\n"
+        f"📍 {trip_name}\n"
+        f"💱 Курс: 1 {data['from_currency']} = {format_number(rate)} {data['to_currency']}\n\n"
+        f"💰 Начальный баланс:\n"
+        f"   {format_amount(amount_to, data['to_currency'])} = "
+        f"{format_amount(amount_from, data['from_currency'])}\n\n"
+        f"Теперь вы можете вводить суммы расходов, и я буду их конвертировать!"
+    )
+
+
+def expense_prompt_text(trip: Dict, amount_to: Decimal, amount_from: Decimal) -> str:
+    """Запрос подтверждения расхода"""
+    return (
+        f"💵 {format_amount(amount_to, trip['to_currency'])} = "
+        f"{format_amount(amount_from, trip['from_currency'])}\n\n"
+        f"Учесть как расход?"
+    )
+
+
+def expense_saved_text(trip: Dict) -> str:
+    """Сообщение об учтённом расходе с остатком"""
+    return (
+        f"✅ Расход учтён!\n\n"
+        f"💰 Остаток:\n"
+        f"   {format_amount(trip['balance_to'], trip['to_currency'])} = "
+        f"{format_amount(trip['balance_from'], trip['from_currency'])}\n\n"
+        f"💬 Введите наименование расхода (или отправьте /skip чтобы пропустить):"
+    )
+
+
+def bulk_expense_prompt_text(trip: Dict, expenses: List[Tuple[Decimal, Decimal, str]]) -> str:
+    """Запрос подтверждения нескольких расходов: (сумма, сумма в домашней валюте, описание)"""
+    lines = [f"📝 Расходов: {len(expenses)}\n"]
+    for amount_to, amount_from, description in expenses:
+        line = (f"💵 {format_amount(amount_to, trip['to_currency'])} = "
+                f"{format_amount(amount_from, trip['from_currency'])}")
+        if description:
+            line += f" — {description}"
+        lines.append(line)
+    total_to = sum((amount_to for amount_to, _, _ in expenses), Decimal(0))
+    total_from = sum((amount_from for _, amount_from, _ in expenses), Decimal(0))
+    lines.append(
+        f"\n📊 Итого: {format_amount(total_to, trip['to_currency'])} = "
+        f"{format_amount(total_from, trip['from_currency'])}\n\n"
+        f"Учесть все расходы?"
+    )
+    return "\n".join(lines)
+
+
+def bulk_expense_saved_text(trip: Dict, count: int) -> str:
+    """Сообщение об учтённых расходах с остатком"""
+    return (
+        f"✅ Учтено расходов: {count}\n\n"
+        f"💰 Остаток:\n"
+        f"   {format_amount(trip['balance_to'], trip['to_currency'])} = "
+        f"{format_amount(trip['balance_from'], trip['from_currency'])}"
+    )
+
+
+def rate_updated_text(trip: Dict, rate: Decimal) -> str:
+    """Сообщение об обновлённом курсе"""
+    return (
+        f"✅ Курс обновлён!\n\n"
+        f"Новый курс: 1 {trip['from_currency']} = {format_number(rate)} {trip['to_currency']}\n\n"
+        f"💰 Баланс пересчитан:\n"
+        f"   {format_amount(trip['balance_to'], trip['to_currency'])} = "
+        f"{format_amount(trip['balance_from'], trip['from_currency'])}"
+    )
@@ -0,0 +1,276 @@
+"""
+Приём обновлений Telegram через webhook
+
+Небольшой HTTP-сервер на стандартной библиотеке: принимает JSON обновлений
+(одно обновление или массив), проверяет заголовок
+X-Telegram-Bot-Api-Secret-Token и кладёт обновления во внутреннюю очередь.
+Отдельный поток забирает из очереди всё накопившееся (до batch_size) и
+передаёт пакетом в process — в bot.py это ShardedDispatcher, который
+раздаёт обновления обработчикам с сохранением порядка для пользователя.
+
+При остановке сервер перестаёт принимать запросы, дожидается уже
+принятых и передаёт в обработку всё, что осталось в очереди.
+
+Проверка локально — отправка записанных обновлений (по одному JSON
+на строку) на запущенный сервер:
+    python webhook.py replay updates.jsonl --url http://127.0.0.1:8443/webhook --secret ...
+"""
+import argparse
+import hmac
+import json
+import logging
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+from telebot import types
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Максимальный размер тела запроса (байт)
+MAX_BODY_SIZE = 1024 * 1024
+
+_STOP = object()
+
+
+class _Server(ThreadingHTTPServer):
+    # Потоки запросов не демонические: server_close() дожидается их завершения
+    daemon_threads = False
+
+    def __init__(self, address, handler, webhook: "WebhookServer"):
+        self.webhook = webhook
+        super().__init__(address, handler)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: _Server
+
+    def do_POST(self):
+        webhook = self.server.webhook
+        if self.path.split("?", 1)[0] != webhook.path:
+            self._reply(404)
+            return
+        if not webhook.check_secret(self.headers.get(SECRET_HEADER)):
+            webhook.count("unauthorized")
+            self._reply(403)
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_BODY_SIZE:
+            self._reply(413 if length > MAX_BODY_SIZE else 400)
+            return
+
+        try:
+            payload = json.loads(self.rfile.read(length))
+            updates = [types.Update.de_json(item)
+                       for item in (payload if isinstance(payload, list) else [payload])]
+        except (ValueError, TypeError, KeyError, AttributeError):
+            webhook.count("invalid")
+            self._reply(400)
+            return
+
+        # Telegram повторит запрос при ответе не 2xx
+        self._reply(200 if webhook.enqueue(updates) else 503)
+
+    def _reply(self, status: int):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+class WebhookServer:
+    def __init__(self, process: Callable[[list], None], host: str = "0.0.0.0",
+                 port: int = 8443, path: str = "/webhook",
+                 secret_token: Optional[str] = None, batch_size: int = 100,
+                 queue_size: int = 10000, put_timeout: float = 1.0):
+        """
+        Args:
+            process: Обработка пакета обновлений (например,
+                TeleBot.process_new_updates)
+            host, port: Адрес, на котором слушает сервер
+            path: Путь webhook
+            secret_token: Ожидаемое значение заголовка секрета; None —
+                без проверки (только для локальной отладки)
+            batch_size: Максимальный размер пакета, передаваемого в process
+            queue_size: Длина внутренней очереди обновлений
+            put_timeout: Сколько ждать места в очереди (сек), прежде чем
+                ответить 503
+        """
+        self._process = process
+        self.path = path
+        self.secret_token = secret_token
+        self.batch_size = batch_size
+        self.put_timeout = put_timeout
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        # Запросы ставят обновления в очередь по одному: место под пакет,
+        # найденное под этой блокировкой, не займёт другой запрос
+        self._enqueue_lock = threading.Lock()
+        self._httpd = _Server((host, port), _Handler, self)
+        self._lock = threading.Lock()
+        self._counters = {"received": 0, "processed": 0, "batches": 0,
+                          "rejected": 0, "unauthorized": 0, "invalid": 0, "failed": 0}
+        self._http_thread = threading.Thread(target=self._httpd.serve_forever,
+                                             name="webhook-http", daemon=True)
+        self._flush_thread = threading.Thread(target=self._run, name="webhook-flush", daemon=True)
+
+    @property
+    def address(self):
+        """Фактический адрес сервера (host, port) — полезно при port=0"""
+        return self._httpd.server_address
+
+    def check_secret(self, value: Optional[str]) -> bool:
+        if self.secret_token is None:
+            return True
+        return value is not None and hmac.compare_digest(value, self.secret_token)
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def enqueue(self, updates: List[types.Update]) -> bool:
+        """
+        Постановка обновлений во внутреннюю очередь — всех или ни одного
+
+        Пакет принимается, только если в очереди есть место под все его
+        обновления: при частичной постановке Telegram повторил бы запрос
+        целиком, и уже поставленные обновления обработались бы дважды.
+
+        Returns:
+            False, если места под пакет нет дольше put_timeout
+        """
+        deadline = time.monotonic() + self.put_timeout
+        with self._enqueue_lock:
+            # maxsize = 0 — очередь без ограничения
+            while 0 < self._queue.maxsize < self._queue.qsize() + len(updates):
+                if len(updates) > self._queue.maxsize or time.monotonic() >= deadline:
+                    self.count("rejected", len(updates))
+                    logger.warning("Очередь webhook переполнена, пакет из %d обновлений отклонён",
+                                   len(updates))
+                    return False
+                time.sleep(0.01)
+            # Очередь разбирает только поток _run, поэтому место не исчезнет
+            for update in updates:
+                self._queue.put_nowait(update)
+        self.count("received", len(updates))
+        return True
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            stop = item is _STOP
+            batch = [] if stop else [item]
+            # Забираем всё, что уже накопилось, не дожидаясь новых обновлений
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    continue
+                batch.append(item)
+            if batch:
+                self._flush(batch)
+            if stop and self._queue.empty():
+                return
+            if stop:
+                self._queue.put(_STOP)
+
+    def _flush(self, batch: list):
+        try:
+            self._process(batch)
+            self.count("processed", len(batch))
+            self.count("batches")
+        except Exception:
+            self.count("failed", len(batch))
+            logger.exception("Ошибка обработки пакета из %d обновлений", len(batch))
+
+    def start(self):
+        self._flush_thread.start()
+        self._http_thread.start()
+
+    def stop(self):
+        """
+        Плавная остановка: новые запросы не принимаются, принятые
+        обновления передаются в process до возврата из метода
+        """
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._queue.put(_STOP)
+        self._flush_thread.join()
+
+    def stats(self) -> Dict:
+        """Счётчики обновлений и текущая длина очереди"""
+        with self._lock:
+            return {**self._counters, "queue_depth": self._queue.qsize()}
+
+
+def replay(path: str, url: str, secret_token: Optional[str] = None,
+           batch_size: int = 1, delay: float = 0.0) -> Dict[int, int]:
+    """
+    Отправка записанных обновлений (JSON Lines) на webhook
+
+    Args:
+        path: Файл с обновлениями, по одному JSON на строку
+        url: Адрес webhook
+        secret_token: Значение заголовка секрета
+        batch_size: Сколько обновлений отправлять в одном запросе
+        delay: Пауза между запросами (сек)
+
+    Returns:
+        Число ответов по HTTP-статусам
+    """
+    import requests
+
+    headers = {SECRET_HEADER: secret_token} if secret_token else {}
+    statuses: Dict[int, int] = {}
+
+    def send(batch):
+        body = batch[0] if len(batch) == 1 else batch
+        status = requests.post(url, json=body, headers=headers, timeout=10).status_code
+        statuses[status] = statuses.get(status, 0) + 1
+
+    with open(path, encoding="utf-8") as f:
+        batch = []
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            batch.append(json.loads(line))
+            if len(batch) >= batch_size:
+                send(batch)
+                batch = []
+                if delay:
+                    time.sleep(delay)
+        if batch:
+            send(batch)
+    return statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Отправка записанных обновлений на webhook")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    replay_parser = subparsers.add_parser("replay", help="Отправить обновления из файла JSON Lines")
+    replay_parser.add_argument("file", help="Файл с обновлениями (по одному JSON на строку)")
+    replay_parser.add_argument("--url", default="http://127.0.0.1:8443/webhook", help="Адрес webhook")
+    replay_parser.add_argument("--secret", default=None, help="Секрет webhook")
+    replay_parser.add_argument("--batch-size", type=int, default=1,
+                               help="Обновлений в одном запросе")
+    replay_parser.add_argument("--delay", type=float, default=0.0,
+                               help="Пауза между запросами (сек)")
+    args = parser.parse_args()
+
+    statuses = replay(args.file, args.url, args.secret, args.batch_size, args.delay)
+    for status, count in sorted(statuses.items()):
+        print(f"HTTP {status}: {count}")
+
+
+if __name__ == "__main__":
+    main()